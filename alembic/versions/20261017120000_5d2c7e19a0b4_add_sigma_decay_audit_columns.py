@@ -0,0 +1,44 @@
+"""Add sigma decay audit columns
+
+Revision ID: 5d2c7e19a0b4
+Revises: a4f8c1d92b75
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "5d2c7e19a0b4"
+down_revision = "a4f8c1d92b75"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("player_decay", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("category_id", sa.String(), nullable=True))
+        batch_op.add_column(
+            sa.Column("rated_trueskill_sigma_before", sa.Float(), nullable=True)
+        )
+        batch_op.add_column(
+            sa.Column("rated_trueskill_sigma_after", sa.Float(), nullable=True)
+        )
+        batch_op.create_foreign_key(
+            batch_op.f("fk_player_decay_category_id_category"),
+            "category",
+            ["category_id"],
+            ["id"],
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("player_decay", schema=None) as batch_op:
+        batch_op.drop_constraint(
+            batch_op.f("fk_player_decay_category_id_category"), type_="foreignkey"
+        )
+        batch_op.drop_column("rated_trueskill_sigma_after")
+        batch_op.drop_column("rated_trueskill_sigma_before")
+        batch_op.drop_column("category_id")
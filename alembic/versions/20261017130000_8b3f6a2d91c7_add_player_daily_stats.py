@@ -0,0 +1,68 @@
+"""Add player daily stats
+
+Revision ID: 8b3f6a2d91c7
+Revises: 5d2c7e19a0b4
+Create Date: 2026-10-17 13:00:00.000000
+
+"""
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "8b3f6a2d91c7"
+down_revision = "5d2c7e19a0b4"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "player_daily_stats",
+        sa.Column("player_id", sa.BigInteger(), nullable=False),
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.Column("category_name", sa.String(), server_default="", nullable=False),
+        sa.Column("map_full_name", sa.String(), server_default="", nullable=False),
+        sa.Column("position_name", sa.String(), server_default="", nullable=False),
+        sa.Column(
+            "is_captain_pick",
+            sa.Boolean(),
+            server_default=sa.text("false"),
+            nullable=False,
+        ),
+        sa.Column("wins", sa.Integer(), server_default=sa.text("0"), nullable=False),
+        sa.Column("losses", sa.Integer(), server_default=sa.text("0"), nullable=False),
+        sa.Column("ties", sa.Integer(), server_default=sa.text("0"), nullable=False),
+        sa.Column("id", sa.String(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["player_id"],
+            ["player.id"],
+            name=op.f("fk_player_daily_stats_player_id_player"),
+        ),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_player_daily_stats")),
+        sa.UniqueConstraint(
+            "player_id",
+            "category_name",
+            "map_full_name",
+            "position_name",
+            "is_captain_pick",
+            "day",
+            name=op.f("uq_player_daily_stats_player_id"),
+        ),
+    )
+    with op.batch_alter_table("player_daily_stats", schema=None) as batch_op:
+        batch_op.create_index(
+            batch_op.f("ix_player_daily_stats_day"), ["day"], unique=False
+        )
+        batch_op.create_index(
+            batch_op.f("ix_player_daily_stats_player_id"), ["player_id"], unique=False
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("player_daily_stats", schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f("ix_player_daily_stats_player_id"))
+        batch_op.drop_index(batch_op.f("ix_player_daily_stats_day"))
+
+    op.drop_table("player_daily_stats")
@@ -0,0 +1,159 @@
+"""
+A write-behind buffer of when each player was last active and their display
+name, so every message in the bot's channels and every reaction doesn't cost
+a read-modify-commit on the player.
+
+record() only updates the buffer, and flush() writes everything buffered with
+one select, one bulk update and one insert. tasks.activity_flush_task flushes
+every ACTIVITY_FLUSH_SECONDS, and the bot flushes once more on shutdown.
+Anything that needs to know how recently a player was active, like the AFK
+timer, has to check last_activity_at() as well as the database.
+
+Players the bot hasn't seen before are still written straight away, since the
+command in the message that introduced them will expect their row to exist.
+"""
+
+import logging
+from datetime import datetime
+from typing import NamedTuple
+
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.orm import Session as SQLAlchemySession
+
+import discord_bots.config as config
+from discord_bots.async_db_utils import async_session
+from discord_bots.models import Player
+from discord_bots.utils import utc_now_naive
+
+_log = logging.getLogger(__name__)
+
+
+class Activity(NamedTuple):
+    # Naive UTC, like Player.last_activity_at
+    at: datetime
+    name: str
+
+
+_pending: dict[int, Activity] = {}
+# Players known to have a row, so their activity can wait for the next flush
+_known_player_ids: set[int] = set()
+
+
+def warm(session: SQLAlchemySession):
+    """
+    Load the id of every player. Called at bot setup.
+    """
+    _known_player_ids.clear()
+    _known_player_ids.update(session.scalars(select(Player.id)))
+    _log.info(f"[activity.warm] Loaded {len(_known_player_ids)} player ids")
+
+
+async def record(player_id: int, name: str):
+    """
+    Note that a player was just active with the given display name.
+
+    :param player_id: The player's discord id
+    :param name: Their display name, which their player is renamed to if it
+    changed
+    """
+    if player_id in _known_player_ids:
+        _pending[player_id] = Activity(utc_now_naive(), name)
+        return
+
+    async with async_session() as session:
+        player: Player | None = await session.get(Player, player_id)
+        if player:
+            player.last_activity_at = utc_now_naive()
+            if player.name != name:
+                player.name = name
+        else:
+            session.add(
+                Player(
+                    id=player_id,
+                    name=name,
+                    last_activity_at=utc_now_naive(),
+                    currency=config.STARTING_CURRENCY,
+                )
+            )
+        await session.commit()
+    _known_player_ids.add(player_id)
+
+
+def last_activity_at(player_id: int) -> datetime | None:
+    """
+    :returns: When the player was last active if that hasn't been flushed
+    yet, otherwise None
+    """
+    activity = _pending.get(player_id)
+    return activity.at if activity else None
+
+
+async def flush():
+    """
+    Write every buffered activity to the database. If that fails or is
+    cancelled the activity is buffered again, unless the player has been
+    active since.
+    """
+    global _pending
+    if not _pending:
+        return
+    pending, _pending = _pending, {}
+    try:
+        async with async_session() as session:
+            name_by_id: dict[int, str] = dict(
+                (
+                    await session.execute(
+                        select(Player.id, Player.name).where(
+                            Player.id.in_(pending.keys())
+                        )
+                    )
+                ).all()
+            )
+            if name_by_id:
+                # Through the table rather than the Player mapper, so a change
+                # that's only a timestamp doesn't look like a change to the
+                # players queue_status shows
+                player_table = Player.__table__
+                await session.execute(
+                    update(player_table)
+                    .where(player_table.c.id == bindparam("player_id"))
+                    .values(last_activity_at=bindparam("at")),
+                    [
+                        {"player_id": player_id, "at": pending[player_id].at}
+                        for player_id in name_by_id
+                    ],
+                )
+            renamed = [
+                {"id": player_id, "name": pending[player_id].name}
+                for player_id, name in name_by_id.items()
+                if name != pending[player_id].name
+            ]
+            if renamed:
+                await session.execute(update(Player), renamed)
+            session.add_all(
+                [
+                    Player(
+                        id=player_id,
+                        name=activity.name,
+                        last_activity_at=activity.at,
+                        currency=config.STARTING_CURRENCY,
+                    )
+                    for player_id, activity in pending.items()
+                    if player_id not in name_by_id
+                ]
+            )
+            await session.commit()
+    except BaseException as e:
+        # Including being cancelled on shutdown, so the last flush gets it
+        for player_id, activity in pending.items():
+            _pending.setdefault(player_id, activity)
+        if not isinstance(e, Exception):
+            raise
+        _log.exception(
+            f"[activity.flush] Failed to flush the activity of {len(pending)} players"
+        )
+        return
+    _known_player_ids.update(pending)
+    _log.debug(
+        f"[activity.flush] Flushed the activity of {len(pending)} players, {len(renamed)} renamed"
+    )
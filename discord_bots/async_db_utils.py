@@ -9,6 +9,7 @@ from typing import Any, AsyncGenerator, Callable, Optional, TypeVar
 
 from sqlalchemy import and_, delete, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
 
 from .models import AsyncSessionLocal
 
@@ -254,6 +255,37 @@ async def async_delete_where(
     return result.rowcount
 
 
+async def async_run_sync(
+    session: AsyncSession | Session,
+    fn: Callable[..., T],
+    *args,
+    **kwargs,
+) -> T:
+    """
+    Call a function that still takes a sync Session with whichever kind of
+    session the caller has. With an AsyncSession it runs through
+    AsyncSession.run_sync, so its queries go through the async driver and
+    don't block the event loop.
+
+    Args:
+        session: The session to use
+        fn: A function taking a sync Session as its first argument
+        *args, **kwargs: The rest of fn's arguments
+
+    Returns:
+        Whatever fn returns
+
+    Example:
+        async with async_session() as session:
+            rating = await async_run_sync(
+                session, rating_cache.get_any, player_id, category_id
+            )
+    """
+    if isinstance(session, AsyncSession):
+        return await session.run_sync(fn, *args, **kwargs)
+    return fn(session, *args, **kwargs)
+
+
 def run_async_in_sync(async_func: Callable[..., Any], *args, **kwargs):
     """
     Helper to run async functions in sync code during migration.
@@ -1,13 +1,41 @@
 # This file exists to avoid a circular reference
 
+from functools import cached_property
+
 import discord
 from discord.ext import commands
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.session import Session as SQLAlchemySession
+
 import discord_bots.config as config
+from discord_bots.models import AsyncSessionLocal, Session
 
 intents = discord.Intents.all()  # TODO: should manually specify each intent
 intents.members = True
 
-bot = commands.Bot(
+
+class Context(commands.Context):
+    """
+    Opens a prefix command's database sessions the first time the command
+    uses them, instead of for every command. after_invoke closes the ones
+    that were opened.
+    """
+
+    @cached_property
+    def session(self) -> SQLAlchemySession:
+        return Session()
+
+    @cached_property
+    def asyncSession(self) -> AsyncSession:
+        return AsyncSessionLocal()
+
+
+class Bot(commands.Bot):
+    async def get_context(self, origin, /, *, cls=Context):
+        return await super().get_context(origin, cls=cls)
+
+
+bot = Bot(
     case_insensitive=True,
     command_prefix=config.COMMAND_PREFIX,
     help_command=commands.DefaultHelpCommand(
@@ -27,6 +27,7 @@ from discord_bots.cogs.in_progress_game import (
     InProgressGameCommands,
     InProgressGameView,
 )
+from discord_bots.dispatcher import Priority
 from discord_bots.models import (
     Config,
     DraftPick,
@@ -46,7 +47,7 @@ from discord_bots.names import generate_be_name, generate_ds_name
 from discord_bots.utils import (
     create_in_progress_game_embed,
     execute_map_rotation,
-    get_category_trueskill,
+    get_category_ratings,
     get_team_voice_channels,
     mean,
     move_game_players,
@@ -89,37 +90,31 @@ def picker_for_pick(pick_number: int, first_picker_team: int) -> int:
 # ─────────────────────────────────────────────────────────────────────────────
 
 
-def _player_rating(
+def _player_ratings(
     session: SQLAlchemySession,
     db_config: Config,
-    player: Player,
+    players: list[Player],
     queue: Queue,
     map_id: str,
-) -> tuple[float, float]:
-    """Return (mu, sigma) for a player, respecting category/map trueskill."""
+) -> dict[int, tuple[float, float]]:
+    """Return (mu, sigma) by player id, respecting category/map trueskill."""
     if queue.category_id:
-        pct = get_category_trueskill(
+        ratings = get_category_ratings(
             session,
             db_config,
-            player.id,
+            [(player.id, None) for player in players],
             queue.map_trueskill_enabled,
             queue.category_id,
             map_id,
-            None,
         )
-        return pct.mu, pct.sigma
-    return player.rated_trueskill_mu, player.rated_trueskill_sigma
-
-
-def _player_rank(
-    session: SQLAlchemySession,
-    db_config: Config,
-    player: Player,
-    queue: Queue,
-    map_id: str,
-) -> float:
-    mu, sigma = _player_rating(session, db_config, player, queue, map_id)
-    return mu - 3 * sigma
+        return {
+            player.id: (rating.mu, rating.sigma)
+            for player, rating in zip(players, ratings)
+        }
+    return {
+        player.id: (player.rated_trueskill_mu, player.rated_trueskill_sigma)
+        for player in players
+    }
 
 
 def select_captains(
@@ -136,11 +131,13 @@ def select_captains(
     captain_b is the lower-rated.
     """
     db_config: Config = session.query(Config).first()
+    ratings = _player_ratings(session, db_config, players, queue, map_id)
+    # Rank is mu - 3*sigma
     sorted_players = sorted(
         players,
         key=lambda p: (
-            -_player_rank(session, db_config, p, queue, map_id),
-            -_player_rating(session, db_config, p, queue, map_id)[0],
+            -(ratings[p.id][0] - 3 * ratings[p.id][1]),
+            -ratings[p.id][0],
             p.id,
         ),
     )
@@ -334,9 +331,8 @@ async def start_draft(
 
     # Use mu (or category mu) average for InProgressGame.average_trueskill so
     # downstream code that reads it still works.
-    all_mus = [
-        _player_rating(session, db_config, p, queue, next_map.id)[0] for p in players
-    ]
+    ratings = _player_ratings(session, db_config, players, queue, next_map.id)
+    all_mus = [ratings[p.id][0] for p in players]
     average_trueskill = mean(all_mus)
 
     game = InProgressGame(
@@ -479,11 +475,20 @@ async def finalize_draft(game_id: str) -> None:
 
         team0_ratings: list[Rating] = []
         team1_ratings: list[Rating] = []
+        players: list[Player] = (
+            session.query(Player)
+            .filter(Player.id.in_([igp.player_id for igp in igps]))
+            .all()
+        )
+        ratings: dict[int, tuple[float, float]] = (
+            _player_ratings(session, db_config, players, queue, game.map_id)
+            if queue is not None
+            else {}
+        )
         for igp in igps:
-            player = session.query(Player).filter(Player.id == igp.player_id).first()
-            if not player or queue is None:
+            if igp.player_id not in ratings:
                 continue
-            mu, sigma = _player_rating(session, db_config, player, queue, game.map_id)
+            mu, sigma = ratings[igp.player_id]
             rating = Rating(mu=mu, sigma=sigma)
             if igp.team == 0:
                 team0_ratings.append(rating)
@@ -552,6 +557,7 @@ async def finalize_draft(game_id: str) -> None:
                             igp.player_id,
                             message_content=voice.jump_url,
                             embed=embed,
+                            priority=Priority.POP,
                         )
                     )
             if send_message_coroutines:
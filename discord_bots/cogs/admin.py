@@ -13,6 +13,7 @@ from sqlalchemy import delete
 from sqlalchemy.orm.session import Session as SQLAlchemySession
 
 import discord_bots.config as config
+import discord_bots.daily_stats as daily_stats
 from discord_bots.async_db_utils import (
     async_delete_where,
     async_query_first,
@@ -345,6 +346,7 @@ class AdminCommands(BaseCog):
                     ephemeral=True,
                 )
                 return
+            daily_stats.remove_game(session, finished_game)
             session.query(FinishedGamePlayer).filter(
                 FinishedGamePlayer.finished_game_id == finished_game.id
             ).delete()
@@ -438,11 +440,11 @@ class AdminCommands(BaseCog):
                 return
             outcome_lower = outcome.lower()
             if outcome_lower == "tie":
-                game.winning_team = -1
+                winning_team = -1
             elif outcome_lower == "be":
-                game.winning_team = 0
+                winning_team = 0
             elif outcome_lower == "ds":
-                game.winning_team = 1
+                winning_team = 1
             else:
                 await interaction.response.send_message(
                     embed=Embed(
@@ -453,6 +455,16 @@ class AdminCommands(BaseCog):
                 )
                 return
 
+            if winning_team != game.winning_team:
+                # Move the game's result in its players' daily counters too
+                finished_game_players: list[FinishedGamePlayer] = (
+                    session.query(FinishedGamePlayer)
+                    .filter(FinishedGamePlayer.finished_game_id == game.id)
+                    .all()
+                )
+                daily_stats.record_game(session, game, finished_game_players, sign=-1)
+                game.winning_team = winning_team
+                daily_stats.record_game(session, game, finished_game_players)
             session.add(game)
             await interaction.response.send_message(
                 embed=Embed(
@@ -5,9 +5,17 @@ from discord.ext.commands import Bot
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.orm.session import Session as SQLAlchemySession
 
+import discord_bots.rank_index as rank_index
+import discord_bots.rating_cache as rating_cache
 from discord_bots.checks import is_admin_app_command, is_command_or_captain_channel
 from discord_bots.cogs.base import BaseCog
-from discord_bots.models import Category, PlayerCategoryTrueskill, Queue, Session
+from discord_bots.models import (
+    Category,
+    PlayerCategoryTrueskill,
+    PlayerDecay,
+    Queue,
+    Session,
+)
 from discord_bots.utils import build_category_str, default_sigma_decay_amount
 from discord_bots.views.configure_category import CategoryConfigureView
 
@@ -98,9 +106,13 @@ class CategoryCommands(BaseCog):
                     ephemeral=True,
                 )
                 return
+            category_id = category.id
             session.query(PlayerCategoryTrueskill).filter(
                 category.id == PlayerCategoryTrueskill.category_id
             ).delete()
+            session.query(PlayerDecay).filter(
+                category.id == PlayerDecay.category_id
+            ).update({PlayerDecay.category_id: None})
             session.delete(category)
             await interaction.response.send_message(
                 embed=Embed(
@@ -109,6 +121,8 @@ class CategoryCommands(BaseCog):
                 )
             )
             session.commit()
+            rating_cache.invalidate(category_id=category_id)
+            rank_index.reload_category(session, category_id)
 
     @group.command(name="show", description="Show category details")
     @app_commands.check(is_command_or_captain_channel)
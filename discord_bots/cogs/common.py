@@ -1,23 +1,21 @@
 import asyncio
 import logging
-from bisect import bisect
-from datetime import datetime, timedelta, timezone
-from typing import List, Optional
+from typing import Optional
 
 from discord import Colour, Embed, Interaction, Message, TextChannel, app_commands
 from discord.ext.commands import Bot
 from sqlalchemy.orm.session import Session as SQLAlchemySession
 from table2ascii import Alignment, PresetStyle, table2ascii
-from trueskill import Rating
 
+import discord_bots.daily_stats as daily_stats
+import discord_bots.rank_index as rank_index
+import discord_bots.rating_cache as rating_cache
 from discord_bots.checks import is_command_or_captain_channel
 from discord_bots.cogs.base import BaseCog
 from discord_bots.config import SHOW_TRUESKILL
 from discord_bots.models import (
     Category,
     Config,
-    FinishedGame,
-    FinishedGamePlayer,
     InProgressGame,
     InProgressGamePlayer,
     Map,
@@ -233,29 +231,11 @@ class CommonCommands(BaseCog):
                 )
                 return
 
-            fgps: List[FinishedGamePlayer] | None = (
-                session.query(FinishedGamePlayer)
-                .filter(FinishedGamePlayer.player_id == player.id)
-                .all()
-            )
-            if not fgps:
-                await interaction.response.send_message(
-                    embed=Embed(
-                        description="You have not played any games",
-                        colour=Colour.blue(),
-                    ),
-                    ephemeral=True,
-                )
-                return
-
-            finished_game_ids: List[str] | None = [fgp.finished_game_id for fgp in fgps]
-            fgs: List[FinishedGame] | None = (
-                session.query(FinishedGame)
-                .filter(FinishedGame.id.in_(finished_game_ids))
-                .filter(FinishedGame.is_captain_pick == False)
-                .all()
-            )
-            if not fgs:
+            if not any(
+                daily_stats.wins_losses_ties(
+                    session, player.id, [None], is_captain_pick=False
+                )[0]
+            ):
                 await interaction.response.send_message(
                     embed=Embed(
                         description="You have not played any games",
@@ -263,102 +243,41 @@ class CommonCommands(BaseCog):
                     ),
                     ephemeral=True,
                 )
-                session.close()
                 return
 
-            fgps_by_finished_game_id: dict[str, FinishedGamePlayer] = {
-                fgp.finished_game_id: fgp for fgp in fgps
-            }
-
-            players: list[Player] = session.query(Player).all()
-
-            default_rating = Rating()
-            # Filter players that haven't played a game
-            players = list(
-                filter(
-                    lambda x: (
-                        x.rated_trueskill_mu != default_rating.mu
-                        and x.rated_trueskill_sigma != default_rating.sigma
-                    )
-                    and (
-                        x.rated_trueskill_mu != config.default_trueskill_mu
-                        and x.rated_trueskill_sigma != config.default_trueskill_sigma
-                    ),
-                    players,
-                )
-            )
-            trueskills = list(
-                sorted(
-                    [
-                        round(p.rated_trueskill_mu - 3 * p.rated_trueskill_sigma, 2)
-                        for p in players
-                    ]
-                )
-            )
-            trueskill_index = bisect(
-                trueskills,
-                round(player.rated_trueskill_mu - 3 * player.rated_trueskill_sigma, 2),
-            )
-            trueskill_ratio = (len(trueskills) - trueskill_index) / (
-                len(trueskills) or 1
-            )
-            if trueskill_ratio <= 0.05:
-                trueskill_pct = "Top 5%"
-            elif trueskill_ratio <= 0.10:
-                trueskill_pct = "Top 10%"
-            elif trueskill_ratio <= 0.25:
-                trueskill_pct = "Top 25%"
-            elif trueskill_ratio <= 0.50:
-                trueskill_pct = "Top 50%"
-            elif trueskill_ratio <= 0.75:
-                trueskill_pct = "Top 75%"
-            else:
-                trueskill_pct = "Top 100%"
-
-            # all of this below can probably be done more gracefull with a pandas dataframe
-            def wins_losses_ties_last_ndays(
-                finished_games: List[FinishedGame], n: int = -1
-            ) -> tuple[list[FinishedGame], list[FinishedGame], list[FinishedGame]]:
-                if n == -1:
-                    # all finished games
-                    last_nfgs = finished_games
+            def top_percent(ratio: float) -> str:
+                if ratio <= 0.05:
+                    return "Top 5%"
+                elif ratio <= 0.10:
+                    return "Top 10%"
+                elif ratio <= 0.25:
+                    return "Top 25%"
+                elif ratio <= 0.50:
+                    return "Top 50%"
+                elif ratio <= 0.75:
+                    return "Top 75%"
                 else:
-                    # last n
-                    last_nfgs = [
-                        fg
-                        for fg in finished_games
-                        if fg.finished_at.replace(tzinfo=timezone.utc)
-                        > datetime.now(timezone.utc) - timedelta(days=n)
-                    ]
-                wins = [
-                    fg
-                    for fg in last_nfgs
-                    if fg.winning_team == fgps_by_finished_game_id[fg.id].team
-                ]
-                losses = [
-                    fg
-                    for fg in last_nfgs
-                    if fg.winning_team != fgps_by_finished_game_id[fg.id].team
-                    and fg.winning_team != -1
-                ]
-                ties = [fg for fg in last_nfgs if fg.winning_team == -1]
-                return wins, losses, ties
+                    return "Top 100%"
 
             def win_rate(wins, losses, ties):
                 denominator = max(wins + losses + ties, 1)
                 return round(100 * (wins + 0.5 * ties) / denominator, 1)
 
-            def get_table_col(games: List[FinishedGame]):
+            def get_table_col(**filters):
                 cols = []
-                for num_days in [7, 30, 90, 365, -1]:
-                    wins, losses, ties = wins_losses_ties_last_ndays(games, num_days)
-                    num_wins, num_losses, num_ties = len(wins), len(losses), len(ties)
+                periods = [7, 30, 90, 365, None]
+                for num_days, (num_wins, num_losses, num_ties) in zip(
+                    periods,
+                    daily_stats.wins_losses_ties(
+                        session, player.id, periods, **filters
+                    ),
+                ):
                     winrate = round(win_rate(num_wins, num_losses, num_ties))
                     col = [
-                        "Total" if num_days == -1 else f"{num_days}D",
-                        len(wins),
-                        len(losses),
-                        len(ties),
+                        "Total" if num_days is None else f"{num_days}D",
+                        num_wins,
+                        num_losses,
+                        num_ties,
                         num_wins + num_losses + num_ties,
                         f"{winrate}%",
                     ]
@@ -366,7 +285,10 @@ class CommonCommands(BaseCog):
                 return cols
 
             message_content = ""  # TODO: temp fix
-            footer_text = f"-# Rank = {MU_LOWER_UNICODE} - 3*{SIGMA_LOWER_UNICODE}"
+            footer_text = (
+                f"-# Rank = {MU_LOWER_UNICODE} - 3*{SIGMA_LOWER_UNICODE}\n"
+                "-# 7D etc. count whole days in UTC, today included"
+            )
             cols = []
             conditions = []
             conditions.append(PlayerCategoryTrueskill.player_id == player.id)
@@ -387,25 +309,55 @@ class CommonCommands(BaseCog):
                 first_message_sent = False
                 count = 0
                 categories = sorted(categories, key=lambda x: x.name)
-                for i_category, category in enumerate(categories):
-                    player_category_trueskills = (
-                        session.query(PlayerCategoryTrueskill, Map, Position)
-                        .join(
-                            Map, Map.id == PlayerCategoryTrueskill.map_id, isouter=True
-                        )
-                        .join(
-                            Position,
-                            Position.id == PlayerCategoryTrueskill.position_id,
-                            isouter=True,
-                        )
-                        .filter(
-                            PlayerCategoryTrueskill.category_id == category.id,
-                            PlayerCategoryTrueskill.player_id == player.id,
+                ratings_by_category_id = {
+                    category.id: rating_cache.get_all(session, player.id, category.id)
+                    for category in categories
+                }
+                map_ids = {
+                    map_id
+                    for ratings in ratings_by_category_id.values()
+                    for map_id, _ in ratings
+                    if map_id
+                }
+                position_ids = {
+                    position_id
+                    for ratings in ratings_by_category_id.values()
+                    for _, position_id in ratings
+                    if position_id
+                }
+                maps_by_id: dict[str, Map] = (
+                    {
+                        map.id: map
+                        for map in session.query(Map).filter(Map.id.in_(map_ids))
+                    }
+                    if map_ids
+                    else {}
+                )
+                positions_by_id: dict[str, Position] = (
+                    {
+                        position.id: position
+                        for position in session.query(Position).filter(
+                            Position.id.in_(position_ids)
                         )
-                        .all()
-                    )
+                    }
+                    if position_ids
+                    else {}
+                )
+                for i_category, category in enumerate(categories):
+                    # (rating, map, position, map_id, position_id)
                     player_category_trueskills = sorted(
-                        player_category_trueskills,
+                        (
+                            (
+                                rating,
+                                maps_by_id.get(map_id),
+                                positions_by_id.get(position_id),
+                                map_id,
+                                position_id,
+                            )
+                            for (map_id, position_id), rating in (
+                                ratings_by_category_id[category.id].items()
+                            )
+                        ),
                         key=lambda x: (
                             x[1].full_name if x[1] else "",
                             x[2].name if x[2] else "",
@@ -421,28 +373,21 @@ class CommonCommands(BaseCog):
                             lambda x: x[2] is None,
                             player_category_trueskills,
                         )
-                    for pct, map, position in player_category_trueskills:
+                    for (
+                        pct,
+                        map,
+                        position,
+                        map_id,
+                        position_id,
+                    ) in player_category_trueskills:
                         title = f"TrueSkill for {category.name}"
-                        category_filters = [
-                            FinishedGamePlayer.player_id == player.id,
-                            FinishedGame.category_name == category.name,
-                        ]
+                        category_filters = {"category_name": category.name}
                         if map:
                             title = f"{title} ({map.full_name})"
-                            category_filters.append(
-                                FinishedGame.map_full_name == map.full_name
-                            )
+                            category_filters["map_full_name"] = map.full_name
                         if position:
                             title = f"{title} ({position.short_name})"
-                            category_filters.append(
-                                FinishedGamePlayer.position_name == position.short_name
-                            )
-                        category_games = (
-                            session.query(FinishedGame)
-                            .join(FinishedGamePlayer)
-                            .filter(*category_filters)
-                            .all()
-                        )
+                            category_filters["position_name"] = position.short_name
                         if category.is_rated and SHOW_TRUESKILL:
                             description = (
                                 f"`Rank: {round(pct.rank, 1)}`,"
@@ -450,12 +395,15 @@ class CommonCommands(BaseCog):
                                 f"`{SIGMA_LOWER_UNICODE}: {round(pct.sigma, 1)}` "
                             )
                         else:
-                            description = f"Rating: {trueskill_pct}"
+                            trueskill_ratio = rank_index.top_ratio(
+                                category.id, pct.rank, map_id, position_id
+                            )
+                            description = f"Rating: {top_percent(trueskill_ratio)}"
 
                         message_content += f"\n{title}\n{description}"  # TODO: temp fix
                         count += 1
 
-                        cols = get_table_col(category_games)
+                        cols = get_table_col(**category_filters)
                         table = table2ascii(
                             header=["Last", "W", "L", "T", "Total", "WR"],
                             body=cols,
@@ -501,8 +449,11 @@ class CommonCommands(BaseCog):
                         f"`{SIGMA_LOWER_UNICODE}: {round(player.rated_trueskill_sigma, 1)}` "
                     )
                 else:
-                    description = f"Rating: {trueskill_pct}"
-                cols = get_table_col(fgs)
+                    trueskill_ratio = rank_index.global_top_ratio(
+                        player.rated_trueskill_mu - 3 * player.rated_trueskill_sigma
+                    )
+                    description = f"Rating: {top_percent(trueskill_ratio)}"
+                cols = get_table_col(is_captain_pick=False)
                 table = table2ascii(
                     header=["Period", "Wins", "Losses", "Ties", "Total", "Win %"],
                     body=cols,
@@ -1,5 +1,7 @@
 import logging
+from asyncio import Future
 from datetime import datetime, timedelta, timezone
+from functools import partial
 from operator import itemgetter
 from typing import Any, Literal, Optional
 
@@ -12,7 +14,6 @@ from discord import (
     Message,
     TextChannel,
     TextStyle,
-    VoiceChannel,
     app_commands,
 )
 from discord.ext.commands import Bot
@@ -38,23 +39,66 @@ from discord_bots.config import (
     GAME_HISTORY_CHANNEL,
     PREDICTION_TIMEOUT,
 )
+from discord_bots.dispatcher import Priority, channel_route, dispatcher
 from discord_bots.models import (
     EconomyDonation,
     EconomyPrediction,
     EconomyTransaction,
     FinishedGame,
     InProgressGame,
-    InProgressGameChannel,
     InProgressGamePlayer,
     Player,
     Queue,
     Session,
 )
+from discord_bots.prediction_totals import (
+    TeamTotal,
+    load_totals,
+    mark_dirty,
+    mark_edited,
+    take_dirty,
+)
 from discord_bots.utils import short_uuid
 
 _log = logging.getLogger(__name__)
 
 
+def prediction_embed(
+    game: InProgressGame,
+    team0: TeamTotal = TeamTotal(0, 0),
+    team1: TeamTotal = TeamTotal(0, 0),
+) -> Embed:
+    team0_ratio = "1.0"
+    team1_ratio = "1.0"
+    if not team0.total + team1.total == 0:
+        if not team0.total == 0:
+            team0_ratio = f"{round(1/(team0.total / (team0.total + team1.total)), 1)}"
+        if not team1.total == 0:
+            team1_ratio = f"{round(1/(team1.total / (team1.total + team0.total)), 1)}"
+
+    embed = Embed(
+        title=f"Game {short_uuid(game.id)} Prediction",
+        colour=Colour.blue(),
+    )
+    embed.add_field(
+        name=f"{game.team0_name}",
+        value=f"> Total: {team0.total}\n> Win Ratio: 1:{team0_ratio}\n> Predictors: {team0.predictors}",
+        inline=True,
+    )
+    embed.add_field(
+        name=f"{game.team1_name}",
+        value=f"> Total: {team1.total}\n> Win Ratio: 1:{team1_ratio}\n> Predictors: {team1.predictors}",
+        inline=True,
+    )
+    return embed
+
+
+def _mark_dirty_if_failed(game_id: str, edit: Future):
+    # So the edit is tried again next time
+    if edit.cancelled() or edit.exception():
+        mark_dirty(game_id)
+
+
 class EconomyCommands(BaseCog):
     def __init__(self, bot: Bot) -> None:
         super().__init__(bot)
@@ -277,30 +321,16 @@ class EconomyCommands(BaseCog):
         if not ECONOMY_ENABLED:
             return None
 
-        short_game_id: str = short_uuid(in_progress_game.id)
-        embed = Embed(
-            title=f"Game {short_game_id} Prediction",
-            colour=Colour.blue(),
-        )
-        embed.add_field(
-            name=f"{in_progress_game.team0_name}",
-            value="> Total: 0\n> Win Ratio: 1:1.0\n> Predictors: 0",
-            inline=True,
-        )
-        embed.add_field(
-            name=f"{in_progress_game.team1_name}",
-            value="> Total: 0\n> Win Ratio: 1:1.0\n> Predictors: 0",
-            inline=True,
-        )
-
         try:
             prediction_message: Message = await match_channel.send(
-                embed=embed, view=EconomyPredictionView(in_progress_game.id)
+                embed=prediction_embed(in_progress_game),
+                view=EconomyPredictionView(in_progress_game.id),
             )
         except Exception:
             _log.exception(f"prediction failed for game: {in_progress_game.id}")
             return None
         else:
+            mark_edited(in_progress_game.id)
             return prediction_message.id
 
     async def create_prediction(
@@ -811,72 +841,41 @@ class EconomyCommands(BaseCog):
                 )
 
     async def update_embeds(self, in_progress_games: list[InProgressGame]):
+        """
+        Edit the prediction embeds of the games whose totals changed since
+        they were last edited, see prediction_totals
+        """
+        games: dict[str, InProgressGame] = {
+            game.id: game
+            for game in in_progress_games
+            if game.prediction_message_id and game.channel_id
+        }
+        game_ids = take_dirty(games)
+        if not game_ids:
+            return
+
         session: SQLAlchemySession
         with Session() as session:
-            for game in in_progress_games:
-                if not game.prediction_message_id:
-                    continue
-                igp_channels: list[InProgressGameChannel] = (
-                    session.query(InProgressGameChannel)
-                    .filter(InProgressGameChannel.in_progress_game_id == game.id)
-                    .all()
-                )
-                for igp_channel in igp_channels:
-                    channel: TextChannel | VoiceChannel = bot.get_channel(
-                        igp_channel.channel_id
-                    )
-                    if type(channel) == TextChannel:
-                        message: Message = channel.get_partial_message(
-                            game.prediction_message_id
-                        )
-                        if message:
-                            message = await message.fetch()
-                        else:
-                            message = await channel.fetch_message(
-                                game.prediction_message_id
-                            )
-
-                        predictions: list[EconomyPrediction] = (
-                            session.query(EconomyPrediction)
-                            .filter(EconomyPrediction.in_progress_game_id == game.id)
-                            .all()
-                        )
-
-                        team0_total: int = 0
-                        team0_predictors: list[str] = []
-                        team1_total: int = 0
-                        team1_predictors: list[str] = []
-                        for prediction in predictions:
-                            if prediction.team == 0:
-                                team0_total += prediction.prediction_value
-                                if not prediction.player_id in team0_predictors:
-                                    team0_predictors.append(prediction.player_id)
-                            else:
-                                team1_total += prediction.prediction_value
-                                if not prediction.player_id in team1_predictors:
-                                    team1_predictors.append(prediction.player_id)
-
-                        team0_ratio = "1.0"
-                        team1_ratio = "1.0"
-                        if not team0_total + team1_total == 0:
-                            if not team0_total == 0:
-                                team0_ratio = f"{round(1/(team0_total / (team0_total + team1_total)), 1)}"
-                            if not team1_total == 0:
-                                team1_ratio = f"{round(1/(team1_total / (team1_total + team0_total)), 1)}"
-
-                        embed: Embed = message.embeds[0]
-                        embed.set_field_at(
-                            index=0,
-                            name=embed.fields[0].name,
-                            value=f"> Total: {team0_total}\n> Win Ratio: 1:{team0_ratio}\n> Predictors: {len(team0_predictors)}",
-                        )
-                        embed.set_field_at(
-                            index=1,
-                            name=embed.fields[1].name,
-                            value=f"> Total: {team1_total}\n> Win Ratio: 1:{team1_ratio}\n> Predictors: {len(team1_predictors)}",
-                        )
-
-                        await message.edit(embed=embed)
+            totals = load_totals(session, game_ids)
+
+        for game_id, (team0, team1) in totals.items():
+            game = games[game_id]
+            channel = bot.get_channel(game.channel_id)
+            if type(channel) != TextChannel:
+                # Not cached yet, try again next time
+                mark_dirty(game_id)
+                continue
+            # The embed is rebuilt from the totals, so the message doesn't
+            # have to be fetched first
+            message = channel.get_partial_message(game.prediction_message_id)
+            # Only the latest edit is sent if they back up
+            edit = dispatcher.submit(
+                channel_route(channel.id),
+                partial(message.edit, embed=prediction_embed(game, team0, team1)),
+                Priority.BACKGROUND,
+                key=("edit", message.id),
+            )
+            edit.add_done_callback(partial(_mark_dirty_if_failed, game_id))
 
 
 class EconomyPredictionView(View):
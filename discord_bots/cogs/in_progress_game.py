@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import asyncio
 import logging
+import time
 from datetime import datetime, timedelta, timezone
 from typing import TYPE_CHECKING, Literal, Optional
 
@@ -20,10 +21,17 @@ from discord import (
 from discord.abc import GuildChannel
 from discord.ext import commands
 from discord.ui import Button, button
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm.session import Session as SQLAlchemySession
 from trueskill import Rating, rate
 
-from discord_bots import config
+from discord_bots import config, daily_stats, game_index
+from discord_bots.async_db_utils import (
+    async_delete_where,
+    async_query_first,
+    async_session,
+)
 from discord_bots.checks import is_admin_app_command, is_command_or_captain_channel
 from discord_bots.cogs.economy import EconomyCommands
 from discord_bots.models import (
@@ -48,13 +56,14 @@ from discord_bots.utils import (
     create_cancelled_game_embed,
     create_finished_game_embed,
     finished_game_str,
-    get_category_trueskill,
+    get_category_trueskills,
     get_n_best_finished_game_teams,
     get_n_best_teams,
     get_n_worst_finished_game_teams,
     get_n_worst_teams,
     in_progress_game_autocomplete,
     in_progress_game_str,
+    load_finished_game_bundles,
     mock_finished_game_teams_str,
     mock_teams_str,
     move_game_players,
@@ -82,6 +91,7 @@ class InProgressGameCommands(commands.Cog):
     group = app_commands.Group(name="game", description="Game commands")
 
     async def cog_load(self) -> None:
+        start = time.perf_counter()
         session: SQLAlchemySession
         with Session() as session:
             in_progress_games: list[InProgressGame] = session.query(
@@ -94,6 +104,10 @@ class InProgressGameCommands(commands.Cog):
                         InProgressGameView(game.id, self),
                         message_id=game.message_id,
                     )
+        if config.PROFILE_STARTUP:
+            _log.info(
+                f"[cog_load] Restored the views of {len(self.views)} in progress games in {time.perf_counter() - start:.3f}s"
+            )
 
     async def cog_unload(self) -> None:
         for view in self.views:
@@ -252,6 +266,7 @@ class InProgressGameCommands(commands.Cog):
         session.query(InProgressGamePlayer).filter(
             InProgressGamePlayer.in_progress_game_id == game.id
         ).delete()
+        game_index.remove_game(session, game.id)
         session.commit()  # if you remove this commit, then there is a chance for the DB to lockup if someone types a message at the same time
 
         if config.ENABLE_VOICE_MOVE and config.VOICE_MOVE_LOBBY:
@@ -325,10 +340,15 @@ class InProgressGameCommands(commands.Cog):
 
             embeds = []
             finished_games.reverse()  # show most recent games last
+            bundles = load_finished_game_bundles(session, finished_games)
             for finished_game in finished_games:
                 # TODO: bold the callers name to make their name easier to see in the embed
                 embed: Embed = create_finished_game_embed(
-                    session, finished_game.id, interaction.guild.id
+                    session,
+                    finished_game.id,
+                    interaction.guild.id,
+                    finished_game=finished_game,
+                    bundle=bundles[finished_game.id],
                 )
                 embed.timestamp = finished_game.finished_at
                 embeds.append(embed)
@@ -368,10 +388,9 @@ class InProgressGameCommands(commands.Cog):
                 ephemeral=True,
             )
         async with _lock:
-            session: SQLAlchemySession
-            with Session() as session:
-                result = self.get_player_and_in_progress_game(
-                    session, interaction.user.id, game_id
+            async with async_session() as session:
+                result = await session.run_sync(
+                    self.get_player_and_in_progress_game, interaction.user.id, game_id
                 )
                 if result is None:
                     embed = Embed(
@@ -401,12 +420,12 @@ class InProgressGameCommands(commands.Cog):
                 is_game_finished = await self.finish_in_progress_game(
                     session, interaction, outcome, game_player, game
                 )
-                session.commit()
+                await session.commit()
                 return is_game_finished
 
     async def finish_in_progress_game(
         self,
-        session: SQLAlchemySession,
+        session: AsyncSession,
         interaction: Interaction,
         outcome: Literal["win", "loss", "tie"],
         game_player: InProgressGamePlayer,
@@ -414,8 +433,8 @@ class InProgressGameCommands(commands.Cog):
     ) -> bool:
         assert interaction is not None
         assert interaction.guild is not None
-        queue: Queue | None = (
-            session.query(Queue).filter(Queue.id == in_progress_game.queue_id).first()
+        queue: Queue | None = await async_query_first(
+            session, Queue, Queue.id == in_progress_game.queue_id
         )
         if not queue:
             # should never happen
@@ -440,6 +459,124 @@ class InProgressGameCommands(commands.Cog):
             # tie
             winning_team = -1
 
+        if queue.category_id:
+            category: Category | None = await async_query_first(
+                session, Category, Category.id == queue.category_id
+            )
+            if category:
+                category_name = category.name
+            else:
+                # should never happen
+                _log.error(
+                    f"Could not find category with id {queue.category_id} for queue with id {queue.id}"
+                )
+                await interaction.followup.send(
+                    embed=Embed(
+                        description="Something went wrong, please contact the server owner",
+                        color=Colour.red(),
+                    ),
+                    ephemeral=True,
+                )
+                return False
+        else:
+            category_name = None
+
+        # Rating the game is still written for a sync Session, run_sync keeps
+        # its queries off the event loop
+        finished_game, players = await session.run_sync(
+            self._record_finished_game,
+            queue,
+            in_progress_game,
+            winning_team,
+            category_name,
+        )
+        if config.ECONOMY_ENABLED and not queue.is_captain_pick:
+            economy_cog = self.bot.get_cog("EconomyCommands")
+            if economy_cog is not None and isinstance(economy_cog, EconomyCommands):
+                await economy_cog.resolve_predictions(
+                    interaction, outcome, in_progress_game.id
+                )
+            else:
+                _log.warning("Could not get EconomyCommands cog")
+
+        await async_delete_where(
+            session,
+            InProgressGamePlayer,
+            InProgressGamePlayer.in_progress_game_id == in_progress_game.id,
+        )
+        game_index.remove_game(session, in_progress_game.id)
+        in_progress_game.is_finished = True
+        session.add(
+            QueueWaitlist(
+                channel_id=config.CHANNEL_ID,  # not sure about this column and what it's used for
+                finished_game_id=finished_game.id,
+                in_progress_game_id=in_progress_game.id,
+                guild_id=interaction.guild_id,
+                queue_id=queue.id,
+                end_waitlist_at=datetime.now(timezone.utc)
+                + timedelta(seconds=config.RE_ADD_DELAY),
+            )
+        )
+
+        # Reward raffle tickets — skipped for captain pick games (unrated /
+        # economy-disabled).
+        if not queue.is_captain_pick:
+            reward = await session.scalar(
+                select(RotationMap.raffle_ticket_reward)
+                .join(Map, Map.id == RotationMap.map_id)
+                .join(Rotation, Rotation.id == RotationMap.rotation_id)
+                .join(Queue, Queue.rotation_id == Rotation.id)
+                .where(Map.short_name == in_progress_game.map_short_name)
+                .where(Queue.id == in_progress_game.queue_id)
+            )
+            if not reward:
+                reward = config.DEFAULT_RAFFLE_VALUE
+
+            for player in players:
+                player.raffle_tickets = (player.raffle_tickets or 0) + reward
+                session.add(player)
+        await session.commit()
+
+        finished_game_embed = await session.run_sync(
+            create_finished_game_embed,
+            finished_game.id,
+            interaction.guild.id,
+            (interaction.user.name, interaction.user.display_name),
+        )
+        game_history_message: Message
+        if config.GAME_HISTORY_CHANNEL:
+            game_history_channel: GuildChannel | None = interaction.guild.get_channel(
+                config.GAME_HISTORY_CHANNEL
+            )
+            if isinstance(game_history_channel, TextChannel):
+                game_history_message = await game_history_channel.send(
+                    embed=finished_game_embed
+                )
+                await upload_stats_screenshot_imgkit_channel(game_history_channel)
+        elif config.STATS_DIR:
+            await upload_stats_screenshot_imgkit_interaction(interaction)
+
+        if game_history_message is not None:
+            finished_game_embed.description = game_history_message.jump_url
+        if config.CHANNEL_ID:
+            main_channel = interaction.guild.get_channel(config.CHANNEL_ID)
+            if isinstance(main_channel, TextChannel):
+                await main_channel.send(embed=finished_game_embed)
+        return True
+
+    def _record_finished_game(
+        self,
+        session: SQLAlchemySession,
+        queue: Queue,
+        in_progress_game: InProgressGame,
+        winning_team: int,
+        category_name: str | None,
+    ) -> tuple[FinishedGame, list[Player]]:
+        """
+        Rate the game and record it as a FinishedGame, then commit
+
+        :returns: The finished game and its players
+        """
         players = (
             session.query(Player)
             .join(InProgressGamePlayer)
@@ -458,18 +595,19 @@ class InProgressGameCommands(commands.Cog):
 
         db_config: Config = session.query(Config).first()
 
-        player_category_trueskills: list[PlayerCategoryTrueskill] = []
-        for ipgp in in_progress_game_players:
-            pct = get_category_trueskill(
+        player_category_trueskills: list[PlayerCategoryTrueskill] = (
+            get_category_trueskills(
                 session,
                 db_config,
-                ipgp.player_id,
+                [
+                    (ipgp.player_id, ipgp.position_id)
+                    for ipgp in in_progress_game_players
+                ],
                 queue.map_trueskill_enabled,
                 queue.category_id,
                 in_progress_game.map_id,
-                ipgp.position_id,
             )
-            player_category_trueskills.append(pct)
+        )
 
         player_category_trueskills_by_id = {
             pct.player_id: pct for pct in player_category_trueskills
@@ -500,28 +638,6 @@ class InProgressGameCommands(commands.Cog):
                         Rating(player.rated_trueskill_mu, player.rated_trueskill_sigma)
                     )
 
-        if queue.category_id:
-            category: Category | None = (
-                session.query(Category).filter(Category.id == queue.category_id).first()
-            )
-            if category:
-                category_name = category.name
-            else:
-                # should never happen
-                _log.error(
-                    f"Could not find category with id {queue.category_id} for queue with id {queue.id}"
-                )
-                await interaction.followup.send(
-                    embed=Embed(
-                        description="Something went wrong, please contact the server owner",
-                        color=Colour.red(),
-                    ),
-                    ephemeral=True,
-                )
-                return False
-        else:
-            category_name = None
-
         game_finished_at = datetime.now(timezone.utc)
         finished_game = FinishedGame(
             average_trueskill=in_progress_game.average_trueskill,
@@ -571,6 +687,8 @@ class InProgressGameCommands(commands.Cog):
                 team1_rated_ratings_before,
             )
 
+        finished_game_players: list[FinishedGamePlayer] = []
+
         def update_ratings(
             team_players: list[InProgressGamePlayer],
             ratings_before: list[Rating],
@@ -600,7 +718,7 @@ class InProgressGameCommands(commands.Cog):
                     rated_trueskill_sigma_after=ratings_after[i].sigma,
                 )
                 # We assume that every player has a player_category_trueskill
-                # because get_category_trueskill is supposed to create it.
+                # because get_category_trueskills is supposed to create it.
                 # Always refresh last_game_finished_at so sigma decay treats
                 # captain-pick games as activity too.
                 pct = player_category_trueskills_by_id[player.id]
@@ -619,6 +737,7 @@ class InProgressGameCommands(commands.Cog):
 
                 session.add(pct)
                 session.add(finished_game_player)
+                finished_game_players.append(finished_game_player)
 
         update_ratings(
             team0_players,
@@ -632,78 +751,9 @@ class InProgressGameCommands(commands.Cog):
             team1_rated_ratings_after,
             game_finished_at,
         )
+        daily_stats.record_game(session, finished_game, finished_game_players)
         session.commit()  # temporary solution until the foreign key constraint is resolved on EconomyPredictions/EconomyTransactions
-        if config.ECONOMY_ENABLED and not queue.is_captain_pick:
-            economy_cog = self.bot.get_cog("EconomyCommands")
-            if economy_cog is not None and isinstance(economy_cog, EconomyCommands):
-                await economy_cog.resolve_predictions(
-                    interaction, outcome, in_progress_game.id
-                )
-            else:
-                _log.warning("Could not get EconomyCommands cog")
-
-        session.query(InProgressGamePlayer).filter(
-            InProgressGamePlayer.in_progress_game_id == in_progress_game.id
-        ).delete()
-        in_progress_game.is_finished = True
-        session.add(
-            QueueWaitlist(
-                channel_id=config.CHANNEL_ID,  # not sure about this column and what it's used for
-                finished_game_id=finished_game.id,
-                in_progress_game_id=in_progress_game.id,
-                guild_id=interaction.guild_id,
-                queue_id=queue.id,
-                end_waitlist_at=datetime.now(timezone.utc)
-                + timedelta(seconds=config.RE_ADD_DELAY),
-            )
-        )
-
-        # Reward raffle tickets — skipped for captain pick games (unrated /
-        # economy-disabled).
-        if not queue.is_captain_pick:
-            reward = (
-                session.query(RotationMap.raffle_ticket_reward)
-                .join(Map, Map.id == RotationMap.map_id)
-                .join(Rotation, Rotation.id == RotationMap.rotation_id)
-                .join(Queue, Queue.rotation_id == Rotation.id)
-                .filter(Map.short_name == in_progress_game.map_short_name)
-                .filter(Queue.id == in_progress_game.queue_id)
-                .scalar()
-            )
-            if not reward:
-                reward = config.DEFAULT_RAFFLE_VALUE
-
-            for player in players:
-                player.raffle_tickets = (player.raffle_tickets or 0) + reward
-                session.add(player)
-        session.commit()
-
-        finished_game_embed = create_finished_game_embed(
-            session,
-            finished_game.id,
-            interaction.guild.id,
-            (interaction.user.name, interaction.user.display_name),
-        )
-        game_history_message: Message
-        if config.GAME_HISTORY_CHANNEL:
-            game_history_channel: GuildChannel | None = interaction.guild.get_channel(
-                config.GAME_HISTORY_CHANNEL
-            )
-            if isinstance(game_history_channel, TextChannel):
-                game_history_message = await game_history_channel.send(
-                    embed=finished_game_embed
-                )
-                await upload_stats_screenshot_imgkit_channel(game_history_channel)
-        elif config.STATS_DIR:
-            await upload_stats_screenshot_imgkit_interaction(interaction)
-
-        if game_history_message is not None:
-            finished_game_embed.description = game_history_message.jump_url
-        if config.CHANNEL_ID:
-            main_channel = interaction.guild.get_channel(config.CHANNEL_ID)
-            if isinstance(main_channel, TextChannel):
-                await main_channel.send(embed=finished_game_embed)
-        return True
+        return finished_game, players
 
     @group.command(
         name="moveplayers",
@@ -799,16 +849,13 @@ class InProgressGameCommands(commands.Cog):
                 )
                 player_ids: list[int] = [fgp.player_id for fgp in fgps]
                 best_teams = get_n_best_finished_game_teams(
-                    fgps, (len(fgps) + 1) // 2, finished_game.is_rated, 7
+                    fgps, (len(fgps) + 1) // 2, finished_game.is_rated, 3
                 )
                 worst_teams = get_n_worst_finished_game_teams(
                     fgps, (len(fgps) + 1) // 2, finished_game.is_rated, 1
                 )
                 game_str += "\n**Most even team combinations:**"
-                for i, (_, best_team) in enumerate(best_teams):
-                    # Every two pairings is the same
-                    if i % 2 == 0:
-                        continue
+                for _, best_team in best_teams:
                     team0_players = best_team[: len(best_team) // 2]
                     team1_players = best_team[len(best_team) // 2 :]
                     game_str += f"\n{mock_finished_game_teams_str(team0_players, team1_players, finished_game.is_rated)}"
@@ -7,12 +7,12 @@ from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.orm.session import Session as SQLAlchemySession
 from table2ascii import Alignment, PresetStyle, table2ascii
 
+import discord_bots.daily_stats as daily_stats
 from discord_bots.checks import is_admin_app_command, is_command_or_captain_channel
 from discord_bots.cogs.base import BaseCog
 from discord_bots.models import (
     Category,
     FinishedGame,
-    FinishedGamePlayer,
     Map,
     PlayerCategoryTrueskill,
     Queue,
@@ -278,31 +278,10 @@ class MapCommands(BaseCog):
                     ephemeral=True,
                 )
                 return
-            fgps: List[FinishedGamePlayer] | None = (
-                session.query(FinishedGamePlayer)
-                .filter(FinishedGamePlayer.player_id == interaction.user.id)
-                .all()
+            stats_by_map = daily_stats.wins_losses_ties_by_map(
+                session, interaction.user.id, category_name
             )
-            if not fgps:
-                await interaction.response.send_message(
-                    embed=Embed(
-                        description=f"You have not played any games",
-                        colour=Colour.red(),
-                    ),
-                    ephemeral=True,
-                )
-                return
-            finished_game_ids: List[str] | None = [fgp.finished_game_id for fgp in fgps]
-            conditions = [
-                FinishedGame.id.in_(finished_game_ids),
-                FinishedGame.is_captain_pick == False,
-            ]
-            if category_name:
-                conditions.append(FinishedGame.category_name == category_name)
-            fgs: List[FinishedGame] | None = (
-                session.query(FinishedGame).filter(*conditions).all()
-            )
-            if not fgs:
+            if not stats_by_map:
                 await interaction.response.send_message(
                     embed=Embed(
                         description=f"Could not find any finished games for you",
@@ -311,32 +290,12 @@ class MapCommands(BaseCog):
                     ephemeral=True,
                 )
                 return
-            fgps_by_finished_game_id: dict[str, FinishedGamePlayer] = {
-                fgp.finished_game_id: fgp for fgp in fgps
-            }
             cols = []
             for m in maps:
-
-                def map_stats(finished_games: list[FinishedGame]):
-                    wins = [
-                        fg
-                        for fg in finished_games
-                        if fg.winning_team == fgps_by_finished_game_id[fg.id].team
-                    ]
-                    losses = [
-                        fg
-                        for fg in finished_games
-                        if fg.winning_team != fgps_by_finished_game_id[fg.id].team
-                        and fg.winning_team != -1
-                    ]
-                    ties = [fg for fg in finished_games if fg.winning_team == -1]
-                    return len(wins), len(losses), len(ties)
-
-                fgs_for_map = [fg for fg in fgs if fg.map_full_name == m.full_name]
-                num_games = len(fgs_for_map)
+                wins, losses, ties = stats_by_map.get(m.full_name, (0, 0, 0))
+                num_games = wins + losses + ties
                 if num_games <= 0:
                     continue
-                wins, losses, ties = map_stats(fgs_for_map)
                 wr = win_rate(wins, losses, ties)
                 cols.append(
                     [
@@ -369,7 +369,7 @@ class QueueCommands(BaseCog):
             # This throws an error if people haven't played in 30 days
             for player in random.sample(players_from_last_30_days, k=int(count)):
                 if isinstance(interaction.channel, TextChannel) and interaction.guild:
-                    add_player_queue.put(
+                    add_player_queue.put_nowait(
                         AddPlayerQueueMessage(
                             player.id,
                             player.name,
@@ -7,6 +7,7 @@ from discord.ext.commands import Bot
 from discord.utils import escape_markdown
 from sqlalchemy.orm.session import Session as SQLAlchemySession
 
+import discord_bots.rank_index as rank_index
 from discord_bots.checks import is_admin_app_command, is_command_or_captain_channel
 from discord_bots.cogs.base import BaseCog
 from discord_bots.models import Config, Player, PlayerCategoryTrueskill, Queue, Session
@@ -143,23 +144,14 @@ class TrueskillCommands(BaseCog):
                 )
                 return
 
-            trueskill_mus = []
             if queue.category_id:
-                player_category_trueskills: List[PlayerCategoryTrueskill] = (
-                    session.query(PlayerCategoryTrueskill)
-                    .filter(
-                        PlayerCategoryTrueskill.category_id == queue.category_id,
-                    )
-                    .all()
-                )
-                trueskill_mus = [pct.mu for pct in player_category_trueskills]
+                trueskill_mus = [
+                    rating.mu
+                    for rating in rank_index.category_ratings(queue.category_id)
+                ]
             else:
-                players = (
-                    session.query(Player)
-                    .filter(Player.finished_game_players.any())
-                    .all()
-                )
-                trueskill_mus = [p.rated_trueskill_mu for p in players]
+                # Players whose rating has moved off the default
+                trueskill_mus = [rating.mu for rating in rank_index.global_ratings()]
 
         std_dev = statistics.stdev(trueskill_mus)
         average = mean(trueskill_mus)
@@ -2,14 +2,13 @@ import asyncio
 import logging
 from collections import defaultdict
 from datetime import datetime, timedelta, timezone
-from itertools import chain, combinations, product
+from functools import partial
 from math import floor
 from random import choice, shuffle, uniform
 from tempfile import NamedTemporaryFile
 from typing import List, Literal, Optional
 
 import discord
-import imgkit
 import sqlalchemy
 from discord import (
     CategoryChannel,
@@ -25,33 +24,42 @@ from discord.ext.commands.context import Context
 from discord.guild import Guild
 from discord.member import Member
 from discord.utils import escape_markdown
-from PIL import Image
-from sqlalchemy import and_, func, or_
+from sqlalchemy import and_, func, or_, select
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm.session import Session as SQLAlchemySession
-from trueskill import Rating
 
 import discord_bots.config as config
+import discord_bots.queue_status as queue_status
+import discord_bots.rating_cache as rating_cache
+from discord_bots.async_db_utils import (
+    async_delete_where,
+    async_query_all,
+    async_query_first,
+    async_run_sync,
+    async_session,
+)
 from discord_bots.checks import is_admin, queue_is_captain_pick_for_channel
+from discord_bots.dispatcher import Priority, channel_route, dispatcher
+from discord_bots.matchmaking import MatchmakingPlayer, balance_teams
 from discord_bots.utils import (
     add_empty_field,
+    async_is_in_game,
     create_condensed_in_progress_game_embed,
     create_in_progress_game_embed,
     del_player_from_queues_and_waitlists,
     execute_map_rotation,
-    flatten_list,
-    get_category_trueskill,
+    get_category_ratings,
     get_player_game,
     get_team_name_diff,
     get_team_voice_channels,
-    is_in_game,
+    load_in_progress_game_bundles,
     mean,
     move_game_players,
     send_in_guild_message,
     send_message,
     short_uuid,
     upload_stats_screenshot_imgkit_channel,
-    win_probability_matchmaking,
 )
 
 from .bot import bot
@@ -67,7 +75,6 @@ from .models import (
     InProgressGamePlayer,
     Map,
     Player,
-    PlayerCategoryTrueskill,
     Queue,
     QueueNotification,
     QueuePlayer,
@@ -84,21 +91,16 @@ from .models import (
 )
 from .names import generate_be_name, generate_ds_name
 from .queues import AddPlayerQueueMessage, add_player_queue, waitlist_messages
-from .twitch import twitch
+from .twitch import get_twitch
 
 _log = logging.getLogger(__name__)
 
 
-async def get_position_combinations(
+async def get_position_assignments(
     queue_positions: list[QueuePosition], players: list[Player]
-) -> tuple[list[list[Player]], dict[int, QueuePosition]]:
+) -> dict[Player, QueuePosition]:
     """
-    Return two things:
-    - A list of lists of player ids. These represent the players on the first team. The second team can be deduced by pulling the players not in this list
-    - A mapping of players to their assigned position
-
-    Each row in the list are the two teams. Each item in each row is a tuple of
-    the player and their position id
+    Return a mapping of players to their assigned position
     """
     assert 2 * sum([qp.count for qp in queue_positions]) == len(players)
 
@@ -106,7 +108,6 @@ async def get_position_combinations(
     players = [p for p in players]
     shuffle(players)
 
-    position_to_player = defaultdict(list)
     player_to_position: dict[Player, QueuePosition] = {}
 
     # Randomly assign a position to each player
@@ -115,33 +116,24 @@ async def get_position_combinations(
     for queue_position in queue_positions:
         for _ in range(queue_position.count * 2):
             player = players.pop()
-            position_to_player[queue_position.position_id].append(player)
             player_to_position[player] = queue_position
 
-    # For each position, we need to get all the combinations of players for that position
-    position_combinations: list[list[Player]] = []
-    for players_at_position in position_to_player.values():
-        # Divide by 2 because we're only generating the first half of the combinations
-        combos = list(combinations(players_at_position, len(players_at_position) // 2))
-        position_combinations.append(combos)
+    return player_to_position
 
-    # Take every combination of positions and multiply them with every other
-    # combination of positions.
-    # The final result is a list of lists, where each inner list represents one
-    # possible game combination and the entire object represents every valid
-    # combination given the positions assigned
-    final_combinations: list[list[Player]] = []
-    final_combinations = position_combinations.pop()
-    while len(position_combinations) > 0:
-        next_combinations = position_combinations.pop()
-        final_combinations = list(product(final_combinations, next_combinations))
-        final_combinations = [flatten_list(l) for l in final_combinations]
 
-    return final_combinations, player_to_position
+def _get_even_teams_rows(
+    session: SQLAlchemySession, player_ids: list[int], queue_id: str
+) -> tuple[Config, list[Player], list[QueuePosition], Queue]:
+    return (
+        session.query(Config).first(),
+        session.query(Player).filter(Player.id.in_(player_ids)).all(),
+        session.query(QueuePosition).filter(QueuePosition.queue_id == queue_id).all(),
+        session.query(Queue).filter(Queue.id == queue_id).first(),
+    )
 
 
 async def get_even_teams(
-    session: SQLAlchemySession,
+    session: SQLAlchemySession | AsyncSession,
     player_ids: list[int],
     team_size: int,
     queue_id: str,
@@ -154,23 +146,19 @@ async def get_even_teams(
     TODO: Re-use get_n_teams function
 
     Try to figure out even teams, the first half of the returning list is
-    the first team, the second half is the second team.
+    the first team, the second half is the second team. The search itself
+    runs in a matchmaking worker, see matchmaking.balance_teams.
 
     :returns: list of players and win probability for the first team
     """
-    db_config: Config = session.query(Config).first()
-    players: list[Player] = (
-        session.query(Player).filter(Player.id.in_(player_ids)).all()
-    )
-    queue_positions = (
-        session.query(QueuePosition).filter(QueuePosition.queue_id == queue_id).all()
+    db_config, players, queue_positions, queue = await async_run_sync(
+        session, _get_even_teams_rows, player_ids, queue_id
     )
-    queue = session.query(Queue).filter(Queue.id == queue_id).first()
 
     # Shuffling is important! This ensures captains and/or positions are randomly distributed!
     shuffle(players)
 
-    player_category_trueskills = {}
+    player_category_trueskills: dict[int, rating_cache.CachedRating] = {}
     queue_position_count = 2 * sum([qp.count for qp in queue_positions])
     should_use_positions = len(queue_positions) > 0 and queue_position_count == len(
         player_ids
@@ -178,87 +166,75 @@ async def get_even_teams(
     player_to_position: dict[Player, QueuePosition] = {}
     _log.info(f"[get_even_teams] should_use_positions: {should_use_positions}")
     if should_use_positions:
-        player_combinations, player_to_position = await get_position_combinations(
-            queue_positions, players
+        player_to_position = await get_position_assignments(queue_positions, players)
+        ratings = await async_run_sync(
+            session,
+            get_category_ratings,
+            db_config,
+            [
+                (player.id, queue_position.position_id)
+                for player, queue_position in player_to_position.items()
+            ],
+            queue.map_trueskill_enabled,
+            queue_category_id,
+            map_id,
         )
-        for player, queue_position in player_to_position.items():
-            pct = get_category_trueskill(
+        for player, rating in zip(player_to_position, ratings):
+            player_category_trueskills[player.id] = rating
+        # Half of the players at each position go on each team
+        position_counts: dict[str, int] | None = defaultdict(int)
+        for queue_position in queue_positions:
+            position_counts[queue_position.position_id] += queue_position.count
+    else:
+        if queue_category_id:
+            ratings = await async_run_sync(
                 session,
+                get_category_ratings,
                 db_config,
-                player.id,
+                [(player_id, None) for player_id in player_ids],
                 queue.map_trueskill_enabled,
                 queue_category_id,
                 map_id,
-                queue_position.position_id,
             )
-            player_category_trueskills[player.id] = pct
-        all_combinations: list[list[Player]] = player_combinations
-    else:
-        if queue_category_id:
-            for player_id in player_ids:
-                pct = get_category_trueskill(
-                    session,
-                    db_config,
-                    player_id,
-                    queue.map_trueskill_enabled,
-                    queue_category_id,
-                    map_id,
-                    None,
-                )
-                player_category_trueskills[player_id] = pct
-        all_combinations: list[list[Player]] = list(combinations(players, team_size))
-
-    best_win_prob_so_far: float = 0.0
-    best_teams_so_far: list[Player] = []
-
-    if config.MAXIMUM_TEAM_COMBINATIONS:
-        all_combinations = all_combinations[: config.MAXIMUM_TEAM_COMBINATIONS]
-    for i, team0 in enumerate(all_combinations):
-        team1 = [p for p in players if p not in team0]
-        team0_ratings = []
-        for player in team0:
-            if queue_category_id and player.id in player_category_trueskills:
-                player_category_trueskill: PlayerCategoryTrueskill = (
-                    player_category_trueskills[player.id]
-                )
-                team0_ratings.append(
-                    Rating(
-                        player_category_trueskill.mu,
-                        player_category_trueskill.sigma,
-                    )
-                )
-            else:
-                team0_ratings.append(
-                    Rating(player.rated_trueskill_mu, player.rated_trueskill_sigma)
-                )
-        team1_ratings = []
-        for player in team1:
-            if queue_category_id and player.id in player_category_trueskills:
-                player_category_trueskill: PlayerCategoryTrueskill = (
-                    player_category_trueskills[player.id]
-                )
-                team1_ratings.append(
-                    Rating(
-                        player_category_trueskill.mu,
-                        player_category_trueskill.sigma,
-                    )
+            for player_id, rating in zip(player_ids, ratings):
+                player_category_trueskills[player_id] = rating
+        position_counts = None
+
+    # The matchmaking workers only get plain tuples, not database objects
+    matchmaking_players: list[MatchmakingPlayer] = []
+    for player in players:
+        position_id: str | None = (
+            player_to_position[player].position_id if player_to_position else None
+        )
+        if queue_category_id and player.id in player_category_trueskills:
+            player_category_trueskill = player_category_trueskills[player.id]
+            matchmaking_players.append(
+                (
+                    player.id,
+                    player_category_trueskill.mu,
+                    player_category_trueskill.sigma,
+                    position_id,
                 )
-            else:
-                team1_ratings.append(
-                    Rating(player.rated_trueskill_mu, player.rated_trueskill_sigma)
+            )
+        else:
+            matchmaking_players.append(
+                (
+                    player.id,
+                    player.rated_trueskill_mu,
+                    player.rated_trueskill_sigma,
+                    position_id,
                 )
-        win_prob = win_probability_matchmaking(team0_ratings, team1_ratings)
-        current_team_evenness = abs(0.50 - win_prob)
-        best_team_evenness_so_far = abs(0.50 - best_win_prob_so_far)
-        if current_team_evenness < best_team_evenness_so_far:
-            best_win_prob_so_far = win_prob
-            best_teams_so_far = list(team0[:]) + list(team1[:])
-        if best_team_evenness_so_far < 0.001:
-            break
+            )
 
-    _log.debug(f"Found team evenness: {best_team_evenness_so_far} interations: {i}")
+    best_split = await balance_teams(matchmaking_players, team_size, position_counts)
 
-    return best_teams_so_far, best_win_prob_so_far, player_to_position
+    # team1 is everyone else, in the order they were shuffled
+    best_teams_so_far: list[Player] = [players[i] for i in best_split.team0] + [
+        players[i] for i in best_split.team1
+    ]
+    _log.debug(f"Found team evenness: {best_split.evenness}")
+
+    return best_teams_so_far, best_split.win_probability, player_to_position
 
 
 async def create_game(
@@ -273,20 +249,20 @@ async def create_game(
     channel = guild.get_channel(channel_id)
     if not channel:
         return
-    session: sqlalchemy.orm.Session
-    with Session() as session:
-        queue: Queue | None = session.query(Queue).filter(Queue.id == queue_id).first()
+    async with async_session() as session:
+        queue: Queue | None = await async_query_first(
+            session, Queue, Queue.id == queue_id
+        )
         if not queue:
             _log.error(f"[create_game] could not find queue with id {queue_id}")
             return
 
-        next_rotation_map: RotationMap | None = (
-            session.query(RotationMap)
+        next_rotation_map: RotationMap | None = await session.scalar(
+            select(RotationMap)
             .join(Rotation, Rotation.id == RotationMap.rotation_id)
             .join(Queue, Queue.rotation_id == Rotation.id)
-            .filter(Queue.id == queue.id)
-            .filter(RotationMap.is_next == True)
-            .first()
+            .where(Queue.id == queue.id, RotationMap.is_next == True)
+            .limit(1)
         )
         if not next_rotation_map:
             raise Exception("No next map!")
@@ -298,12 +274,12 @@ async def create_game(
 
         next_map = None
         if rolled_random_map:
-            maps: List[Map] = session.query(Map).all()
+            maps: List[Map] = await async_query_all(session, Map)
             random_map = choice(maps)
             next_map = random_map
         else:
-            next_map: Map | None = (
-                session.query(Map).filter(Map.id == next_rotation_map.map_id).first()
+            next_map: Map | None = await async_query_first(
+                session, Map, Map.id == next_rotation_map.map_id
             )
 
         if queue.is_captain_pick:
@@ -311,40 +287,28 @@ async def create_game(
             # cogs.in_progress_game which can drag in commands during init.
             from discord_bots.captain_pick import start_draft as _start_draft
 
-            await _start_draft(
-                session,
-                queue,
-                next_map,
-                rolled_random_map,
-                player_ids,
-                channel,
-                guild,
-            )
+            # Drafts are still written for a sync Session
+            sync_session: SQLAlchemySession
+            with Session() as sync_session:
+                await _start_draft(
+                    sync_session,
+                    sync_session.get(Queue, queue.id),
+                    sync_session.get(Map, next_map.id),
+                    rolled_random_map,
+                    player_ids,
+                    channel,
+                    guild,
+                )
             return
 
         if len(player_ids) == 1:
             # Useful for debugging, no real world application
-            players = session.query(Player).filter(Player.id == player_ids[0]).all()
+            players = await async_query_all(session, Player, Player.id == player_ids[0])
             win_prob = 0.0
             player_to_position = (
                 {}
             )  # TODO: Should get the position, but not immediate need right now
         else:
-            """
-            # run get_even_teams in a separate process, so that it doesn't block the event loop
-            loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
-            with concurrent.futures.ProcessPoolExecutor() as pool:
-                result = await loop.run_in_executor(
-                    pool,
-                    get_even_teams,
-                    player_ids,
-                    len(player_ids) // 2,
-                    queue.is_rated,
-                    queue.category_id,
-                )
-                players = result[0]
-                win_prob = result[1]
-            """
             players, win_prob, player_to_position = await get_even_teams(
                 session,
                 player_ids,
@@ -353,33 +317,33 @@ async def create_game(
                 next_map.id,
                 queue.category_id,
             )
-        category = (
-            session.query(Category).filter(Category.id == queue.category_id).first()
+        category: Category | None = await async_query_first(
+            session, Category, Category.id == queue.category_id
         )
-        db_config: Config = session.query(Config).first()
-        player_category_trueskills: list[PlayerCategoryTrueskill] = []
+        db_config: Config = await async_query_first(session, Config)
+        player_category_trueskills: list[rating_cache.CachedRating] = []
         if len(player_to_position) > 0:
-            for player, queue_position in player_to_position.items():
-                pct = get_category_trueskill(
-                    session,
-                    db_config,
-                    player.id,
-                    queue.map_trueskill_enabled,
-                    queue.category_id,
-                    next_map.id,
-                    queue_position.position_id,
-                )
-                player_category_trueskills.append(pct)
+            player_category_trueskills = await session.run_sync(
+                get_category_ratings,
+                db_config,
+                [
+                    (player.id, queue_position.position_id)
+                    for player, queue_position in player_to_position.items()
+                ],
+                queue.map_trueskill_enabled,
+                queue.category_id,
+                next_map.id,
+            )
         elif category:
-            player_category_trueskills: list[PlayerCategoryTrueskill] = (
-                session.query(PlayerCategoryTrueskill)
-                .filter(
-                    PlayerCategoryTrueskill.category_id == category.id,
-                    PlayerCategoryTrueskill.map_id == next_map.id,
-                    PlayerCategoryTrueskill.player_id.in_(player_ids),
+            for player_id in player_ids:
+                ratings = await session.run_sync(
+                    rating_cache.get_all, player_id, category.id
                 )
-                .all()
-            )
+                player_category_trueskills += [
+                    rating
+                    for (map_id, _), rating in ratings.items()
+                    if map_id == next_map.id
+                ]
         if player_category_trueskills:
             average_trueskill = mean([x.mu for x in player_category_trueskills])
         else:
@@ -427,7 +391,11 @@ async def create_game(
             session.add(game_player)
 
         short_game_id = short_uuid(game.id)
-        embed: Embed = await create_in_progress_game_embed(session, game, guild)
+        bundles = await session.run_sync(load_in_progress_game_bundles, [game])
+        # The embed only needs the session to load the bundle itself
+        embed: Embed = await create_in_progress_game_embed(
+            session.sync_session, game, guild, bundle=bundles[game.id]
+        )
         embed.title = f"🚩 Game '{queue.name}' ({short_uuid(game.id)}) has begun!"
 
         category_channel: discord.abc.GuildChannel | None = guild.get_channel(
@@ -479,6 +447,7 @@ async def create_game(
                     player.id,
                     message_content=be_voice_channel.jump_url,
                     embed=embed,
+                    priority=Priority.POP,
                 )
             )
 
@@ -489,6 +458,7 @@ async def create_game(
                     player.id,
                     message_content=ds_voice_channel.jump_url,
                     embed=embed,
+                    priority=Priority.POP,
                 )
             )
         await asyncio.gather(*send_message_coroutines)
@@ -499,15 +469,23 @@ async def create_game(
             and isinstance(in_progress_game_cog, InProgressGameCommands)
             and match_channel
         ):
-            message = await match_channel.send(
-                embed=embed, view=InProgressGameView(game.id, in_progress_game_cog)
+            message = await dispatcher.submit(
+                channel_route(match_channel.id),
+                partial(
+                    match_channel.send,
+                    embed=embed,
+                    view=InProgressGameView(game.id, in_progress_game_cog),
+                ),
+                Priority.POP,
             )
             game.message_id = message.id
         else:
             _log.warning("Could not get InProgressGameCommands")
 
-        session.query(QueuePlayer).filter(QueuePlayer.player_id.in_(player_ids)).delete()  # type: ignore
-        session.commit()
+        await async_delete_where(
+            session, QueuePlayer, QueuePlayer.player_id.in_(player_ids)
+        )
+        await session.commit()
 
         if not rolled_random_map:
             await execute_map_rotation(queue.rotation_id, False)
@@ -520,9 +498,11 @@ async def create_game(
             )
             if prediction_message_id:
                 game.prediction_message_id = prediction_message_id
-                session.commit()
+                await session.commit()
 
-        await channel.send(embed=embed)
+        await dispatcher.submit(
+            channel_route(channel.id), partial(channel.send, embed=embed), Priority.POP
+        )
         if (
             config.ENABLE_VOICE_MOVE
             and queue.move_enabled
@@ -537,99 +517,141 @@ async def create_game(
             )
 
 
-async def add_player_to_queue(
-    queue_id: str,
+async def add_player_to_queues(
+    queue_ids: list[str],
     player_id: int,
     channel: TextChannel | DMChannel | GroupChannel,
     guild: Guild,
-) -> tuple[bool, bool]:
+) -> tuple[list[str], str | None]:
     """
-    Helper function to add player to a queue and pop if needed.
-
-    TODO: Remove this function, it's only called in one place so just inline it
-
-    :returns: A tuple of booleans - the first represents whether the player was
-    added to the queue, the second represents whether the queue popped as a
-    result.
+    Helper function to add a player to several queues at once and pop if
+    needed.
+
+    Roles, rank limits and whether the player is in a game are checked for
+    every queue up front, the player is added to every queue they qualify for
+    in one commit, and the new queue sizes are counted in one query. If more
+    than one queue is full, only the first one in queue_ids pops, like adding
+    to them one at a time would.
+
+    :returns: The ids of the queues the player was added to, in queue_ids
+    order, and the id of the queue that popped as a result, if any. If a
+    queue popped, only the queues before it are returned.
     """
-    session: sqlalchemy.orm.Session
-    with Session() as session:
-        queue_roles = (
-            session.query(QueueRole).filter(QueueRole.queue_id == queue_id).all()
+    if not queue_ids:
+        return [], None
+    async with async_session() as session:
+        if await async_is_in_game(session, player_id):
+            return [], None
+
+        player: Player = await async_query_first(
+            session, Player, Player.id == player_id
+        )
+        queue_by_id: dict[str, Queue] = {
+            queue.id: queue
+            for queue in await async_query_all(session, Queue, Queue.id.in_(queue_ids))
+        }
+        role_ids_by_queue_id: dict[str, set[int]] = defaultdict(set)
+        for queue_role in await async_query_all(
+            session, QueueRole, QueueRole.queue_id.in_(queue_ids)
+        ):
+            role_ids_by_queue_id[queue_role.queue_id].add(queue_role.role_id)
+        already_added_queue_ids: set[str] = set(
+            await session.scalars(
+                select(QueuePlayer.queue_id).where(
+                    QueuePlayer.player_id == player_id,
+                    QueuePlayer.queue_id.in_(queue_ids),
+                )
+            )
         )
 
-        # Zero queue roles means no role restrictions
-        if len(queue_roles) > 0:
-            member = guild.get_member(player_id)
-            if not member:
-                return False, False
-            queue_role_ids = set(map(lambda x: x.role_id, queue_roles))
-            player_role_ids = set(map(lambda x: x.id, member.roles))
-            has_role = len(queue_role_ids.intersection(player_role_ids)) > 0
-            if not has_role:
-                return False, False
-
-        if is_in_game(player_id):
-            return False, False
-
-        player: Player = session.query(Player).filter(Player.id == player_id).first()
-        queue: Queue = session.query(Queue).filter(Queue.id == queue_id).first()
-        category = (
-            session.query(Category).filter(Category.id == queue.category_id).first()
+        member: Member | None = guild.get_member(player_id)
+        player_role_ids: set[int] = (
+            set(map(lambda x: x.id, member.roles)) if member else set()
         )
-        player_category_trueskill: PlayerCategoryTrueskill | None = None
-        if category:
-            player_category_trueskill = (
-                session.query(PlayerCategoryTrueskill)
-                .filter(
-                    PlayerCategoryTrueskill.player_id == player_id,
-                    PlayerCategoryTrueskill.category_id == category.id,
+        added_at = discord.utils.utcnow()
+        queue_ids_to_add: list[str] = []
+        for queue_id in queue_ids:
+            queue: Queue | None = queue_by_id.get(queue_id)
+            if not queue or queue_id in already_added_queue_ids:
+                continue
+            # Zero queue roles means no role restrictions
+            queue_role_ids = role_ids_by_queue_id[queue_id]
+            if queue_role_ids and not queue_role_ids & player_role_ids:
+                continue
+
+            # TODO: This should be done in the calling function so that the user can given a proper message indicating that they don't meet the requirements
+            player_category_trueskill: rating_cache.CachedRating | None = None
+            if queue.category_id:
+                player_category_trueskill = await session.run_sync(
+                    rating_cache.get_any, player_id, queue.category_id
                 )
-                .first()
-            )
-        # TODO: This should be done in the calling function so that the user can given a proper message indicating that they don't meet the requirements
-        player_rank = player.rated_trueskill_mu - (3 * player.rated_trueskill_sigma)
-        if player_category_trueskill:
-            player_rank = player_category_trueskill.mu - (
-                3 * player_category_trueskill.sigma
-            )
-        if queue.rank_max is not None:
-            if player_rank > queue.rank_max:
-                return False, False
-        if queue.rank_min is not None:
-            if player_rank < queue.rank_min:
-                return False, False
+            player_rank = player.rated_trueskill_mu - (3 * player.rated_trueskill_sigma)
+            if player_category_trueskill:
+                player_rank = player_category_trueskill.mu - (
+                    3 * player_category_trueskill.sigma
+                )
+            if queue.rank_max is not None:
+                if player_rank > queue.rank_max:
+                    continue
+            if queue.rank_min is not None:
+                if player_rank < queue.rank_min:
+                    continue
 
-        session.add(
-            QueuePlayer(
-                queue_id=queue_id,
-                player_id=player_id,
-                channel_id=channel.id,
-                added_at=discord.utils.utcnow(),
+            queue_ids_to_add.append(queue_id)
+            session.add(
+                QueuePlayer(
+                    queue_id=queue_id,
+                    player_id=player_id,
+                    channel_id=channel.id,
+                    added_at=added_at,
+                )
             )
-        )
+        if not queue_ids_to_add:
+            return [], None
         try:
-            session.commit()
+            await session.commit()
         except IntegrityError:
-            session.rollback()
-            return False, False
-
-        queue: Queue = session.query(Queue).filter(Queue.id == queue_id).first()
-        queue_players: list[QueuePlayer] = (
-            session.query(QueuePlayer).filter(QueuePlayer.queue_id == queue_id).all()
+            await session.rollback()
+            return [], None
+
+        queue_player_counts: dict[str, int] = dict(
+            (
+                await session.execute(
+                    select(QueuePlayer.queue_id, func.count(QueuePlayer.player_id))
+                    .where(QueuePlayer.queue_id.in_(queue_ids_to_add))
+                    .group_by(QueuePlayer.queue_id)
+                )
+            ).all()
         )
-        if len(queue_players) == queue.size and not queue.is_sweaty:  # Pop!
-            player_ids: list[int] = list(map(lambda x: x.player_id, queue_players))
-            await create_game(queue.id, player_ids, channel.id, guild.id)
-            return True, True
+        for i, queue_id in enumerate(queue_ids_to_add):
+            queue = queue_by_id[queue_id]
+            if (
+                queue_player_counts.get(queue_id, 0) == queue.size
+                and not queue.is_sweaty
+            ):
+                # Pop! create_game takes the players out of every other queue
+                player_ids: list[int] = list(
+                    await session.scalars(
+                        select(QueuePlayer.player_id).where(
+                            QueuePlayer.queue_id == queue_id
+                        )
+                    )
+                )
+                await create_game(queue.id, player_ids, channel.id, guild.id)
+                return queue_ids_to_add[:i], queue_id
 
-        queue_notifications: list[QueueNotification] = (
-            session.query(QueueNotification)
-            .filter(
-                QueueNotification.queue_id == queue_id,
-                QueueNotification.size == len(queue_players),
-            )
-            .all()
+        queue_notifications: list[QueueNotification] = await async_query_all(
+            session,
+            QueueNotification,
+            or_(
+                *[
+                    and_(
+                        QueueNotification.queue_id == queue_id,
+                        QueueNotification.size == queue_player_counts.get(queue_id, 0),
+                    )
+                    for queue_id in queue_ids_to_add
+                ]
+            ),
         )
         for queue_notification in queue_notifications:
             member: Member | None = guild.get_member(queue_notification.player_id)
@@ -637,16 +659,16 @@ async def add_player_to_queue(
                 try:
                     await member.send(
                         embed=Embed(
-                            description=f"'{queue.name}' is at {queue_notification.size} players!",
+                            description=f"'{queue_by_id[queue_notification.queue_id].name}' is at {queue_notification.size} players!",
                             colour=Colour.blue(),
                         )
                     )
                 except Exception:
                     pass
-            session.delete(queue_notification)
-        session.commit()
+            await session.delete(queue_notification)
+        await session.commit()
 
-        return True, False
+        return queue_ids_to_add, None
 
 
 # Commands start here
@@ -659,12 +681,9 @@ async def is_not_banned(ctx: Context):
 
     https://discordpy.readthedocs.io/en/stable/ext/commands/commands.html#global-checks
     """
-    session: sqlalchemy.orm.Session
-    with Session() as session:
-        is_banned = (
-            session.query(Player)
-            .filter(Player.id == ctx.message.author.id, Player.is_banned)
-            .first()
+    async with async_session() as session:
+        is_banned = await async_query_first(
+            session, Player, Player.id == ctx.message.author.id, Player.is_banned
         )
     return not is_banned
 
@@ -677,7 +696,8 @@ async def add(ctx: Context, *args):
     Players can also add to a queue by its index. The index starts at 1.
     """
     message = ctx.message
-    if is_in_game(message.author.id):
+    session = ctx.asyncSession
+    if await async_is_in_game(session, message.author.id):
         await send_message(
             message.channel,
             embed_description=f"<@{message.author.id}> you are already in a game",
@@ -685,15 +705,14 @@ async def add(ctx: Context, *args):
         )
         return
 
-    session = ctx.session
-    most_recent_game: FinishedGame | None = (
-        session.query(FinishedGame)
+    most_recent_game: FinishedGame | None = await session.scalar(
+        select(FinishedGame)
         .join(FinishedGamePlayer)
-        .filter(
+        .where(
             FinishedGamePlayer.player_id == message.author.id,
         )
         .order_by(FinishedGame.finished_at.desc())  # type: ignore
-        .first()
+        .limit(1)
     )
 
     is_captain_channel = queue_is_captain_pick_for_channel(message.channel.id)
@@ -705,28 +724,27 @@ async def add(ctx: Context, *args):
                 embed_description=f"Usage: !add [queue]",
                 colour=Colour.red(),
             )
-            session.close()
             return
         # Don't auto-add to isolated queues
-        queues_to_add += (
-            session.query(Queue)
-            .filter(
+        queues_to_add += await session.scalars(
+            select(Queue)
+            .where(
                 Queue.is_isolated == False,
                 Queue.is_locked == False,
                 Queue.is_captain_pick == is_captain_channel,
             )
             .order_by(Queue.ordinal.asc())
-            .all()
         )  # type: ignore
     else:
-        all_queues = (
-            session.query(Queue)
-            .filter(
-                Queue.is_locked == False,
-                Queue.is_captain_pick == is_captain_channel,
+        all_queues = list(
+            await session.scalars(
+                select(Queue)
+                .where(
+                    Queue.is_locked == False,
+                    Queue.is_captain_pick == is_captain_channel,
+                )
+                .order_by(Queue.ordinal.asc())
             )
-            .order_by(Queue.ordinal.asc())
-            .all()
         )  # type: ignore
         for arg in args:
             # Try adding by integer index first, then try string name
@@ -738,13 +756,11 @@ async def add(ctx: Context, *args):
                 for queue_to_add in queues_with_ordinal:
                     queues_to_add.append(queue_to_add)
             except ValueError:
-                queue: Queue | None = (
-                    session.query(Queue)
-                    .filter(
-                        Queue.name.ilike(arg),
-                        Queue.is_captain_pick == is_captain_channel,
-                    )
-                    .first()
+                queue: Queue | None = await async_query_first(
+                    session,
+                    Queue,
+                    Queue.name.ilike(arg),
+                    Queue.is_captain_pick == is_captain_channel,
                 )  # type: ignore
                 if queue:
                     queues_to_add.append(queue)
@@ -758,28 +774,36 @@ async def add(ctx: Context, *args):
             colour=Colour.red(),
         )
         return
+    # A rolled back commit below expires everything loaded so far, and an
+    # AsyncSession can't lazily load it again
+    queue_ids_to_add: list[str] = [queue.id for queue in queues_to_add]
+    queue_names: list[str] = [queue.name for queue in queues_to_add]
 
-    vpw: VotePassedWaitlist | None = session.query(VotePassedWaitlist).first()
+    vpw: VotePassedWaitlist | None = await async_query_first(
+        session, VotePassedWaitlist
+    )
     if vpw:
-        for queue in queues_to_add:
+        vpw_id: str = vpw.id
+        end_waitlist_at: datetime = vpw.end_waitlist_at
+        for queue_id in queue_ids_to_add:
             session.add(
                 VotePassedWaitlistPlayer(
-                    vote_passed_waitlist_id=vpw.id,
+                    vote_passed_waitlist_id=vpw_id,
                     player_id=message.author.id,
-                    queue_id=queue.id,
+                    queue_id=queue_id,
                 )
             )
             try:
-                session.commit()
+                await session.commit()
             except IntegrityError as exc:
                 _log.error(f"integrity error {exc}")
-                session.rollback()
+                await session.rollback()
 
         current_time: datetime = datetime.now(timezone.utc)
         # The assumption is the end timestamp is later than now, otherwise it
         # would have been processed
         difference: float = (
-            vpw.end_waitlist_at.replace(tzinfo=timezone.utc) - current_time
+            end_waitlist_at.replace(tzinfo=timezone.utc) - current_time
         ).total_seconds()
         if difference < config.RE_ADD_DELAY:
             time_to_wait: int = floor(config.RE_ADD_DELAY - difference)
@@ -817,27 +841,27 @@ async def add(ctx: Context, *args):
             is_waitlist = True
 
     if is_waitlist and most_recent_game:
-        for queue in queues_to_add:
+        most_recent_game_id: str = most_recent_game.id
+        for queue_id in queue_ids_to_add:
             # TODO: Check player eligibility here?
-            queue_waitlist: QueueWaitlist | None = (
-                session.query(QueueWaitlist)
-                .filter(QueueWaitlist.finished_game_id == most_recent_game.id)
-                .first()
+            queue_waitlist_id: str | None = await session.scalar(
+                select(QueueWaitlist.id)
+                .where(QueueWaitlist.finished_game_id == most_recent_game_id)
+                .limit(1)
             )
-            if queue_waitlist:
+            if queue_waitlist_id:
                 session.add(
                     QueueWaitlistPlayer(
-                        queue_id=queue.id,
-                        queue_waitlist_id=queue_waitlist.id,
+                        queue_id=queue_id,
+                        queue_waitlist_id=queue_waitlist_id,
                         player_id=message.author.id,
                     )
                 )
                 try:
-                    session.commit()
+                    await session.commit()
                 except IntegrityError:
-                    session.rollback()
+                    await session.rollback()
 
-        queue_names = [queue.name for queue in queues_to_add]
         embed_description = f"<@{message.author.id}> your game has just finished, you will be randomized into **{', '.join(queue_names)}** {timer}"
         waitlist_message: Message | None = await send_message(
             message.channel,
@@ -852,11 +876,11 @@ async def add(ctx: Context, *args):
         return
 
     if isinstance(message.channel, TextChannel) and message.guild:
-        add_player_queue.put(
+        add_player_queue.put_nowait(
             AddPlayerQueueMessage(
                 message.author.id,
                 message.author.display_name,
-                [q.id for q in queues_to_add],
+                queue_ids_to_add,
                 True,
                 message.channel,
                 message.guild,
@@ -1064,7 +1088,13 @@ async def autosub(ctx: Context, member: Member = None):
             game_message: discord.PartialMessage = game_channel.get_partial_message(
                 game.message_id
             )
-            coroutines.append(game_message.edit(embed=embed))
+            coroutines.append(
+                dispatcher.submit(
+                    channel_route(game_channel.id),
+                    partial(game_message.edit, embed=embed),
+                    key=("edit", game.message_id),
+                )
+            )
 
     # send the new discord.Embed to each player
     if be_voice_channel:
@@ -1160,6 +1190,9 @@ async def imagetest2(ctx: Context):
 
 @bot.command()
 async def lt(ctx: Context):
+    import imgkit
+    from PIL import Image
+
     query_url = "http://tribesquery.toocrooked.com/hostQuery.php?server=104.128.49.65:28006&port=28006"
     await ctx.message.channel.send(query_url)
 
@@ -1174,6 +1207,9 @@ async def lt(ctx: Context):
 
 @bot.command()
 async def pug(ctx: Context):
+    import imgkit
+    from PIL import Image
+
     query_url = "http://tribesquery.toocrooked.com/hostQuery.php?server=216.128.150.208port=28001"
     await ctx.message.channel.send(query_url)
     ntf = NamedTemporaryFile(delete=True, suffix=".png")
@@ -1190,173 +1226,115 @@ async def status(ctx: Context, *args):
     assert ctx.guild
     session: sqlalchemy.orm.Session
     with Session() as session:
-        queue_indices: list[int] = []
-        queue_names: list[str] = []
-        all_rotations: list[Rotation] = []  # TODO: use sets
-        if len(args) == 0:
-            all_rotations = (
-                session.query(Rotation).order_by(Rotation.created_at.asc()).all()
-            )
-        else:
-            # get the rotation associated to the specified queue
-            all_rotations = []
-            for arg in args:
-                # TODO: avoid looping so you only need one query
-                try:
-                    queue_index = int(arg)
-                    arg_rotation = (
-                        session.query(Rotation)
-                        .join(Queue)
-                        .filter(Queue.ordinal == queue_index)
-                        .first()
-                    )
-                    if arg_rotation:
-                        queue_indices.append(queue_index)
-                        if arg_rotation not in all_rotations:
-                            all_rotations.append(arg_rotation)
-                except ValueError:
-                    arg_rotation = (
-                        session.query(Rotation)
-                        .join(Queue)
-                        .filter(Queue.name.ilike(arg))
-                        .first()
-                    )
-                    if arg_rotation:
-                        queue_names.append(arg)
-                        if arg_rotation not in all_rotations:
-                            all_rotations.append(arg_rotation)
-                except IndexError:
-                    pass
-
-        if not all_rotations:
-            await ctx.channel.send("No Rotations")
-            return
-
-        is_captain_channel = queue_is_captain_pick_for_channel(ctx.channel.id)
-        embed = Embed(title="Queues", color=Colour.blue())
-        ipg_embeds: list[Embed] = []
-        rotation_queues: list[Queue] | None
-        for rotation in all_rotations:
-            conditions = [
-                Queue.rotation_id == rotation.id,
-                Queue.is_locked == False,
-                Queue.is_captain_pick == is_captain_channel,
-            ]
-            if queue_indices:
-                conditions.append(Queue.ordinal.in_(queue_indices))
-            if queue_names:
-                conditions.append(Queue.name.in_(queue_names))
-            rotation_queues = (
-                session.query(Queue)
-                .filter(*conditions)
-                .order_by(Queue.ordinal.asc())
-                .all()
-            )
-            if not rotation_queues:
-                continue
-
-            games_by_queue: dict[str, list[InProgressGame]] = defaultdict(list)
-            for game in session.query(InProgressGame).filter(
-                InProgressGame.is_finished == False
-            ):
-                if game.queue_id:
-                    games_by_queue[game.queue_id].append(game)
-
-            next_rotation_map: RotationMap | None = (
-                session.query(RotationMap)
-                .filter(RotationMap.rotation_id == rotation.id)
-                .filter(RotationMap.is_next == True)
-                .first()
-            )
-            if not next_rotation_map:
-                continue
-            next_map: Map | None = (
-                session.query(Map)
-                .join(RotationMap, RotationMap.map_id == Map.id)
-                .filter(next_rotation_map.map_id == Map.id)
-                .first()
-            )
-            next_map_str = f"{next_map.full_name} ({next_map.short_name})"
-            if config.ENABLE_RAFFLE:
-                has_raffle_reward = next_rotation_map.raffle_ticket_reward > 0
-                raffle_reward = (
-                    next_rotation_map.raffle_ticket_reward
-                    if has_raffle_reward
-                    else config.DEFAULT_RAFFLE_VALUE
-                )
-                next_map_str += f" ({raffle_reward} tickets)"
-            rotation_queues_len = len(rotation_queues)
-            if rotation_queues_len:
-                embed.add_field(
-                    name=f"",
-                    value=f"```asciidoc\n* {rotation.name}```",
-                    inline=False,
-                )
-                skip_map_votes_count = (
-                    session.query(SkipMapVote)
-                    .filter(SkipMapVote.rotation_id == rotation.id)
-                    .count()
-                )
-                if skip_map_votes_count:
-                    embed.add_field(
-                        name=f"🗺️ ️Next Map",
-                        value=next_map_str,
-                        inline=True,
-                    )
-                    embed.add_field(
-                        name="Votes to Skip",
-                        value=f"[{skip_map_votes_count}/{config.MAP_VOTE_THRESHOLD}]",
-                    )
-                    embed.add_field(name="", value="")
-                else:
-                    embed.add_field(
-                        name=f"🗺️ ️Next Map",
-                        value=next_map_str,
-                        inline=False,
-                    )
+        # Only queries if something changed since the last /status
+        rotations = await queue_status.snapshot(session)
 
-            for i, queue in enumerate(rotation_queues):
-                if queue.is_locked:
-                    continue
-                players_in_queue: list[Player] = (
-                    session.query(Player)
-                    .join(QueuePlayer)
-                    .filter(QueuePlayer.queue_id == queue.id)
-                    .order_by(QueuePlayer.added_at.asc())
-                    .all()
-                )
-                queue_title_str = f"(**{queue.ordinal}**) {queue.name} [{len(players_in_queue)}/{queue.size}]"
-                player_display_names: list[str] = (
-                    [player.name for player in players_in_queue]
-                    if players_in_queue
-                    else []
-                )
-                newline = "\n"  # Escape sequence (backslash) not allowed in expression portion of f-string prior to Python 3.12
-                embed.add_field(
-                    name=queue_title_str,
-                    value=(
-                        "> \n** **"  # weird hack to create an empty quote
-                        if not player_display_names
-                        else f">>> {newline.join(player_display_names)}"
+    queue_indices: list[int] = []
+    queue_names: list[str] = []
+    all_rotations: list[queue_status.RotationStatus] = []
+    if len(args) == 0:
+        all_rotations = rotations
+    else:
+        # get the rotation associated to the specified queue
+        for arg in args:
+            try:
+                queue_index = int(arg)
+                arg_rotation = next(
+                    (
+                        rotation
+                        for rotation in rotations
+                        if any(
+                            queue.ordinal == queue_index for queue in rotation.queues
+                        )
                     ),
-                    inline=True,
+                    None,
                 )
-                if (i + 1) == rotation_queues_len and (i + 1) >= 5 and (i + 1) % 3 == 2:
-                    # we have to do this "inline", since there can be multiple sets of queues per rotation in a single embed
-                    # embeds are allowed 3 "columns" per "row"
-                    # to line everything up nicely when there's >= 5 queues and only one "column" slot left, we add a blank
-                    embed.add_field(name="", value="", inline=True)
-                if queue.id in games_by_queue:
-                    game: InProgressGame
-                    for game in games_by_queue[queue.id]:
-                        ipg_embed = await create_condensed_in_progress_game_embed(
-                            session,
-                            game,
+                if arg_rotation:
+                    queue_indices.append(queue_index)
+                    if arg_rotation not in all_rotations:
+                        all_rotations.append(arg_rotation)
+            except ValueError:
+                arg_rotation = next(
+                    (
+                        rotation
+                        for rotation in rotations
+                        if any(
+                            queue.name.casefold() == arg.casefold()
+                            for queue in rotation.queues
                         )
-                        ipg_embeds.append(ipg_embed)
-        await ctx.channel.send(
-            embeds=[embed] + ipg_embeds,
+                    ),
+                    None,
+                )
+                if arg_rotation:
+                    queue_names.append(arg.casefold())
+                    if arg_rotation not in all_rotations:
+                        all_rotations.append(arg_rotation)
+
+    if not all_rotations:
+        await ctx.channel.send("No Rotations")
+        return
+
+    is_captain_channel = queue_is_captain_pick_for_channel(ctx.channel.id)
+    embed = Embed(title="Queues", color=Colour.blue())
+    ipg_embeds: list[Embed] = []
+    for rotation in all_rotations:
+        rotation_queues = [
+            queue
+            for queue in rotation.queues
+            if not queue.is_locked
+            and queue.is_captain_pick == is_captain_channel
+            and (not queue_indices or queue.ordinal in queue_indices)
+            and (not queue_names or queue.name.casefold() in queue_names)
+        ]
+        if not rotation_queues:
+            continue
+        if not rotation.next_map_str:
+            continue
+        rotation_queues_len = len(rotation_queues)
+        embed.add_field(
+            name=f"",
+            value=f"```asciidoc\n* {rotation.name}```",
+            inline=False,
         )
+        if rotation.skip_map_votes:
+            embed.add_field(
+                name=f"🗺️ ️Next Map",
+                value=rotation.next_map_str,
+                inline=True,
+            )
+            embed.add_field(
+                name="Votes to Skip",
+                value=f"[{rotation.skip_map_votes}/{config.MAP_VOTE_THRESHOLD}]",
+            )
+            embed.add_field(name="", value="")
+        else:
+            embed.add_field(
+                name=f"🗺️ ️Next Map",
+                value=rotation.next_map_str,
+                inline=False,
+            )
+
+        for i, queue in enumerate(rotation_queues):
+            queue_title_str = f"(**{queue.ordinal}**) {queue.name} [{len(queue.player_names)}/{queue.size}]"
+            newline = "\n"  # Escape sequence (backslash) not allowed in expression portion of f-string prior to Python 3.12
+            embed.add_field(
+                name=queue_title_str,
+                value=(
+                    "> \n** **"  # weird hack to create an empty quote
+                    if not queue.player_names
+                    else f">>> {newline.join(queue.player_names)}"
+                ),
+                inline=True,
+            )
+            if (i + 1) == rotation_queues_len and (i + 1) >= 5 and (i + 1) % 3 == 2:
+                # we have to do this "inline", since there can be multiple sets of queues per rotation in a single embed
+                # embeds are allowed 3 "columns" per "row"
+                # to line everything up nicely when there's >= 5 queues and only one "column" slot left, we add a blank
+                embed.add_field(name="", value="", inline=True)
+            ipg_embeds.extend(queue.game_embeds)
+    await ctx.channel.send(
+        embeds=[embed] + ipg_embeds,
+    )
 
 
 # TODO: Re-enable when configs are stored in the db
@@ -1375,6 +1353,7 @@ async def status(ctx: Context, *args):
 
 @bot.command()
 async def streams(ctx: Context):
+    twitch = get_twitch()
     if not twitch:
         await send_message(
             channel=ctx.message.channel,
@@ -1430,21 +1409,6 @@ async def _rebalance_game(
         .all()
     )
     player_ids: list[int] = list(map(lambda x: x.player_id, game_players))
-    """
-    # run get_even_teams in a separate process, so that it doesn't block the event loop
-    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
-    with concurrent.futures.ProcessPoolExecutor() as pool:
-        result = await loop.run_in_executor(
-            pool,
-            get_even_teams,
-            player_ids,
-            len(player_ids) // 2,
-            queue.is_rated,
-            queue.category_id,
-        )
-        players = result[0]
-        win_prob = result[1]
-    """
     players, win_prob, player_to_position = await get_even_teams(
         session,
         player_ids,
@@ -1457,28 +1421,25 @@ async def _rebalance_game(
         session.delete(game_player)
     game.win_probability = win_prob
     category = session.query(Category).filter(Category.id == queue.category_id).first()
-    player_category_trueskills: list[PlayerCategoryTrueskill] = []
+    player_category_trueskills: list[rating_cache.CachedRating] = []
     if len(player_to_position) > 0:
-        for player, queue_position in player_to_position.items():
-            pct = get_category_trueskill(
-                session,
-                db_config,
-                player.id,
-                queue.map_trueskill_enabled,
-                queue.category_id,
-                game.map_id,
-                queue_position.position_id,
-            )
-            player_category_trueskills.append(pct)
-    elif category:
-        player_category_trueskills: list[PlayerCategoryTrueskill] = (
-            session.query(PlayerCategoryTrueskill)
-            .filter(
-                PlayerCategoryTrueskill.category_id == category.id,
-                PlayerCategoryTrueskill.player_id.in_(player_ids),
-            )
-            .all()
+        player_category_trueskills = get_category_ratings(
+            session,
+            db_config,
+            [
+                (player.id, queue_position.position_id)
+                for player, queue_position in player_to_position.items()
+            ],
+            queue.map_trueskill_enabled,
+            queue.category_id,
+            game.map_id,
         )
+    elif category:
+        player_category_trueskills = [
+            rating
+            for player_id in player_ids
+            for rating in rating_cache.get_all(session, player_id, category.id).values()
+        ]
     if player_category_trueskills:
         average_trueskill = mean([x.mu for x in player_category_trueskills])
     else:
@@ -1827,7 +1788,13 @@ async def sub(ctx: Context, member: Member):
             game_message: discord.PartialMessage = game_channel.get_partial_message(
                 game.message_id
             )
-            coroutines.append(game_message.edit(embed=embed))
+            coroutines.append(
+                dispatcher.submit(
+                    channel_route(game_channel.id),
+                    partial(game_message.edit, embed=embed),
+                    key=("edit", game.message_id),
+                )
+            )
 
     # send the new discord.Embed to each player
     if be_voice_channel:
@@ -144,6 +144,18 @@ def _convert_to_int(value: str) -> int | None:
 LOG_LEVEL: str = _to_str(key="LOG_LEVEL", default="INFO")
 DATABASE_URI: str = _to_str(key="DATABASE_URI", required=False)
 DB_NAME = "tribes"
+# Connection pool of each of the sync and async Postgres engines
+DB_POOL_SIZE: int = _to_int(key="DB_POOL_SIZE", default=40)
+DB_MAX_OVERFLOW: int = _to_int(key="DB_MAX_OVERFLOW", default=50)
+DB_POOL_TIMEOUT: int = _to_int(key="DB_POOL_TIMEOUT", default=30)
+DB_POOL_RECYCLE: int = _to_int(key="DB_POOL_RECYCLE", default=1800)
+DB_POOL_PRE_PING: bool = _to_bool(key="DB_POOL_PRE_PING", default=True)
+# PRAGMAs set on every SQLite connection
+SQLITE_JOURNAL_MODE: str = _to_str(key="SQLITE_JOURNAL_MODE", default="WAL")
+SQLITE_SYNCHRONOUS: str = _to_str(key="SQLITE_SYNCHRONOUS", default="NORMAL")
+SQLITE_MMAP_SIZE: int = _to_int(key="SQLITE_MMAP_SIZE", default=256 * 1024 * 1024)
+SQLITE_CACHE_SIZE: int = _to_int(key="SQLITE_CACHE_SIZE", default=-64 * 1024)
+SQLITE_BUSY_TIMEOUT: int = _to_int(key="SQLITE_BUSY_TIMEOUT", default=15000)
 API_KEY: str = _to_str(key="DISCORD_API_KEY", required=True)
 CHANNEL_ID: int = _to_int(key="CHANNEL_ID", required=True)
 TRIBES_VOICE_CATEGORY_CHANNEL_ID: int = _to_int(
@@ -164,12 +176,12 @@ DEFAULT_VOICE_MOVE: bool = _to_bool(key="DEFAULT_VOICE_MOVE", default=False)
 VOICE_MOVE_LOBBY: int = _to_int(key="VOICE_MOVE_LOBBY", required=False)
 ALLOW_VULGAR_NAMES: bool = _to_bool(key="ALLOW_VULGAR_NAMES", default=False)
 ENABLE_DEBUG: bool = _to_bool(key="ENABLE_DEBUG", default=False)
+PROFILE_STARTUP: bool = _to_bool(key="PROFILE_STARTUP", default=False)
 ENABLE_RAFFLE: bool = _to_bool(key="ENABLE_RAFFLE", default=False)
 SHOW_TRUESKILL: bool = _to_bool(key="SHOW_TRUESKILL", default=False)
 SHOW_LEFT_RIGHT_TEAM: bool = _to_bool(key="SHOW_LEFT_RIGHT_TEAM", default=False)
 SHOW_CAPTAINS: bool = _to_bool(key="SHOW_CAPTAINS", default=False)
 DISABLE_MAP_ROTATION: bool = _to_bool(key="DISABLE_MAP_ROTATION", default=False)
-MAXIMUM_TEAM_COMBINATIONS = _to_int("MAXIMUM_TEAM_COMBINATIONS")
 LEADERBOARD_CHANNEL = _to_int(key="LEADERBOARD_CHANNEL")
 RE_ADD_DELAY: int = _to_int(key="RE_ADD_DELAY", default=30)
 REQUIRE_ADD_TARGET: bool = _to_bool(key="REQUIRE_ADD_TARGET", default=False)
@@ -186,7 +198,9 @@ DEFAULT_TRUESKILL_TAU: float = _to_float(
 )
 DEFAULT_TRUESKILL_BETA: float = DEFAULT_TRUESKILL_SIGMA / 2
 TRUESKILL_SIGMA_DECAY_JOB_SCHEDULED_TIME: datetime.time = _to_time(key="TRUESKILL_SIGMA_DECAY_JOB_SCHEDULED_TIME", default=datetime.time(0, 0, tzinfo=datetime.timezone.utc))
+SIGMA_DECAY_AUDIT: bool = _to_bool(key="SIGMA_DECAY_AUDIT", default=False)
 AFK_TIME_MINUTES: int = _to_int(key="AFK_TIME_MINUTES", default=45)
+ACTIVITY_FLUSH_SECONDS: float = _to_float(key="ACTIVITY_FLUSH_SECONDS", default=5)
 MAP_ROTATION_MINUTES: int = _to_int(key="MAP_ROTATION_MINUTES", default=60)
 DEFAULT_RAFFLE_VALUE: int = _to_int(key="DEFAULT_RAFFLE_VALUE", default=5)
 DISABLE_PRIVATE_MESSAGES: bool = _to_bool(key="DISABLE_PRIVATE_MESSAGES", default=False)
@@ -200,6 +214,7 @@ MAP_VOTE_THRESHOLD: int = _to_int(key="MAP_VOTE_THRESHOLD", default=7)
 STATS_DIR: str | None = _to_str(key="STATS_DIR")
 STATS_WIDTH = _to_int(key="STATS_WIDTH")
 STATS_HEIGHT = _to_int(key="STATS_HEIGHT")
+STATS_RENDER_WORKERS: int = _to_int(key="STATS_RENDER_WORKERS", default=1)
 ECONOMY_ENABLED: bool = _to_bool(key="ECONOMY_ENABLED", default=False)
 CURRENCY_NAME: str = _to_str(key="CURRENCY_NAME", default="Shazbucks")
 STARTING_CURRENCY: int = _to_int(key="STARTING_CURRENCY", default=100)
@@ -210,5 +225,10 @@ ADMIN_LOG_CHANNEL: int = _to_int(key="ADMIN_LOG_CHANNEL")
 ADMIN_AUTOSUB: bool = _to_bool(key="ADMIN_AUTOSUB", default=False)
 POP_RANDOM_QUEUE: bool = _to_bool(key="POP_RANDOM_QUEUE", default=False)
 MM_SIGMA_MULT: float = _to_float(key="MM_SIGMA_MULT", default=0)
+MATCHMAKING_WORKERS: int = _to_int(key="MATCHMAKING_WORKERS", default=1)
+MATCHMAKING_TIMEOUT: float = _to_float(key="MATCHMAKING_TIMEOUT", default=5)
+DISPATCH_CONCURRENCY: int = _to_int(key="DISPATCH_CONCURRENCY", default=10)
+DISPATCH_ROUTE_CONCURRENCY: int = _to_int(key="DISPATCH_ROUTE_CONCURRENCY", default=4)
+DISPATCH_MAX_RETRIES: int = _to_int(key="DISPATCH_MAX_RETRIES", default=3)
 
 # TODO grouping here and in docs
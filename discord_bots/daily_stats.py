@@ -0,0 +1,223 @@
+"""
+Per-player daily win/loss/tie counters (PlayerDailyStats), so /stats and
+/map stats can sum a few rows instead of loading every game a player has
+finished.
+
+finish_in_progress_game records each game, /admin deletegame removes it and
+/admin editgamewinner moves it to the new outcome.
+Games finished before these counters existed are added by
+scripts/backfill_player_daily_stats.py.
+"""
+
+import logging
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy import case, func
+from sqlalchemy.orm.session import Session as SQLAlchemySession
+
+from discord_bots.models import FinishedGame, FinishedGamePlayer, PlayerDailyStats
+
+_log = logging.getLogger(__name__)
+
+
+def _day(finished_at: datetime) -> date:
+    if finished_at.tzinfo:
+        finished_at = finished_at.astimezone(timezone.utc)
+    return finished_at.date()
+
+
+def _today() -> date:
+    return datetime.now(timezone.utc).date()
+
+
+def record_game(
+    session: SQLAlchemySession,
+    finished_game: FinishedGame,
+    finished_game_players: list[FinishedGamePlayer],
+    sign: int = 1,
+):
+    """
+    Add the result of a finished game to its players' counters, or remove it
+    with sign=-1. Doesn't commit.
+    """
+    day = _day(finished_game.finished_at)
+    category_name = finished_game.category_name or ""
+    map_full_name = finished_game.map_full_name or ""
+    player_ids = [fgp.player_id for fgp in finished_game_players]
+    rows: dict[tuple[int, str], PlayerDailyStats] = {
+        (row.player_id, row.position_name): row
+        for row in session.query(PlayerDailyStats).filter(
+            PlayerDailyStats.player_id.in_(player_ids),
+            PlayerDailyStats.day == day,
+            PlayerDailyStats.category_name == category_name,
+            PlayerDailyStats.map_full_name == map_full_name,
+            PlayerDailyStats.is_captain_pick == finished_game.is_captain_pick,
+        )
+    }
+    for fgp in finished_game_players:
+        key = (fgp.player_id, fgp.position_name or "")
+        row = rows.get(key)
+        if not row:
+            if sign < 0:
+                continue
+            row = PlayerDailyStats(
+                player_id=fgp.player_id,
+                day=day,
+                category_name=category_name,
+                map_full_name=map_full_name,
+                position_name=key[1],
+                is_captain_pick=finished_game.is_captain_pick,
+            )
+            rows[key] = row
+            session.add(row)
+        if finished_game.winning_team == -1:
+            row.ties += sign
+        elif finished_game.winning_team == fgp.team:
+            row.wins += sign
+        else:
+            row.losses += sign
+        if row.wins <= 0 and row.losses <= 0 and row.ties <= 0:
+            session.delete(row)
+
+
+def remove_game(session: SQLAlchemySession, finished_game: FinishedGame):
+    """
+    Take a finished game that's about to be deleted out of its players'
+    counters. Doesn't commit.
+    """
+    finished_game_players = (
+        session.query(FinishedGamePlayer)
+        .filter(FinishedGamePlayer.finished_game_id == finished_game.id)
+        .all()
+    )
+    record_game(session, finished_game, finished_game_players, sign=-1)
+
+
+def wins_losses_ties(
+    session: SQLAlchemySession,
+    player_id: int,
+    last_ndays: list[int | None],
+    category_name: str | None = None,
+    map_full_name: str | None = None,
+    position_name: str | None = None,
+    is_captain_pick: bool | None = None,
+) -> list[tuple[int, int, int]]:
+    """
+    Sum a player's counters over several periods in one query.
+
+    :param last_ndays: For each period, the number of days back, or None for
+    all time. The counters are per UTC day, so a period is n whole days,
+    today included, rather than the n*24 hours up to now.
+    :param category_name: Only count this category, or all if None. Same for
+    map_full_name, position_name and is_captain_pick.
+    :returns: (wins, losses, ties) for each period in last_ndays
+    """
+    columns = []
+    for n in last_ndays:
+        for counter in (
+            PlayerDailyStats.wins,
+            PlayerDailyStats.losses,
+            PlayerDailyStats.ties,
+        ):
+            if n is not None:
+                since = _today() - timedelta(days=n)
+                counter = case((PlayerDailyStats.day > since, counter), else_=0)
+            columns.append(func.coalesce(func.sum(counter), 0))
+    filters = [PlayerDailyStats.player_id == player_id]
+    if category_name is not None:
+        filters.append(PlayerDailyStats.category_name == category_name)
+    if map_full_name is not None:
+        filters.append(PlayerDailyStats.map_full_name == map_full_name)
+    if position_name is not None:
+        filters.append(PlayerDailyStats.position_name == position_name)
+    if is_captain_pick is not None:
+        filters.append(PlayerDailyStats.is_captain_pick == is_captain_pick)
+    sums = session.query(*columns).filter(*filters).one()
+    return [tuple(sums[i : i + 3]) for i in range(0, len(sums), 3)]
+
+
+def wins_losses_ties_by_map(
+    session: SQLAlchemySession,
+    player_id: int,
+    category_name: str | None = None,
+) -> dict[str, tuple[int, int, int]]:
+    """
+    :returns: A player's all time (wins, losses, ties) in non captain pick
+    games, by map full name
+    """
+    filters = [
+        PlayerDailyStats.player_id == player_id,
+        PlayerDailyStats.is_captain_pick == False,
+    ]
+    if category_name is not None:
+        filters.append(PlayerDailyStats.category_name == category_name)
+    return {
+        map_full_name: (wins, losses, ties)
+        for map_full_name, wins, losses, ties in session.query(
+            PlayerDailyStats.map_full_name,
+            func.sum(PlayerDailyStats.wins),
+            func.sum(PlayerDailyStats.losses),
+            func.sum(PlayerDailyStats.ties),
+        )
+        .filter(*filters)
+        .group_by(PlayerDailyStats.map_full_name)
+    }
+
+
+def backfill(session: SQLAlchemySession) -> int:
+    """
+    Rebuild every counter from finished_game and finished_game_player with a
+    single GROUP BY. Doesn't commit.
+
+    :returns: The number of rows written
+    """
+    is_tie = FinishedGame.winning_team == -1
+    is_win = FinishedGame.winning_team == FinishedGamePlayer.team
+    category_name = func.coalesce(FinishedGame.category_name, "")
+    map_full_name = func.coalesce(FinishedGame.map_full_name, "")
+    position_name = func.coalesce(FinishedGamePlayer.position_name, "")
+    day = func.date(FinishedGame.finished_at)
+    query = (
+        session.query(
+            FinishedGamePlayer.player_id,
+            day,
+            category_name,
+            map_full_name,
+            position_name,
+            FinishedGame.is_captain_pick,
+            func.sum(case((is_win, 1), else_=0)),
+            func.sum(case((~is_win & ~is_tie, 1), else_=0)),
+            func.sum(case((is_tie, 1), else_=0)),
+        )
+        .join(FinishedGame, FinishedGame.id == FinishedGamePlayer.finished_game_id)
+        .group_by(
+            FinishedGamePlayer.player_id,
+            day,
+            category_name,
+            map_full_name,
+            position_name,
+            FinishedGame.is_captain_pick,
+        )
+    )
+    session.query(PlayerDailyStats).delete()
+    count = 0
+    for row in query:
+        player_id, day, category_name, map_full_name, position_name = row[:5]
+        is_captain_pick, wins, losses, ties = row[5:]
+        session.add(
+            PlayerDailyStats(
+                player_id=player_id,
+                # SQLite returns the date as a string
+                day=date.fromisoformat(day) if isinstance(day, str) else day,
+                category_name=category_name,
+                map_full_name=map_full_name,
+                position_name=position_name,
+                is_captain_pick=is_captain_pick,
+                wins=wins,
+                losses=losses,
+                ties=ties,
+            )
+        )
+        count += 1
+    _log.info(f"[daily_stats.backfill] Wrote {count} player daily stats")
+    return count
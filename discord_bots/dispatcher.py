@@ -0,0 +1,286 @@
+"""
+Every DM, voice move and channel message the bot sends goes through one
+dispatcher, so a queue popping doesn't fire dozens of requests at Discord at
+once and run into its rate limits.
+
+Requests are queued with a route and a priority. At most DISPATCH_CONCURRENCY
+requests run at once, and at most DISPATCH_ROUTE_CONCURRENCY per route, where
+a route is roughly one of Discord's rate limit buckets (see the *_route
+functions). Of the queued requests that can start, the one with the highest
+priority starts first, so telling players their game has begun isn't stuck
+behind AFK notices. Queuing a request with the same key as one that hasn't
+started yet replaces it, so an embed edited every few seconds is only edited
+once however far behind the dispatcher is. Requests that fail with a 429 or a
+server error are retried with backoff, up to DISPATCH_MAX_RETRIES times.
+
+discord.py already waits out the rate limits it knows about, and retries some
+429s itself. Those are counted from its log, see _RateLimitCounter.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Hashable
+
+import aiohttp
+import discord
+
+import discord_bots.config as config
+
+_log = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    # Lower goes first
+    POP = 0  # Telling players a game started, moving them to its channels
+    NORMAL = 1  # Replies and announcements
+    BACKGROUND = 2  # AFK notices, map rotations, embed refreshes
+
+
+def dm_route() -> str:
+    # Opening a DM channel is one bucket for the whole bot
+    return "dm"
+
+
+def channel_route(channel_id: int) -> str:
+    return f"channel:{channel_id}"
+
+
+def voice_move_route(guild_id: int) -> str:
+    return f"voice_move:{guild_id}"
+
+
+@dataclass
+class DispatchMetrics:
+    """
+    :sent: Requests that succeeded
+    :failed: Requests that failed after any retries
+    :retries: Requests retried after a 429 or server error
+    :rate_limited: 429s, the ones discord.py retried itself included
+    :coalesced: Requests replaced by a newer one with the same key before
+    they started
+    :queue_depth: Requests waiting to start
+    :queue_wait_seconds: By priority, how long requests waited to start
+    """
+
+    sent: int = 0
+    failed: int = 0
+    retries: int = 0
+    rate_limited: int = 0
+    coalesced: int = 0
+    queue_depth: int = 0
+    max_queue_depth: int = 0
+    started: Counter = field(default_factory=Counter)
+    total_queue_wait_seconds: dict[Priority, float] = field(
+        default_factory=lambda: defaultdict(float)
+    )
+    max_queue_wait_seconds: dict[Priority, float] = field(
+        default_factory=lambda: defaultdict(float)
+    )
+
+    def record_wait(self, priority: Priority, queue_wait_seconds: float):
+        self.started[priority] += 1
+        self.total_queue_wait_seconds[priority] += queue_wait_seconds
+        self.max_queue_wait_seconds[priority] = max(
+            self.max_queue_wait_seconds[priority], queue_wait_seconds
+        )
+
+    def mean_queue_wait_seconds(self, priority: Priority) -> float:
+        started = self.started[priority]
+        return self.total_queue_wait_seconds[priority] / started if started else 0.0
+
+
+@dataclass
+class _Request:
+    route: str
+    send: Callable[[], Awaitable[Any]]
+    priority: Priority
+    key: Hashable | None
+    submitted_at: float
+    future: asyncio.Future
+    started: bool = False
+
+
+class Dispatcher:
+    def __init__(
+        self,
+        concurrency: int | None = None,
+        route_concurrency: int | None = None,
+        max_retries: int | None = None,
+        backoff_seconds: float = 0.5,
+    ):
+        self.concurrency = max(
+            1, config.DISPATCH_CONCURRENCY if concurrency is None else concurrency
+        )
+        self.route_concurrency = max(
+            1,
+            (
+                config.DISPATCH_ROUTE_CONCURRENCY
+                if route_concurrency is None
+                else route_concurrency
+            ),
+        )
+        self.max_retries = (
+            config.DISPATCH_MAX_RETRIES if max_retries is None else max_retries
+        )
+        self.backoff_seconds = backoff_seconds
+        self.metrics = DispatchMetrics()
+        # (priority, sequence, request). A request whose priority was raised
+        # by coalescing is in here twice, the entry left behind is skipped.
+        self._heap: list[tuple[int, int, _Request]] = []
+        self._sequence = itertools.count()
+        self._queued_by_key: dict[Hashable, _Request] = {}
+        self._running = 0
+        self._running_by_route: Counter = Counter()
+        # Keeps the running requests from being garbage collected
+        self._tasks: set[asyncio.Task] = set()
+
+    def submit(
+        self,
+        route: str,
+        send: Callable[[], Awaitable[Any]],
+        priority: Priority = Priority.NORMAL,
+        key: Hashable | None = None,
+    ) -> asyncio.Future:
+        """
+        Queue a request to Discord. Returns straight away.
+
+        :param route: Which rate limit bucket the request counts against
+        :param send: Makes the request, e.g. functools.partial(channel.send,
+        embed=embed). Called again for every retry.
+        :param key: If a request with the same key hasn't started yet, send
+        replaces its send instead of queuing another request
+        :returns: A future with the result of send, or the exception it
+        failed with. Failures are logged, so it doesn't have to be awaited.
+        """
+        loop = asyncio.get_running_loop()
+        queued = self._queued_by_key.get(key) if key is not None else None
+        if queued is not None:
+            queued.send = send
+            self.metrics.coalesced += 1
+            if priority < queued.priority:
+                queued.priority = priority
+                heapq.heappush(self._heap, (priority, next(self._sequence), queued))
+                self._start_ready()
+            return queued.future
+
+        request = _Request(
+            route, send, priority, key, loop.time(), loop.create_future()
+        )
+        # Retrieve the exception, so one nobody awaited isn't reported again
+        request.future.add_done_callback(
+            lambda future: future.cancelled() or future.exception()
+        )
+        if key is not None:
+            self._queued_by_key[key] = request
+        heapq.heappush(self._heap, (priority, next(self._sequence), request))
+        self.metrics.queue_depth += 1
+        self.metrics.max_queue_depth = max(
+            self.metrics.max_queue_depth, self.metrics.queue_depth
+        )
+        self._start_ready()
+        return request.future
+
+    def _start_ready(self):
+        """
+        Start queued requests by priority, for as long as there's capacity
+        """
+        blocked: list[tuple[int, int, _Request]] = []
+        while self._heap and self._running < self.concurrency:
+            entry = heapq.heappop(self._heap)
+            request = entry[2]
+            if request.started:
+                continue
+            if self._running_by_route[request.route] >= self.route_concurrency:
+                blocked.append(entry)
+                continue
+            request.started = True
+            if request.key is not None:
+                self._queued_by_key.pop(request.key, None)
+            self._running += 1
+            self._running_by_route[request.route] += 1
+            self.metrics.queue_depth -= 1
+            self.metrics.record_wait(
+                request.priority,
+                asyncio.get_running_loop().time() - request.submitted_at,
+            )
+            task = asyncio.create_task(self._run(request))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        for entry in blocked:
+            heapq.heappush(self._heap, entry)
+
+    def _retry_after(self, e: Exception, attempt: int) -> float | None:
+        """
+        :returns: Seconds to wait before retrying, or None if the request
+        shouldn't be retried
+        """
+        backoff = self.backoff_seconds * 2**attempt
+        backoff += random.uniform(0, self.backoff_seconds)
+        if isinstance(e, discord.RateLimited):
+            self.metrics.rate_limited += 1
+            return e.retry_after
+        if isinstance(e, discord.HTTPException):
+            if e.status == 429:
+                self.metrics.rate_limited += 1
+                retry_after = getattr(e.response, "headers", {}).get("Retry-After")
+                return float(retry_after) if retry_after else backoff
+            return backoff if e.status >= 500 else None
+        if isinstance(e, (aiohttp.ClientError, asyncio.TimeoutError)):
+            return backoff
+        return None
+
+    async def _run(self, request: _Request):
+        try:
+            for attempt in itertools.count():
+                try:
+                    result = await request.send()
+                except Exception as e:
+                    retry_after = self._retry_after(e, attempt)
+                    if retry_after is None or attempt >= self.max_retries:
+                        self.metrics.failed += 1
+                        _log.warning(
+                            f"[Dispatcher] {request.route} request failed after {attempt + 1} attempt(s): {e!r}"
+                        )
+                        if not request.future.done():
+                            request.future.set_exception(e)
+                        return
+                    self.metrics.retries += 1
+                    await asyncio.sleep(retry_after)
+                else:
+                    self.metrics.sent += 1
+                    if not request.future.done():
+                        request.future.set_result(result)
+                    return
+        except asyncio.CancelledError:
+            request.future.cancel()
+            raise
+        finally:
+            self._running -= 1
+            self._running_by_route[request.route] -= 1
+            self._start_ready()
+
+
+dispatcher = Dispatcher()
+
+
+class _RateLimitCounter(logging.Filter):
+    """
+    Counts the 429s discord.py handles itself, which it logs as warnings
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if isinstance(record.msg, str) and (
+            record.msg.startswith("We are being rate limited")
+            or record.msg.startswith("Global rate limit has been hit")
+        ):
+            dispatcher.metrics.rate_limited += 1
+        return True
+
+
+logging.getLogger("discord.http").addFilter(_RateLimitCounter())
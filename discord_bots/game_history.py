@@ -0,0 +1,168 @@
+"""
+Loads finished games and their players for the offline scripts in one ordered
+query, streamed in chunks, into numpy columns instead of ORM objects.
+
+Games are ordered by finished_at (then id). The players of game i are the
+rows offsets[i]:offsets[i + 1] of the player columns.
+"""
+
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm.session import Session as SQLAlchemySession
+
+from discord_bots.models import FinishedGame, FinishedGamePlayer
+
+_log = logging.getLogger(__name__)
+
+
+@dataclass
+class GameHistory:
+    # One entry per game
+    ids: list[str]
+    game_ids: list[str]
+    queue_names: list[str]
+    category_names: list[str | None]
+    map_short_names: list[str]
+    started_at: np.ndarray
+    finished_at: np.ndarray
+    winning_team: np.ndarray
+    is_rated: np.ndarray
+    win_probability: np.ndarray
+    offsets: np.ndarray
+    # One entry per player per game
+    player_ids: np.ndarray
+    teams: np.ndarray
+    mu_before: np.ndarray
+    sigma_before: np.ndarray
+    mu_after: np.ndarray
+    sigma_after: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def players(self, game_index: int) -> slice:
+        """
+        :returns: The slice of the player columns that belongs to a game
+        """
+        return slice(self.offsets[game_index], self.offsets[game_index + 1])
+
+
+def load(
+    session: SQLAlchemySession,
+    *filters,
+    descending: bool = False,
+    limit: int | None = None,
+    chunk_size: int = 10000,
+) -> GameHistory:
+    """
+    Load every finished game matching the filters, with their players.
+
+    :param filters: Filters on FinishedGame, e.g. FinishedGame.category_name == "NA"
+    :param descending: Newest game first instead of oldest
+    :param limit: Only the first limit games in that order
+    :param chunk_size: How many player rows to fetch at a time
+    """
+    order_by = (
+        (FinishedGame.finished_at.desc(), FinishedGame.id.desc())
+        if descending
+        else (FinishedGame.finished_at, FinishedGame.id)
+    )
+    if limit is not None:
+        filters = (
+            FinishedGame.id.in_(
+                select(FinishedGame.id)
+                .filter(*filters)
+                .order_by(*order_by)
+                .limit(limit)
+                .scalar_subquery()
+            ),
+        )
+    query = (
+        session.query(
+            FinishedGame.id,
+            FinishedGame.game_id,
+            FinishedGame.queue_name,
+            FinishedGame.category_name,
+            FinishedGame.map_short_name,
+            FinishedGame.started_at,
+            FinishedGame.finished_at,
+            FinishedGame.winning_team,
+            FinishedGame.is_rated,
+            FinishedGame.win_probability,
+            FinishedGamePlayer.player_id,
+            FinishedGamePlayer.team,
+            FinishedGamePlayer.rated_trueskill_mu_before,
+            FinishedGamePlayer.rated_trueskill_sigma_before,
+            FinishedGamePlayer.rated_trueskill_mu_after,
+            FinishedGamePlayer.rated_trueskill_sigma_after,
+        )
+        .join(
+            FinishedGamePlayer, FinishedGamePlayer.finished_game_id == FinishedGame.id
+        )
+        .filter(*filters)
+        .order_by(*order_by)
+        .yield_per(chunk_size)
+    )
+
+    ids: list[str] = []
+    game_ids: list[str] = []
+    queue_names: list[str] = []
+    category_names: list[str | None] = []
+    map_short_names: list[str] = []
+    started_at: list[datetime] = []
+    finished_at: list[datetime] = []
+    winning_team: list[int] = []
+    is_rated: list[bool] = []
+    win_probability: list[float] = []
+    offsets: list[int] = []
+    player_ids: list[int] = []
+    teams: list[int] = []
+    mu_before: list[float] = []
+    sigma_before: list[float] = []
+    mu_after: list[float] = []
+    sigma_after: list[float] = []
+    for row in query:
+        if not ids or ids[-1] != row[0]:
+            ids.append(row[0])
+            game_ids.append(row[1])
+            queue_names.append(row[2])
+            category_names.append(row[3])
+            map_short_names.append(row[4])
+            started_at.append(row[5])
+            finished_at.append(row[6])
+            winning_team.append(row[7])
+            is_rated.append(row[8])
+            win_probability.append(row[9])
+            offsets.append(len(player_ids))
+        player_ids.append(row[10])
+        teams.append(row[11])
+        mu_before.append(row[12])
+        sigma_before.append(row[13])
+        mu_after.append(row[14])
+        sigma_after.append(row[15])
+    offsets.append(len(player_ids))
+
+    _log.info(f"[game_history.load] Loaded {len(ids)} games, {len(player_ids)} players")
+    return GameHistory(
+        ids=ids,
+        game_ids=game_ids,
+        queue_names=queue_names,
+        category_names=category_names,
+        map_short_names=map_short_names,
+        started_at=np.array(started_at, dtype="datetime64[us]"),
+        finished_at=np.array(finished_at, dtype="datetime64[us]"),
+        winning_team=np.array(winning_team, dtype=np.int8),
+        is_rated=np.array(is_rated, dtype=bool),
+        win_probability=np.array(win_probability, dtype=np.float64),
+        offsets=np.array(offsets, dtype=np.int64),
+        player_ids=np.array(player_ids, dtype=np.int64),
+        teams=np.array(teams, dtype=np.int8),
+        mu_before=np.array(mu_before, dtype=np.float64),
+        sigma_before=np.array(sigma_before, dtype=np.float64),
+        mu_after=np.array(mu_after, dtype=np.float64),
+        sigma_after=np.array(sigma_after, dtype=np.float64),
+    )
@@ -0,0 +1,120 @@
+"""
+Process-wide index of which in progress game each player is in, so checking
+whether a player is in a game (on every add, waitlist and sub) doesn't have
+to query in_progress_game_player.
+
+The index is built from in_progress_game_player once at startup. Players
+added to or deleted from a game through the ORM anywhere in the bot (a game
+popping, a sub, a rebalance) are written through when their session commits,
+and dropped if it rolls back. Bulk query().delete() statements skip the ORM,
+so code using them to remove a game's players has to call remove_game().
+"""
+
+import logging
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session as SQLAlchemySession
+
+from discord_bots.models import InProgressGame, InProgressGamePlayer
+
+_log = logging.getLogger(__name__)
+
+# player_id -> in_progress_game_id
+_game_ids: dict[int, str] = {}
+_warm: bool = False
+
+
+def warm(session: SQLAlchemySession):
+    """
+    Load every in progress game player into the index. Called at bot setup.
+    """
+    global _warm
+    _game_ids.clear()
+    for player_id, in_progress_game_id in session.query(
+        InProgressGamePlayer.player_id, InProgressGamePlayer.in_progress_game_id
+    ).join(InProgressGame):
+        _game_ids[player_id] = in_progress_game_id
+    _warm = True
+    _log.info(f"[game_index.warm] Indexed {len(_game_ids)} players in games")
+
+
+def is_warm() -> bool:
+    return _warm
+
+
+def game_id(player_id: int) -> str | None:
+    """
+    :returns: The id of the in progress game the player is in, if any. Only
+    meaningful once warm() has run.
+    """
+    return _game_ids.get(player_id)
+
+
+def player_ids(in_progress_game_id: str) -> list[int]:
+    return [
+        player_id
+        for player_id, game_id_ in _game_ids.items()
+        if game_id_ == in_progress_game_id
+    ]
+
+
+# (player_id, removed from game id, added to game id), in the order they
+# were made. A player_id of None removes every player in the game.
+_Change = tuple[int | None, str | None, str | None]
+_PENDING_CHANGES_KEY = "game_index_pending_changes"
+
+
+def _pending(session: SQLAlchemySession | AsyncSession) -> list[_Change]:
+    return session.info.setdefault(_PENDING_CHANGES_KEY, [])
+
+
+def remove_game(session: SQLAlchemySession | AsyncSession, in_progress_game_id: str):
+    """
+    Remove every player in the game from the index when the session commits
+    """
+    _pending(session).append((None, in_progress_game_id, None))
+
+
+def _apply(changes: list[_Change]):
+    for player_id, removed_from, added_to in changes:
+        if player_id is None:
+            for player_id_ in player_ids(removed_from):
+                del _game_ids[player_id_]
+            continue
+        if removed_from is not None and _game_ids.get(player_id) == removed_from:
+            del _game_ids[player_id]
+        if added_to is not None:
+            _game_ids[player_id] = added_to
+
+
+@event.listens_for(SQLAlchemySession, "after_flush")
+def _after_flush(session: SQLAlchemySession, _flush_context):
+    # Deletes first, so a player deleted and added back in one flush (e.g. a
+    # rebalance) stays in the game
+    changes = [
+        (obj.player_id, obj.in_progress_game_id, None)
+        for obj in session.deleted
+        if isinstance(obj, InProgressGamePlayer)
+    ]
+    changes += [
+        (obj.player_id, None, obj.in_progress_game_id)
+        for obj in session.new
+        if isinstance(obj, InProgressGamePlayer)
+    ]
+    if changes:
+        _pending(session).extend(changes)
+
+
+@event.listens_for(SQLAlchemySession, "after_commit")
+def _after_commit(session: SQLAlchemySession):
+    changes = session.info.pop(_PENDING_CHANGES_KEY, None)
+    if changes:
+        _apply(changes)
+
+
+@event.listens_for(SQLAlchemySession, "after_transaction_end")
+def _after_transaction_end(session: SQLAlchemySession, transaction):
+    # Anything still pending here was rolled back
+    if transaction.parent is None:
+        session.info.pop(_PENDING_CHANGES_KEY, None)
@@ -0,0 +1,190 @@
+"""
+Process-wide counts of the games each player played per category in the last
+LEADERBOARD_DAYS days, which decide who is eligible for the leaderboard, so
+print_leaderboard doesn't have to GROUP BY over finished_game_player.
+
+The counts are warmed once at startup. FinishedGames (and their players)
+committed through the ORM anywhere in the bot are added when their session
+commits, deleted FinishedGames are removed, and games older than
+LEADERBOARD_DAYS drop out the next time the counts are read. Like the leaderboard
+always has, captain pick games don't count.
+"""
+
+import heapq
+import logging
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session as SQLAlchemySession
+
+from discord_bots.models import FinishedGame, FinishedGamePlayer
+
+_log = logging.getLogger(__name__)
+
+LEADERBOARD_DAYS = 30
+
+
+# finished_game_id -> (category_name, player_ids)
+_games: dict[str, tuple[str, list[int]]] = {}
+# (started_at, finished_game_id), oldest first, to expire games
+_games_by_started_at: list[tuple[datetime, str]] = []
+# category_name -> player_id -> games in the last LEADERBOARD_DAYS days
+_counts: dict[str, Counter[int]] = {}
+# Whether a game was added or removed since the leaderboard was last printed
+_dirty: bool = True
+
+
+def _naive_utc(value: datetime) -> datetime:
+    if value.tzinfo:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _cutoff() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(
+        days=LEADERBOARD_DAYS
+    )
+
+
+def _add_game(finished_game_id: str, category_name: str, started_at: datetime):
+    global _dirty
+    started_at = _naive_utc(started_at)
+    if finished_game_id in _games or started_at <= _cutoff():
+        return
+    _games[finished_game_id] = (category_name, [])
+    heapq.heappush(_games_by_started_at, (started_at, finished_game_id))
+    _dirty = True
+
+
+def _add_player(finished_game_id: str, player_id: int):
+    global _dirty
+    game = _games.get(finished_game_id)
+    if not game:
+        # An old game, a captain pick game, or one without a category
+        return
+    category_name, player_ids = game
+    player_ids.append(player_id)
+    _counts.setdefault(category_name, Counter())[player_id] += 1
+    _dirty = True
+
+
+def _remove_game(finished_game_id: str):
+    global _dirty
+    game = _games.pop(finished_game_id, None)
+    if not game:
+        return
+    category_name, player_ids = game
+    counts = _counts[category_name]
+    counts.subtract(player_ids)
+    for player_id in player_ids:
+        if counts[player_id] <= 0:
+            del counts[player_id]
+    _dirty = True
+
+
+def _expire():
+    cutoff = _cutoff()
+    while _games_by_started_at and _games_by_started_at[0][0] <= cutoff:
+        _, finished_game_id = heapq.heappop(_games_by_started_at)
+        _remove_game(finished_game_id)
+
+
+def warm(session: SQLAlchemySession):
+    """
+    Count every player's recent games. Called at bot setup.
+    """
+    _games.clear()
+    _games_by_started_at.clear()
+    _counts.clear()
+    for finished_game_id, category_name, started_at, player_id in (
+        session.query(
+            FinishedGame.id,
+            FinishedGame.category_name,
+            FinishedGame.started_at,
+            FinishedGamePlayer.player_id,
+        )
+        .join(
+            FinishedGamePlayer,
+            FinishedGamePlayer.finished_game_id == FinishedGame.id,
+        )
+        .filter(
+            FinishedGame.started_at > _cutoff(),
+            FinishedGame.category_name != None,
+            FinishedGame.is_captain_pick == False,
+        )
+    ):
+        _add_game(finished_game_id, category_name, started_at)
+        _add_player(finished_game_id, player_id)
+    _log.info(
+        f"[leaderboard.warm] Loaded {len(_games)} games from the last {LEADERBOARD_DAYS} days"
+    )
+
+
+def eligible_player_ids(category_name: str, min_games: int) -> list[int]:
+    """
+    :returns: The ids of players who played at least min_games (and at least
+    one) games of the category in the last LEADERBOARD_DAYS days
+    """
+    _expire()
+    return [
+        player_id
+        for player_id, count in _counts.get(category_name, Counter()).items()
+        if count >= min_games
+    ]
+
+
+def mark_dirty():
+    """
+    Have the leaderboard reprinted on the next leaderboard_task run, e.g.
+    after ratings changed
+    """
+    global _dirty
+    _dirty = True
+
+
+def take_dirty() -> bool:
+    """
+    :returns: Whether the leaderboard changed since the last call
+    """
+    global _dirty
+    _expire()
+    dirty, _dirty = _dirty, False
+    return dirty
+
+
+# Same as rating_cache: remember what each flush changed, apply it once the
+# session commits, and throw it away if it rolls back
+_PENDING_CHANGES_KEY = "leaderboard_pending_changes"
+
+
+@event.listens_for(SQLAlchemySession, "after_flush")
+def _after_flush(session: SQLAlchemySession, _flush_context):
+    changes: list = session.info.setdefault(_PENDING_CHANGES_KEY, [])
+    for obj in session.new:
+        if (
+            isinstance(obj, FinishedGame)
+            and obj.category_name
+            and not obj.is_captain_pick
+        ):
+            changes.append((_add_game, obj.id, obj.category_name, obj.started_at))
+        elif isinstance(obj, FinishedGamePlayer):
+            changes.append((_add_player, obj.finished_game_id, obj.player_id))
+    for obj in session.deleted:
+        if isinstance(obj, FinishedGame):
+            changes.append((_remove_game, obj.id))
+
+
+@event.listens_for(SQLAlchemySession, "after_commit")
+def _after_commit(session: SQLAlchemySession):
+    changes = session.info.pop(_PENDING_CHANGES_KEY, [])
+    # Games first, in case their players were flushed before them
+    for apply, *args in sorted(changes, key=lambda change: change[0] != _add_game):
+        apply(*args)
+
+
+@event.listens_for(SQLAlchemySession, "after_transaction_end")
+def _after_transaction_end(session: SQLAlchemySession, transaction):
+    # Anything still pending here was rolled back
+    if transaction.parent is None:
+        session.info.pop(_PENDING_CHANGES_KEY, None)
@@ -10,7 +10,13 @@ from discord.app_commands import AppCommandError, errors
 from discord.ext.commands import CommandError, CommandNotFound, Context, UserInputError
 from trueskill import setup as trueskill_setup
 
+import discord_bots.activity as activity
 import discord_bots.config as config
+import discord_bots.game_index as game_index
+import discord_bots.leaderboard as leaderboard
+import discord_bots.rank_index as rank_index
+import discord_bots.rating_cache as rating_cache
+import discord_bots.stats_render as stats_render
 from discord_bots.async_db_utils import (
     async_delete_where,
     async_query_first,
@@ -38,11 +44,11 @@ from discord_bots.cogs.rotation import RotationCommands
 from discord_bots.cogs.schedule import ScheduleCommands, ScheduleUtils
 from discord_bots.cogs.trueskill import TrueskillCommands
 from discord_bots.cogs.vote import VoteCommands
+from discord_bots.matchmaking import shutdown_pool, start_pool
 from discord_bots.utils import utc_now_naive
 
 from .bot import bot
 from .models import (
-    AsyncSessionLocal,
     Config,
     CustomCommand,
     MapVote,
@@ -54,6 +60,7 @@ from .models import (
     VotePassedWaitlistPlayer,
 )
 from .tasks import (
+    activity_flush_task,
     add_player_task,
     afk_timer_task,
     leaderboard_task,
@@ -198,24 +205,7 @@ async def on_message(message: Message):
         )
         or (captain_channel_id is not None and message.channel.id == captain_channel_id)
     ):
-        async with async_session() as session:
-            player: Player | None = await async_query_first(
-                session, Player, Player.id == message.author.id
-            )
-            if player:
-                player.last_activity_at = utc_now_naive()
-                if player.name != message.author.display_name:
-                    player.name = message.author.display_name
-            else:
-                session.add(
-                    Player(
-                        id=message.author.id,
-                        name=message.author.display_name,
-                        last_activity_at=utc_now_naive(),
-                        currency=config.STARTING_CURRENCY,
-                    )
-                )
-            await session.commit()
+        await activity.record(message.author.id, message.author.display_name)
         try:
             await bot.process_commands(message)
         except Exception as e:
@@ -226,24 +216,8 @@ async def on_message(message: Message):
 
 @bot.event
 async def on_reaction_add(reaction: Reaction, user: User | Member):
-    async with async_session() as session:
-        player: Player | None = await async_query_first(
-            session, Player, Player.id == user.id
-        )
-        if player:
-            player.last_activity_at = utc_now_naive()
-            player.name = user.display_name
-            await session.commit()
-        else:
-            session.add(
-                Player(
-                    id=user.id,
-                    name=user.display_name,
-                    last_activity_at=utc_now_naive(),
-                    currency=config.STARTING_CURRENCY,
-                )
-            )
-            await session.commit()
+    await activity.record(user.id, user.display_name)
+
 
 @bot.event
 async def on_member_join(member: Member):
@@ -284,18 +258,12 @@ async def on_member_remove(member: Member):
         await session.commit()
 
 
-@bot.before_invoke
-async def before_invoke(context: Context):
-    session = Session()
-    context.session = session
-    if AsyncSessionLocal:
-        context.asyncSession = AsyncSessionLocal()
-
-
 @bot.after_invoke
 async def after_invoke(context: Context):
-    context.session.close()
-    if context.asyncSession:
+    # The sessions are only opened if the command used them, see bot.Context
+    if "session" in context.__dict__:
+        context.session.close()
+    if "asyncSession" in context.__dict__:
         await context.asyncSession.close()
 
 
@@ -310,28 +278,43 @@ async def init_config():
         await session.commit()
 
 
+# In the order they're loaded
+COGS = (
+    AdminCommands,
+    CategoryCommands,
+    CommonCommands,
+    EconomyCommands,
+    InProgressGameCommands,
+    ListCommands,
+    MapCommands,
+    PlayerCommands,
+    PositionCommands,
+    QueueCommands,
+    QueuePositionCommands,
+    RaffleCommands,
+    RandomCommands,
+    RotationCommands,
+    ScheduleCommands,
+    TrueskillCommands,
+    VoteCommands,
+    NotificationCommands,
+    ConfigCommands,
+    DraftCommands,
+    LadderCommands,
+)
+
+
 async def setup():
-    await bot.add_cog(AdminCommands(bot))
-    await bot.add_cog(CategoryCommands(bot))
-    await bot.add_cog(CommonCommands(bot))
-    await bot.add_cog(EconomyCommands(bot))
-    await bot.add_cog(InProgressGameCommands(bot))
-    await bot.add_cog(ListCommands(bot))
-    await bot.add_cog(MapCommands(bot))
-    await bot.add_cog(PlayerCommands(bot))
-    await bot.add_cog(PositionCommands(bot))
-    await bot.add_cog(QueueCommands(bot))
-    await bot.add_cog(QueuePositionCommands(bot))
-    await bot.add_cog(RaffleCommands(bot))
-    await bot.add_cog(RandomCommands(bot))
-    await bot.add_cog(RotationCommands(bot))
-    await bot.add_cog(ScheduleCommands(bot))
-    await bot.add_cog(TrueskillCommands(bot))
-    await bot.add_cog(VoteCommands(bot))
-    await bot.add_cog(NotificationCommands(bot))
-    await bot.add_cog(ConfigCommands(bot))
-    await bot.add_cog(DraftCommands(bot))
-    await bot.add_cog(LadderCommands(bot))
+    setup_started_at = time.perf_counter()
+    for cog in COGS:
+        start = time.perf_counter()
+        await bot.add_cog(cog(bot))
+        if config.PROFILE_STARTUP:
+            _log.info(
+                f"[setup] Loaded {cog.__name__} in {time.perf_counter() - start:.3f}s"
+            )
+    start_pool()
+    activity_flush_task.start()
     add_player_task.start()
     afk_timer_task.start()
     leaderboard_task.start()
@@ -344,6 +327,15 @@ async def setup():
         prediction_task.start()
     sigma_decay_task.start()
     await init_config()
+    start = time.perf_counter()
+    with Session() as session:
+        rating_cache.warm(session)
+        leaderboard.warm(session)
+        rank_index.warm(session)
+        activity.warm(session)
+        game_index.warm(session)
+    if config.PROFILE_STARTUP:
+        _log.info(f"[setup] Warmed the caches in {time.perf_counter() - start:.3f}s")
     async with async_session() as session:
         db_config = await async_query_first(session, Config)
         if db_config:
@@ -352,12 +344,20 @@ async def setup():
                 sigma=db_config.default_trueskill_sigma,
                 tau=db_config.default_trueskill_tau,
             )
+    if config.PROFILE_STARTUP:
+        _log.info(f"[setup] Finished in {time.perf_counter() - setup_started_at:.3f}s")
 
 
 async def main():
     await create_seed_admins()
     await setup()
-    await bot.start(config.API_KEY)
+    try:
+        await bot.start(config.API_KEY)
+    finally:
+        activity_flush_task.cancel()
+        await activity.flush()
+        shutdown_pool()
+        stats_render.shutdown()
 
 
 if __name__ == "__main__":
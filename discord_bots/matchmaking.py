@@ -0,0 +1,498 @@
+"""
+Team balancing engine. Imported by commands.get_even_teams when a queue pops
+and by the showgamedebug helpers in utils.
+
+Every player's (mu, sigma) is loaded into NumPy arrays once. The win
+probability only depends on the difference in mu between the teams, so
+get_even_teams searches on that directly (see TeamBalancer.search_split) and
+the showgamedebug lists score splits in bulk with the closed-form normal CDF.
+
+When a queue pops the search runs in a pool of worker processes started at bot
+setup (see balance_teams), so the event loop keeps serving Discord meanwhile.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import logging
+import math
+import multiprocessing
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from itertools import combinations
+from statistics import NormalDist
+from typing import Sequence
+
+import numpy as np
+from trueskill import global_env
+
+import discord_bots.config as config
+
+_log = logging.getLogger(__name__)
+
+# Once a split this close to a coin flip has been found, any split at least
+# this even is as good as the most even one
+GOOD_ENOUGH_EVENNESS = 0.001
+
+# GOOD_ENOUGH_EVENNESS as a distance from zero on the standard normal curve
+_GOOD_ENOUGH_Z = NormalDist().inv_cdf(0.50 + GOOD_ENOUGH_EVENNESS)
+
+
+@dataclass
+class TeamSplit:
+    """
+    :team0: Indexes (into the balancer's players) of the players on team0
+    :team1: Indexes of the players on team1, in the original player order
+    :win_probability: The probability that team0 beats team1
+    """
+
+    team0: tuple[int, ...]
+    team1: tuple[int, ...]
+    win_probability: float
+
+    @property
+    def evenness(self) -> float:
+        return abs(0.50 - self.win_probability)
+
+
+# Coefficients of the polynomial in trueskill.backends.erfc, innermost first
+_ERFC_COEFFICIENTS = (
+    0.17087277,
+    -0.82215223,
+    1.48851587,
+    -1.13520398,
+    0.27886807,
+    -0.18628806,
+    0.09678418,
+    0.37409196,
+    1.00002368,
+)
+
+
+def _erfc(x: np.ndarray) -> np.ndarray:
+    """
+    Vectorized copy of trueskill.backends.erfc, so batched win probabilities
+    agree with trueskill.global_env().cdf
+    """
+    z = np.abs(x)
+    t = 1.0 / (1.0 + z / 2.0)
+    polynomial = np.full_like(t, _ERFC_COEFFICIENTS[0])
+    for coefficient in _ERFC_COEFFICIENTS[1:]:
+        polynomial = coefficient + t * polynomial
+    r = t * np.exp(-z * z - 1.26551223 + t * polynomial)
+    return np.where(x < 0, 2.0 - r, r)
+
+
+def cdf(x: np.ndarray) -> np.ndarray:
+    return 0.5 * _erfc(-x / math.sqrt(2))
+
+
+class TeamBalancer:
+    """
+    Scores two-team splits of a fixed group of players.
+
+    :mus: Each player's mu, in the order the caller wants indexes to refer to
+    :sigmas: Each player's sigma, in the same order
+    :sigma_mult: How much of each player's sigma to subtract from their mu
+    before comparing teams. Defaults to config.MM_SIGMA_MULT, see
+    utils.win_probability_matchmaking. Use 0 to match utils.win_probability.
+    """
+
+    def __init__(
+        self,
+        mus: Sequence[float],
+        sigmas: Sequence[float],
+        sigma_mult: float | None = None,
+    ):
+        assert len(mus) == len(sigmas)
+        self.mus: list[float] = [float(mu) for mu in mus]
+        self.sigmas: list[float] = [float(sigma) for sigma in sigmas]
+        self.sigma_mult: float = (
+            config.MM_SIGMA_MULT if sigma_mult is None else sigma_mult
+        )
+        self.size: int = len(self.mus)
+
+        mu = np.asarray(self.mus, dtype=np.float64)
+        sigma = np.asarray(self.sigmas, dtype=np.float64)
+        self._mmu: np.ndarray = mu - self.sigma_mult * sigma
+        self._total_mmu: float = float(self._mmu.sum())
+        # Every player is in every split, so the denominator is the same for
+        # all of them and only the difference in mu needs to be computed
+        self._denom: float = math.sqrt(
+            self.size * config.DEFAULT_TRUESKILL_BETA**2 + float((sigma**2).sum())
+        )
+
+    def win_probabilities(self, team0_indexes: np.ndarray) -> np.ndarray:
+        """
+        :team0_indexes: A 2D array, one row of player indexes per split
+        :returns: The probability that team0 wins, for each row
+        """
+        team0_mmu = self._mmu[team0_indexes].sum(axis=1)
+        delta_mu = 2 * team0_mmu - self._total_mmu
+        return cdf(delta_mu / self._denom)
+
+    def win_probability(self, team0: Sequence[int]) -> float:
+        """
+        Scalar win probability, computed term for term the same way as
+        utils.win_probability_matchmaking
+        """
+        team0_set = set(team0)
+        team1 = [i for i in range(self.size) if i not in team0_set]
+        mmu = lambda i: self.mus[i] - self.sigma_mult * self.sigmas[i]
+        delta_mu = sum(mmu(i) for i in team0) - sum(mmu(i) for i in team1)
+        sum_sigma = sum(self.sigmas[i] ** 2 for i in itertools.chain(team0, team1))
+        denom = math.sqrt(self.size * config.DEFAULT_TRUESKILL_BETA**2 + sum_sigma)
+        return global_env().cdf(delta_mu / denom)
+
+    def split(self, team0: Sequence[int]) -> TeamSplit:
+        team0_set = set(team0)
+        return TeamSplit(
+            team0=tuple(team0),
+            team1=tuple(i for i in range(self.size) if i not in team0_set),
+            win_probability=self.win_probability(team0),
+        )
+
+    def search_split(
+        self,
+        groups: Sequence[tuple[Sequence[int], int]],
+        rng: random.Random | None = None,
+    ) -> TeamSplit:
+        """
+        Find the most even split where, for every (indexes, count) group,
+        count of those players go on team0 and the rest go on team1. Without
+        positions there is a single group with every player in it.
+
+        The search is a meet in the middle on the difference in mu: the first
+        half of every group is enumerated on the left, the second half on the
+        right, and each left subset is matched to the right subsets closest to
+        making the teams even with a binary search. 12v12 needs about 6000
+        subsets instead of 2.7 million combinations.
+
+        If more than one split is under GOOD_ENOUGH_EVENNESS, one of them is
+        picked at random so the same players don't always get the same teams.
+
+        :groups: The players of each position and how many of them go on team0
+        :rng: Picks between equally good splits
+        """
+        if rng is None:
+            rng = random.Random()
+        groups = [(list(indexes), count) for indexes, count in groups]
+        team0_fixed: list[int] = []
+        # Swapping team0 and team1 gives the same game, so when every group is
+        # split in half, put the first player on team0 and only search half
+        if (
+            groups
+            and groups[0][0]
+            and all(len(indexes) == 2 * count for indexes, count in groups)
+        ):
+            indexes, count = groups[0]
+            team0_fixed.append(indexes[0])
+            groups[0] = (indexes[1:], count - 1)
+
+        left_parts = [indexes[: len(indexes) // 2] for indexes, _ in groups]
+        right_parts = [indexes[len(indexes) // 2 :] for indexes, _ in groups]
+        counts = [count for _, count in groups]
+        # The teams are even when team0 has exactly half of the total mu
+        target = self._total_mmu / 2 - float(self._mmu[team0_fixed].sum())
+        tolerance = _GOOD_ENOUGH_Z * self._denom / 2
+
+        # (left subsets, right subsets, first and last good right subset for
+        # each left subset)
+        good_matches: list[tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = []
+        good_count = 0
+        closest: tuple[float, np.ndarray, np.ndarray] | None = None
+        for left_counts in itertools.product(
+            *[
+                range(min(len(part), count) + 1)
+                for part, count in zip(left_parts, counts)
+            ]
+        ):
+            right_counts = [count - k for count, k in zip(counts, left_counts)]
+            if any(k > len(part) for k, part in zip(right_counts, right_parts)):
+                continue
+            left_sums, left_subsets = self._subsets(left_parts, left_counts)
+            right_sums, right_subsets = self._subsets(right_parts, right_counts)
+            order = np.argsort(right_sums, kind="stable")
+            right_sums, right_subsets = right_sums[order], right_subsets[order]
+
+            wanted = target - left_sums
+            lo = np.searchsorted(right_sums, wanted - tolerance, side="left")
+            hi = np.searchsorted(right_sums, wanted + tolerance, side="right")
+            if (hi > lo).any():
+                good_matches.append((left_subsets, right_subsets, lo, hi))
+                good_count += int((hi - lo).sum())
+            if good_count:
+                continue
+
+            position = np.searchsorted(right_sums, wanted)
+            for j in (
+                np.maximum(position - 1, 0),
+                np.minimum(position, len(right_sums) - 1),
+            ):
+                distance = np.abs(right_sums[j] - wanted)
+                i = int(np.argmin(distance))
+                if closest is None or distance[i] < closest[0]:
+                    closest = (
+                        float(distance[i]),
+                        left_subsets[i],
+                        right_subsets[j[i]],
+                    )
+
+        if good_count:
+            r = rng.randrange(good_count)
+            for left_subsets, right_subsets, lo, hi in good_matches:
+                matches = np.cumsum(hi - lo)
+                if r < matches[-1]:
+                    i = int(np.searchsorted(matches, r, side="right"))
+                    j = int(lo[i] + r - (matches[i] - (hi[i] - lo[i])))
+                    left_subset, right_subset = left_subsets[i], right_subsets[j]
+                    break
+                r -= int(matches[-1])
+        else:
+            assert closest is not None
+            _, left_subset, right_subset = closest
+
+        return self.split(
+            sorted(
+                team0_fixed
+                + [int(i) for i in left_subset]
+                + [int(i) for i in right_subset]
+            )
+        )
+
+    def greedy_split(self, groups: Sequence[tuple[Sequence[int], int]]) -> TeamSplit:
+        """
+        Fast fallback for search_split: take players from best to worst and
+        put each one on whichever team is behind, as long as that team still
+        has room at the player's position.
+        """
+        # Open slots on (team0, team1) for the group each player is in
+        slots: dict[int, list[int]] = {}
+        for indexes, count in groups:
+            group_slots = [count, len(indexes) - count]
+            for i in indexes:
+                slots[i] = group_slots
+        team0: list[int] = []
+        team_mmu = [0.0, 0.0]
+        for i in sorted(slots, key=lambda i: self._mmu[i], reverse=True):
+            team = 0 if team_mmu[0] <= team_mmu[1] else 1
+            if not slots[i][team]:
+                team = 1 - team
+            slots[i][team] -= 1
+            team_mmu[team] += float(self._mmu[i])
+            if team == 0:
+                team0.append(i)
+        return self.split(sorted(team0))
+
+    def _subsets(
+        self, parts: Sequence[Sequence[int]], counts: Sequence[int]
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        :returns: The mu sum of every way to pick counts[i] players from each
+        parts[i], and a 2D array of the player indexes picked, one row each
+        """
+        rows = list(
+            itertools.product(
+                *[combinations(part, count) for part, count in zip(parts, counts)]
+            )
+        )
+        subsets = np.fromiter(
+            itertools.chain.from_iterable(itertools.chain.from_iterable(rows)),
+            dtype=np.intp,
+            count=len(rows) * sum(counts),
+        ).reshape(len(rows), sum(counts))
+        return self._mmu[subsets].sum(axis=1), subsets
+
+    def top_splits(self, team_size: int, n: int, direction: int = 1) -> list[TeamSplit]:
+        """
+        Score every split with team_size players on team0.
+
+        :direction: 1 for the n most even splits, -1 for the n least even
+        """
+        if 2 * team_size == self.size and team_size > 0:
+            # Each split and its mirror image are the same game, only score
+            # the ones with the first player on team0
+            team0_combinations = (
+                (0, *team0)
+                for team0 in combinations(range(1, self.size), team_size - 1)
+            )
+        else:
+            team0_combinations = combinations(range(self.size), team_size)
+        team0_indexes = np.fromiter(
+            itertools.chain.from_iterable(team0_combinations),
+            dtype=np.intp,
+        ).reshape(-1, team_size)
+        if len(team0_indexes) == 0:
+            return []
+        evenness = np.abs(0.50 - self.win_probabilities(team0_indexes))
+        # A stable sort keeps ties in combination order
+        order = np.argsort(direction * evenness, kind="stable")[:n]
+        return [self.split(tuple(int(i) for i in team0_indexes[j])) for j in order]
+
+
+# What the matchmaking workers get for each player: (player id, mu, sigma,
+# position id). Plain tuples so nothing from the database has to be pickled.
+MatchmakingPlayer = tuple[int, float, float, str | None]
+
+
+def _team0_groups(
+    players: Sequence[MatchmakingPlayer],
+    team_size: int,
+    position_counts: dict[str, int] | None,
+) -> list[tuple[list[int], int]]:
+    if not position_counts:
+        return [(list(range(len(players))), team_size)]
+    return [
+        ([i for i, player in enumerate(players) if player[3] == position_id], count)
+        for position_id, count in position_counts.items()
+    ]
+
+
+def find_teams(
+    players: Sequence[MatchmakingPlayer],
+    team_size: int,
+    position_counts: dict[str, int] | None,
+    sigma_mult: float,
+    seed: int,
+) -> tuple[TeamSplit, float, float]:
+    """
+    Runs in a matchmaking worker process.
+
+    :position_counts: How many players of each position go on each team
+    :seed: Picks between equally good splits. The global random state isn't
+    touched, since without a pool this runs in the bot process.
+    :returns: The split (indexes into players), the time.time() the search
+    started and how many seconds it took
+    """
+    started_at = time.time()
+    start = time.perf_counter()
+    rng = random.Random(seed)
+    balancer = TeamBalancer(
+        [player[1] for player in players],
+        [player[2] for player in players],
+        sigma_mult,
+    )
+    split = balancer.search_split(
+        _team0_groups(players, team_size, position_counts), rng
+    )
+    return split, started_at, time.perf_counter() - start
+
+
+@dataclass
+class MatchmakingMetrics:
+    """
+    :searches: Searches that finished in time
+    :fallbacks: Searches that timed out or failed and used greedy_split
+    :queue_wait_seconds: Time spent waiting for a free worker
+    :compute_seconds: Time spent searching inside the worker
+    """
+
+    searches: int = 0
+    fallbacks: int = 0
+    total_queue_wait_seconds: float = 0.0
+    max_queue_wait_seconds: float = 0.0
+    total_compute_seconds: float = 0.0
+    max_compute_seconds: float = 0.0
+
+    def record(self, queue_wait_seconds: float, compute_seconds: float):
+        self.searches += 1
+        self.total_queue_wait_seconds += queue_wait_seconds
+        self.max_queue_wait_seconds = max(
+            self.max_queue_wait_seconds, queue_wait_seconds
+        )
+        self.total_compute_seconds += compute_seconds
+        self.max_compute_seconds = max(self.max_compute_seconds, compute_seconds)
+
+
+metrics = MatchmakingMetrics()
+
+_pool: ProcessPoolExecutor | None = None
+
+
+def start_pool(workers: int | None = None):
+    """
+    Start the matchmaking workers. Called once at bot setup. By then the
+    database engines have threads and connections of their own, so rather
+    than forking the bot, the workers are started from a fresh fork server
+    process (spawned where there is none). With no workers, balance_teams
+    searches on the event loop instead.
+    """
+    global _pool
+    workers = config.MATCHMAKING_WORKERS if workers is None else workers
+    if _pool or workers <= 0:
+        return
+    start_method = (
+        "forkserver"
+        if "forkserver" in multiprocessing.get_all_start_methods()
+        else "spawn"
+    )
+    _pool = ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context(start_method)
+    )
+    # Start the workers now rather than when the first queue pops
+    for _ in range(workers):
+        _pool.submit(int)
+    _log.info(f"[start_pool] Started {workers} matchmaking worker(s)")
+
+
+def shutdown_pool():
+    global _pool
+    if _pool:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def balance_teams(
+    players: Sequence[MatchmakingPlayer],
+    team_size: int,
+    position_counts: dict[str, int] | None = None,
+) -> TeamSplit:
+    """
+    Find the most even teams in a matchmaking worker, so a big queue popping
+    doesn't block the event loop. If the worker doesn't answer within
+    config.MATCHMAKING_TIMEOUT seconds, falls back to TeamBalancer.greedy_split.
+
+    :returns: The split, as indexes into players
+    """
+    players = [
+        (player_id, float(mu), float(sigma), position_id)
+        for player_id, mu, sigma, position_id in players
+    ]
+    args = (players, team_size, position_counts, config.MM_SIGMA_MULT)
+    seed = random.getrandbits(64)
+    submitted_at = time.time()
+    if not _pool:
+        split, started_at, compute_seconds = find_teams(*args, seed)
+    else:
+        loop = asyncio.get_running_loop()
+        try:
+            split, started_at, compute_seconds = await asyncio.wait_for(
+                loop.run_in_executor(_pool, find_teams, *args, seed),
+                timeout=config.MATCHMAKING_TIMEOUT,
+            )
+        except (asyncio.TimeoutError, BrokenProcessPool) as e:
+            _log.warning(
+                f"[balance_teams] Search for {len(players)} players failed, using greedy teams: {type(e).__name__}"
+            )
+            if isinstance(e, BrokenProcessPool):
+                shutdown_pool()
+                start_pool()
+            metrics.fallbacks += 1
+            balancer = TeamBalancer(
+                [player[1] for player in players],
+                [player[2] for player in players],
+            )
+            return balancer.greedy_split(
+                _team0_groups(players, team_size, position_counts)
+            )
+
+    queue_wait_seconds = max(0.0, started_at - submitted_at)
+    metrics.record(queue_wait_seconds, compute_seconds)
+    _log.info(
+        f"[balance_teams] {len(players)} players, queue wait: {queue_wait_seconds:.3f}s, compute: {compute_seconds:.3f}s"
+    )
+    return split
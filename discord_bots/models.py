@@ -1,13 +1,14 @@
 from __future__ import annotations
 
 from dataclasses import dataclass, field
-from datetime import datetime, timezone
+from datetime import date, datetime, timezone
 from uuid import uuid4
 
 from sqlalchemy import (
     BigInteger,
     Boolean,
     Column,
+    Date,
     DateTime,
     Float,
     Integer,
@@ -40,27 +41,54 @@ if config.DATABASE_URI:
 else:
     db_url = f"sqlite:///{config.DB_NAME}.db"
 
+
+def set_sqlite_pragmas(dbapi_connection, _connection_record):
+    """
+    Applied to every new SQLite connection. WAL lets readers and a writer use
+    the database at the same time, and synchronous=NORMAL only syncs at
+    checkpoints, which is still safe with WAL.
+    """
+    cursor = dbapi_connection.cursor()
+    if config.SQLITE_JOURNAL_MODE:
+        cursor.execute(f"PRAGMA journal_mode={config.SQLITE_JOURNAL_MODE}")
+    if config.SQLITE_SYNCHRONOUS:
+        cursor.execute(f"PRAGMA synchronous={config.SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA mmap_size={config.SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA cache_size={config.SQLITE_CACHE_SIZE}")
+    cursor.execute(f"PRAGMA busy_timeout={config.SQLITE_BUSY_TIMEOUT}")
+    cursor.close()
+
+
 # RDS free tier has max 81 connections
 if db_url.startswith("postgresql://"):
     # Postgres configuration - support both sync and async
-    engine = create_engine(db_url, echo=False, pool_size=40, max_overflow=50)
+    pool_options = dict(
+        pool_size=config.DB_POOL_SIZE,
+        max_overflow=config.DB_MAX_OVERFLOW,
+        pool_timeout=config.DB_POOL_TIMEOUT,
+        pool_recycle=config.DB_POOL_RECYCLE,
+        pool_pre_ping=config.DB_POOL_PRE_PING,
+    )
+    engine = create_engine(db_url, echo=False, **pool_options)
 
     # Convert postgresql:// to postgresql+asyncpg:// for async support
     # Doesn't require any new .env variables
     async_db_url = db_url.replace("postgresql://", "postgresql+asyncpg://")
-    async_engine = create_async_engine(
-        async_db_url, echo=False, pool_size=40, max_overflow=50
-    )
+    async_engine = create_async_engine(async_db_url, echo=False, **pool_options)
 else:
     # SQLite configuration - support both sync and async
-    engine = create_engine(db_url, echo=False, connect_args={"timeout": 15})
+    sqlite_connect_args = {"timeout": config.SQLITE_BUSY_TIMEOUT / 1000}
+    engine = create_engine(db_url, echo=False, connect_args=sqlite_connect_args)
 
     # Convert sqlite:/// to sqlite+aiosqlite:/// for async support
     # Doesn't require any new .env variables
     async_db_url = db_url.replace("sqlite://", "sqlite+aiosqlite://")
     async_engine = create_async_engine(
-        async_db_url, echo=False, connect_args={"timeout": 15}
+        async_db_url, echo=False, connect_args=sqlite_connect_args
     )
+
+    event.listen(engine, "connect", set_sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", set_sqlite_pragmas)
 naming_convention = {
     "ix": "ix_%(column_0_label)s",
     "uq": "uq_%(table_name)s_%(column_0_name)s",
@@ -633,6 +661,72 @@ class FinishedGamePlayer:
         return self.player_id < other.player_id
 
 
+@mapper_registry.mapped
+@dataclass
+class PlayerDailyStats:
+    """
+    A player's wins, losses and ties on one day (UTC, by finished_at) for one
+    combination of category, map and position, so /stats and /map stats can
+    sum these instead of loading every finished game.
+    Games without a category or position are stored with an empty name.
+    See discord_bots/daily_stats.py
+    """
+
+    __sa_dataclass_metadata_key__ = "sa"
+    __tablename__ = "player_daily_stats"
+    __table_args__ = (
+        UniqueConstraint(
+            "player_id",
+            "category_name",
+            "map_full_name",
+            "position_name",
+            "is_captain_pick",
+            "day",
+        ),
+    )
+
+    player_id: int = field(
+        metadata={
+            "sa": Column(
+                BigInteger, ForeignKey("player.id"), nullable=False, index=True
+            )
+        },
+    )
+    day: date = field(metadata={"sa": Column(Date, nullable=False, index=True)})
+    category_name: str = field(
+        metadata={"sa": Column(String, nullable=False, server_default="")},
+    )
+    map_full_name: str = field(
+        metadata={"sa": Column(String, nullable=False, server_default="")},
+    )
+    position_name: str = field(
+        metadata={"sa": Column(String, nullable=False, server_default="")},
+    )
+    is_captain_pick: bool = field(
+        default=False,
+        metadata={
+            "sa": Column(Boolean, nullable=False, server_default=expression.false())
+        },
+    )
+    wins: int = field(
+        default=0,
+        metadata={"sa": Column(Integer, nullable=False, server_default=text("0"))},
+    )
+    losses: int = field(
+        default=0,
+        metadata={"sa": Column(Integer, nullable=False, server_default=text("0"))},
+    )
+    ties: int = field(
+        default=0,
+        metadata={"sa": Column(Integer, nullable=False, server_default=text("0"))},
+    )
+    id: str = field(
+        init=False,
+        default_factory=lambda: str(uuid4()),
+        metadata={"sa": Column(String, primary_key=True)},
+    )
+
+
 @mapper_registry.mapped
 @dataclass
 class InProgressGame:
@@ -1032,7 +1126,9 @@ class Player:
 @dataclass
 class PlayerDecay:
     """
-    A manual instance of decaying a player's trueskill
+    An instance of decaying a player's trueskill. Either a manual mu decay, or
+    the daily sigma decay of a category (see SIGMA_DECAY_AUDIT), which sets
+    category_id and the sigma columns and leaves mu as is.
     """
 
     __sa_dataclass_metadata_key__ = "sa"
@@ -1052,6 +1148,16 @@ class PlayerDecay:
     rated_trueskill_mu_after: float = field(
         metadata={"sa": Column(Float, nullable=False)}
     )
+    category_id: str | None = field(
+        default=None,
+        metadata={"sa": Column(String, ForeignKey("category.id"), nullable=True)},
+    )
+    rated_trueskill_sigma_before: float | None = field(
+        default=None, metadata={"sa": Column(Float, nullable=True)}
+    )
+    rated_trueskill_sigma_after: float | None = field(
+        default=None, metadata={"sa": Column(Float, nullable=True)}
+    )
     decayed_at: datetime = field(
         init=False,
         default_factory=lambda: datetime.now(timezone.utc).replace(tzinfo=None),
@@ -0,0 +1,122 @@
+"""
+Tracks which games' prediction totals changed since their prediction embed
+was last edited, so prediction_task only edits the embeds that are out of
+date, and loads the totals of just those games with one grouped query.
+
+Any game whose predictions a session commits a change to (a new prediction,
+a cancelled one) is marked dirty, and so is any game whose embed hasn't been
+edited since the bot started, in case predictions were made while it was
+down. Like the other caches, changes are only picked up once their session
+commits, and bulk query().update()/delete() statements skip the ORM, so code
+using them has to call mark_dirty().
+"""
+
+import logging
+from collections.abc import Iterable
+from typing import NamedTuple
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session as SQLAlchemySession
+
+from discord_bots.models import EconomyPrediction
+
+_log = logging.getLogger(__name__)
+
+
+class TeamTotal(NamedTuple):
+    total: int
+    predictors: int
+
+
+# Games whose predictions changed since their embed was last edited
+_dirty_game_ids: set[str] = set()
+# Games whose embed has been up to date at some point since the bot started
+_edited_game_ids: set[str] = set()
+
+
+def mark_dirty(game_id: str):
+    _dirty_game_ids.add(game_id)
+
+
+def mark_edited(game_id: str):
+    """
+    Note that the game's embed shows its current totals, e.g. because it was
+    just posted
+    """
+    _dirty_game_ids.discard(game_id)
+    _edited_game_ids.add(game_id)
+
+
+def take_dirty(game_ids: Iterable[str]) -> set[str]:
+    """
+    :param game_ids: Every game with open predictions. Games that aren't
+    passed are forgotten.
+    :returns: The games out of game_ids whose embed is out of date. They're
+    assumed to be edited now, call mark_dirty() if that fails.
+    """
+    game_ids = set(game_ids)
+    dirty = {
+        game_id
+        for game_id in game_ids
+        if game_id in _dirty_game_ids or game_id not in _edited_game_ids
+    }
+    _dirty_game_ids.difference_update(dirty)
+    _edited_game_ids.intersection_update(game_ids)
+    _edited_game_ids.update(dirty)
+    return dirty
+
+
+def load_totals(
+    session: SQLAlchemySession, game_ids: Iterable[str]
+) -> dict[str, tuple[TeamTotal, TeamTotal]]:
+    """
+    :returns: The total predicted on, and the number of players who
+    predicted on, team0 and team1 of each game
+    """
+    totals: dict[str, list[TeamTotal]] = {
+        game_id: [TeamTotal(0, 0), TeamTotal(0, 0)] for game_id in game_ids
+    }
+    if not totals:
+        return {}
+    for game_id, team, total, predictors in (
+        session.query(
+            EconomyPrediction.in_progress_game_id,
+            EconomyPrediction.team,
+            func.sum(EconomyPrediction.prediction_value),
+            func.count(func.distinct(EconomyPrediction.player_id)),
+        )
+        .filter(EconomyPrediction.in_progress_game_id.in_(list(totals)))
+        .group_by(EconomyPrediction.in_progress_game_id, EconomyPrediction.team)
+    ):
+        # Like the embed always has, anything but team0 counts as team1
+        totals[game_id][0 if team == 0 else 1] = TeamTotal(int(total or 0), predictors)
+    return {game_id: (team0, team1) for game_id, (team0, team1) in totals.items()}
+
+
+_PENDING_CHANGES_KEY = "prediction_totals_pending_changes"
+
+
+@event.listens_for(SQLAlchemySession, "after_flush")
+def _after_flush(session: SQLAlchemySession, _flush_context):
+    game_ids = {
+        obj.in_progress_game_id
+        for obj in (*session.new, *session.dirty, *session.deleted)
+        if isinstance(obj, EconomyPrediction) and obj.in_progress_game_id
+    }
+    if game_ids:
+        session.info.setdefault(_PENDING_CHANGES_KEY, set()).update(game_ids)
+
+
+@event.listens_for(SQLAlchemySession, "after_commit")
+def _after_commit(session: SQLAlchemySession):
+    game_ids = session.info.pop(_PENDING_CHANGES_KEY, None)
+    if game_ids:
+        _dirty_game_ids.update(game_ids)
+        _log.debug(f"[prediction_totals] {len(game_ids)} game(s) changed")
+
+
+@event.listens_for(SQLAlchemySession, "after_transaction_end")
+def _after_transaction_end(session: SQLAlchemySession, transaction):
+    # Anything still pending here was rolled back
+    if transaction.parent is None:
+        session.info.pop(_PENDING_CHANGES_KEY, None)
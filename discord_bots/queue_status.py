@@ -0,0 +1,225 @@
+"""
+A process-wide snapshot of everything /status shows: rotations, their next
+map and skip votes, their queues with the players in them, and the embeds of
+the games in progress in each queue.
+
+The snapshot is built with a handful of queries the first time /status needs
+it, and thrown away when a session commits a change to anything it shows, so
+/status between adds, removes, pops, votes and rotations doesn't touch the
+database. Unlike the other caches, bulk query().update()/delete() statements
+are noticed automatically, since queue players are almost always removed
+that way.
+"""
+
+import logging
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+from discord import Embed
+from sqlalchemy import event, func, inspect
+from sqlalchemy.orm import ORMExecuteState
+from sqlalchemy.orm import Session as SQLAlchemySession
+
+import discord_bots.config as config
+from discord_bots.models import (
+    InProgressGame,
+    InProgressGamePlayer,
+    Map,
+    Player,
+    Position,
+    Queue,
+    QueuePlayer,
+    Rotation,
+    RotationMap,
+    SkipMapVote,
+)
+from discord_bots.utils import (
+    create_condensed_in_progress_game_embed,
+    load_in_progress_game_bundles,
+)
+
+_log = logging.getLogger(__name__)
+
+
+@dataclass
+class QueueStatus:
+    id: str
+    name: str
+    ordinal: int
+    size: int
+    is_locked: bool
+    is_captain_pick: bool
+    # In the order they were added
+    player_names: list[str] = field(default_factory=list)
+    game_embeds: list[Embed] = field(default_factory=list)
+
+
+@dataclass
+class RotationStatus:
+    id: str
+    name: str
+    # e.g. "Dangerous Crossing (DX) (5 tickets)", None without a next map
+    next_map_str: str | None
+    skip_map_votes: int
+    # By ordinal
+    queues: list[QueueStatus] = field(default_factory=list)
+
+
+_snapshot: list[RotationStatus] | None = None
+# Bumped by every invalidation, so a snapshot that was being built while a
+# change committed isn't kept
+_generation: int = 0
+
+# Changes to these invalidate the snapshot. Players only matter when their
+# name changes.
+_WATCHED = (
+    InProgressGame,
+    InProgressGamePlayer,
+    Map,
+    Player,
+    Position,
+    Queue,
+    QueuePlayer,
+    Rotation,
+    RotationMap,
+    SkipMapVote,
+)
+
+
+def invalidate():
+    global _snapshot, _generation
+    _snapshot = None
+    _generation += 1
+
+
+async def _build(session: SQLAlchemySession) -> list[RotationStatus]:
+    queues_by_rotation: dict[str, list[QueueStatus]] = defaultdict(list)
+    queues: dict[str, QueueStatus] = {}
+    for queue in session.query(Queue).order_by(Queue.ordinal.asc()):
+        queues[queue.id] = QueueStatus(
+            id=queue.id,
+            name=queue.name,
+            ordinal=queue.ordinal,
+            size=queue.size,
+            is_locked=queue.is_locked,
+            is_captain_pick=queue.is_captain_pick,
+        )
+        queues_by_rotation[queue.rotation_id].append(queues[queue.id])
+    for queue_id, player_name in (
+        session.query(QueuePlayer.queue_id, Player.name)
+        .join(Player, Player.id == QueuePlayer.player_id)
+        .order_by(QueuePlayer.added_at.asc())
+    ):
+        if queue_id in queues:
+            queues[queue_id].player_names.append(player_name)
+
+    in_progress_games: list[InProgressGame] = (
+        session.query(InProgressGame).filter(InProgressGame.is_finished == False).all()
+    )
+    bundles = load_in_progress_game_bundles(session, in_progress_games)
+    for game in in_progress_games:
+        if game.queue_id in queues:
+            queues[game.queue_id].game_embeds.append(
+                await create_condensed_in_progress_game_embed(
+                    session, game, bundles[game.id]
+                )
+            )
+
+    next_map_strs: dict[str, str] = {}
+    for rotation_id, raffle_ticket_reward, full_name, short_name in (
+        session.query(
+            RotationMap.rotation_id,
+            RotationMap.raffle_ticket_reward,
+            Map.full_name,
+            Map.short_name,
+        )
+        .join(Map, Map.id == RotationMap.map_id)
+        .filter(RotationMap.is_next == True)
+    ):
+        if rotation_id in next_map_strs:
+            continue
+        next_map_str = f"{full_name} ({short_name})"
+        if config.ENABLE_RAFFLE:
+            raffle_reward = (
+                raffle_ticket_reward
+                if raffle_ticket_reward > 0
+                else config.DEFAULT_RAFFLE_VALUE
+            )
+            next_map_str += f" ({raffle_reward} tickets)"
+        next_map_strs[rotation_id] = next_map_str
+    skip_map_votes: dict[str, int] = dict(
+        session.query(SkipMapVote.rotation_id, func.count(SkipMapVote.id)).group_by(
+            SkipMapVote.rotation_id
+        )
+    )
+
+    return [
+        RotationStatus(
+            id=rotation.id,
+            name=rotation.name,
+            next_map_str=next_map_strs.get(rotation.id),
+            skip_map_votes=skip_map_votes.get(rotation.id, 0),
+            queues=queues_by_rotation.get(rotation.id, []),
+        )
+        for rotation in session.query(Rotation).order_by(Rotation.created_at.asc())
+    ]
+
+
+async def snapshot(session: SQLAlchemySession) -> list[RotationStatus]:
+    """
+    :returns: Every rotation by creation date, from the cache if nothing
+    changed since it was built. Treat it as read only.
+    """
+    global _snapshot
+    if _snapshot is not None:
+        return _snapshot
+    generation = _generation
+    built = await _build(session)
+    if generation == _generation:
+        _snapshot = built
+    _log.debug(f"[queue_status.snapshot] Built a snapshot of {len(built)} rotations")
+    return built
+
+
+# Like rating_cache, only throw the snapshot away once the change commits, so
+# a rolled back change doesn't cost a rebuild
+_PENDING_CHANGES_KEY = "queue_status_pending_changes"
+
+
+def _is_watched_change(obj, session: SQLAlchemySession) -> bool:
+    if isinstance(obj, Player):
+        return obj in session.new or inspect(obj).attrs.name.history.has_changes()
+    return isinstance(obj, _WATCHED)
+
+
+@event.listens_for(SQLAlchemySession, "after_flush")
+def _after_flush(session: SQLAlchemySession, _flush_context):
+    if session.info.get(_PENDING_CHANGES_KEY):
+        return
+    if any(
+        _is_watched_change(obj, session)
+        for obj in (*session.new, *session.dirty, *session.deleted)
+    ):
+        session.info[_PENDING_CHANGES_KEY] = True
+
+
+@event.listens_for(SQLAlchemySession, "do_orm_execute")
+def _do_orm_execute(orm_execute_state: ORMExecuteState):
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is not None and issubclass(mapper.class_, _WATCHED):
+        orm_execute_state.session.info[_PENDING_CHANGES_KEY] = True
+
+
+@event.listens_for(SQLAlchemySession, "after_commit")
+def _after_commit(session: SQLAlchemySession):
+    if session.info.pop(_PENDING_CHANGES_KEY, False):
+        invalidate()
+
+
+@event.listens_for(SQLAlchemySession, "after_transaction_end")
+def _after_transaction_end(session: SQLAlchemySession, transaction):
+    # Anything still pending here was rolled back
+    if transaction.parent is None:
+        session.info.pop(_PENDING_CHANGES_KEY, None)
@@ -1,13 +1,15 @@
 # Module for Python queues used to handle concurrency - not to be confused with
 # the game queues
+import asyncio
 from dataclasses import dataclass
-from queue import SimpleQueue
 
 from discord.channel import TextChannel
 from discord.guild import Guild
 from discord.message import Message
 
-add_player_queue: SimpleQueue = SimpleQueue()
+# Consumed by tasks.add_player_task, which wakes up as soon as something is put
+# here. Producers run on the event loop, so use put_nowait.
+add_player_queue: "asyncio.Queue[AddPlayerQueueMessage]" = asyncio.Queue()
 waitlist_messages: list[Message] = (
     []
 )  # short-term solution to bulk delete queue_waitlist messages
@@ -0,0 +1,274 @@
+"""
+Process-wide sorted indexes of ratings, so /stats can find a player's
+percentile, /trueskill shownormaldist can read a category's distribution and
+the leaderboard can find the top ranks without scanning player or
+player_category_trueskill.
+
+There's one index per (category_id, map_id, position_id) of
+PlayerCategoryTrueskills, and a global one of Player.rated_trueskill_mu/sigma
+for players whose rating has moved off the default.
+
+The indexes are built once at startup. Like rating_cache, changes made through
+the ORM are applied when their session commits and dropped if it rolls back,
+and bulk query().update()/delete() statements have to call reload_category().
+"""
+
+import heapq
+import logging
+from typing import Iterable, Iterator, NamedTuple
+
+import trueskill
+from sortedcontainers import SortedList
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session as SQLAlchemySession
+
+from discord_bots.models import Config, Player, PlayerCategoryTrueskill
+
+_log = logging.getLogger(__name__)
+
+
+class IndexedRating(NamedTuple):
+    rank: float
+    mu: float
+    sigma: float
+    player_id: int
+
+
+RatingKey = tuple[str, str | None, str | None]
+
+# (category_id, map_id, position_id) -> ratings, lowest rank first
+_category_ratings: dict[RatingKey, SortedList] = {}
+# (player_id, category_id, map_id, position_id) -> the rating in the index
+_category_entries: dict[tuple[int, str, str | None, str | None], IndexedRating] = {}
+_global_ratings: SortedList = SortedList()
+_global_entries: dict[int, IndexedRating] = {}
+# (mu, sigma) of unplayed players, who are left out of the global index
+_default_ratings: list[tuple[float, float]] = [(trueskill.MU, trueskill.SIGMA)]
+
+
+def _set_category_rating(
+    player_id: int,
+    category_id: str,
+    map_id: str | None,
+    position_id: str | None,
+    rating: IndexedRating | None,
+):
+    key = (player_id, category_id, map_id, position_id)
+    old = _category_entries.pop(key, None)
+    if old:
+        _category_ratings[(category_id, map_id, position_id)].remove(old)
+    if rating:
+        _category_entries[key] = rating
+        _category_ratings.setdefault(
+            (category_id, map_id, position_id), SortedList()
+        ).add(rating)
+
+
+def _is_default(mu: float, sigma: float) -> bool:
+    # Same as /stats always did: a player is unplayed if either value is
+    # still at a default
+    return any(
+        mu == default_mu or sigma == default_sigma
+        for default_mu, default_sigma in _default_ratings
+    )
+
+
+def _set_global_rating(player_id: int, mu: float | None, sigma: float | None):
+    old = _global_entries.pop(player_id, None)
+    if old:
+        _global_ratings.remove(old)
+    if mu is not None and sigma is not None and not _is_default(mu, sigma):
+        rating = IndexedRating(mu - 3 * sigma, mu, sigma, player_id)
+        _global_entries[player_id] = rating
+        _global_ratings.add(rating)
+
+
+def warm(session: SQLAlchemySession):
+    """
+    Build every index. Called at bot setup.
+    """
+    _category_ratings.clear()
+    _category_entries.clear()
+    _global_ratings.clear()
+    _global_entries.clear()
+    config: Config | None = session.query(Config).first()
+    _default_ratings[1:] = (
+        [(config.default_trueskill_mu, config.default_trueskill_sigma)]
+        if config
+        else []
+    )
+    for player_id, category_id, map_id, position_id, rank, mu, sigma in session.query(
+        PlayerCategoryTrueskill.player_id,
+        PlayerCategoryTrueskill.category_id,
+        PlayerCategoryTrueskill.map_id,
+        PlayerCategoryTrueskill.position_id,
+        PlayerCategoryTrueskill.rank,
+        PlayerCategoryTrueskill.mu,
+        PlayerCategoryTrueskill.sigma,
+    ):
+        _set_category_rating(
+            player_id,
+            category_id,
+            map_id,
+            position_id,
+            IndexedRating(rank, mu, sigma, player_id),
+        )
+    for player_id, mu, sigma in session.query(
+        Player.id, Player.rated_trueskill_mu, Player.rated_trueskill_sigma
+    ):
+        _set_global_rating(player_id, mu, sigma)
+    _log.info(
+        f"[rank_index.warm] Indexed {len(_category_entries)} player category trueskills and {len(_global_entries)} players"
+    )
+
+
+def reload_category(session: SQLAlchemySession, category_id: str):
+    """
+    Rebuild a category's indexes from the database, after a bulk update or
+    delete
+    """
+    for key in [key for key in _category_entries if key[1] == category_id]:
+        _set_category_rating(*key, None)
+    for player_id, map_id, position_id, rank, mu, sigma in session.query(
+        PlayerCategoryTrueskill.player_id,
+        PlayerCategoryTrueskill.map_id,
+        PlayerCategoryTrueskill.position_id,
+        PlayerCategoryTrueskill.rank,
+        PlayerCategoryTrueskill.mu,
+        PlayerCategoryTrueskill.sigma,
+    ).filter(PlayerCategoryTrueskill.category_id == category_id):
+        _set_category_rating(
+            player_id,
+            category_id,
+            map_id,
+            position_id,
+            IndexedRating(rank, mu, sigma, player_id),
+        )
+
+
+def _top_ratio(ratings: SortedList, rank: float) -> float:
+    # Ties with rank don't count as above it
+    return (len(ratings) - ratings.bisect_right((rank, float("inf")))) / (
+        len(ratings) or 1
+    )
+
+
+def top_ratio(
+    category_id: str,
+    rank: float,
+    map_id: str | None = None,
+    position_id: str | None = None,
+) -> float:
+    """
+    :returns: The fraction of ratings in the category (and map and position)
+    ranked above rank, e.g. 0.05 for the top 5%
+    """
+    return _top_ratio(
+        _category_ratings.get((category_id, map_id, position_id), SortedList()),
+        rank,
+    )
+
+
+def global_top_ratio(rank: float) -> float:
+    """
+    :returns: The fraction of played players with a global rank above rank
+    """
+    return _top_ratio(_global_ratings, rank)
+
+
+def category_ratings(category_id: str) -> Iterator[IndexedRating]:
+    """
+    :returns: Every rating in the category, including map and position ratings
+    """
+    for (rating_category_id, _, _), ratings in _category_ratings.items():
+        if rating_category_id == category_id:
+            yield from ratings
+
+
+def global_ratings() -> Iterator[IndexedRating]:
+    return iter(_global_ratings)
+
+
+def top(category_id: str, player_ids: Iterable[int], limit: int) -> list[IndexedRating]:
+    """
+    :returns: Up to limit of the highest ranked ratings in the category
+    (including map and position ratings) that belong to player_ids, highest
+    first
+    """
+    player_ids = set(player_ids)
+    result: list[IndexedRating] = []
+    if not player_ids:
+        return result
+    for rating in heapq.merge(
+        *(
+            reversed(ratings)
+            for (rating_category_id, _, _), ratings in _category_ratings.items()
+            if rating_category_id == category_id
+        ),
+        reverse=True,
+    ):
+        if rating.player_id in player_ids:
+            result.append(rating)
+            if len(result) >= limit:
+                break
+    return result
+
+
+# Same as rating_cache: remember what each flush changed, apply it once the
+# session commits, and throw it away if it rolls back
+_PENDING_CHANGES_KEY = "rank_index_pending_changes"
+
+
+def _rated_trueskill_changed(player: Player) -> bool:
+    attrs = inspect(player).attrs
+    return (
+        attrs.rated_trueskill_mu.history.has_changes()
+        or attrs.rated_trueskill_sigma.history.has_changes()
+    )
+
+
+@event.listens_for(SQLAlchemySession, "after_flush")
+def _after_flush(session: SQLAlchemySession, _flush_context):
+    changes: dict = session.info.setdefault(_PENDING_CHANGES_KEY, {})
+    for obj in session.new | session.dirty:
+        if isinstance(obj, PlayerCategoryTrueskill):
+            changes[(PlayerCategoryTrueskill, obj.id)] = (
+                _set_category_rating,
+                obj.player_id,
+                obj.category_id,
+                obj.map_id,
+                obj.position_id,
+                IndexedRating(obj.rank, obj.mu, obj.sigma, obj.player_id),
+            )
+        elif isinstance(obj, Player) and (
+            obj in session.new or _rated_trueskill_changed(obj)
+        ):
+            changes[(Player, obj.id)] = (
+                _set_global_rating,
+                obj.id,
+                obj.rated_trueskill_mu,
+                obj.rated_trueskill_sigma,
+            )
+    for obj in session.deleted:
+        if isinstance(obj, PlayerCategoryTrueskill):
+            changes[(PlayerCategoryTrueskill, obj.id)] = (
+                _set_category_rating,
+                obj.player_id,
+                obj.category_id,
+                obj.map_id,
+                obj.position_id,
+                None,
+            )
+
+
+@event.listens_for(SQLAlchemySession, "after_commit")
+def _after_commit(session: SQLAlchemySession):
+    for apply, *args in session.info.pop(_PENDING_CHANGES_KEY, {}).values():
+        apply(*args)
+
+
+@event.listens_for(SQLAlchemySession, "after_transaction_end")
+def _after_transaction_end(session: SQLAlchemySession, transaction):
+    # Anything still pending here was rolled back
+    if transaction.parent is None:
+        session.info.pop(_PENDING_CHANGES_KEY, None)
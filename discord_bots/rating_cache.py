@@ -0,0 +1,235 @@
+"""
+Process-wide cache of every PlayerCategoryTrueskill's mu and sigma, keyed by
+(player_id, category_id, map_id, position_id), so adding to a queue doesn't
+have to query player_category_trueskill.
+
+The cache is warmed once at startup. Changes made through the ORM anywhere in
+the bot (finishing a game, setmu/setsigma, resetplayertrueskill, sigma decay,
+new PlayerCategoryTrueskills) are written through when their session commits,
+and dropped if it rolls back. Bulk query().update()/delete() statements skip
+the ORM, so code using them has to call invalidate().
+"""
+
+import logging
+from dataclasses import dataclass
+from typing import NamedTuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session as SQLAlchemySession
+
+from discord_bots.models import PlayerCategoryTrueskill
+
+_log = logging.getLogger(__name__)
+
+
+class CachedRating(NamedTuple):
+    mu: float
+    sigma: float
+
+    @property
+    def rank(self) -> float:
+        return self.mu - 3 * self.sigma
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+stats = CacheStats()
+
+# (player_id, category_id) -> (map_id, position_id) -> rating
+_ratings: dict[tuple[int, str], dict[tuple[str | None, str | None], CachedRating]] = {}
+# Until warm() has run, or for anything invalidated since, a missing entry
+# doesn't mean the player has no rating, so it has to be looked up
+_warm: bool = False
+_stale_player_ids: set[int] = set()
+_stale_category_ids: set[str] = set()
+
+
+def warm(session: SQLAlchemySession):
+    """
+    Load every PlayerCategoryTrueskill into the cache. Called at bot setup.
+    """
+    global _warm
+    _ratings.clear()
+    count = 0
+    for player_id, category_id, map_id, position_id, mu, sigma in session.query(
+        PlayerCategoryTrueskill.player_id,
+        PlayerCategoryTrueskill.category_id,
+        PlayerCategoryTrueskill.map_id,
+        PlayerCategoryTrueskill.position_id,
+        PlayerCategoryTrueskill.mu,
+        PlayerCategoryTrueskill.sigma,
+    ):
+        _ratings.setdefault((player_id, category_id), {}).setdefault(
+            (map_id, position_id), CachedRating(mu, sigma)
+        )
+        count += 1
+    _stale_player_ids.clear()
+    _stale_category_ids.clear()
+    _warm = True
+    _log.info(f"[rating_cache.warm] Loaded {count} player category trueskills")
+
+
+def invalidate(player_id: int | None = None, category_id: str | None = None):
+    """
+    Forget cached ratings for a player, a category, or with neither,
+    everything. They're read from the database again the next time they're
+    needed.
+    """
+    global _warm
+    if player_id is None and category_id is None:
+        _ratings.clear()
+        _warm = False
+        return
+    for key in list(_ratings):
+        if player_id in (None, key[0]) and category_id in (None, key[1]):
+            del _ratings[key]
+    if player_id is not None:
+        _stale_player_ids.add(player_id)
+    else:
+        _stale_category_ids.add(category_id)
+
+
+def _is_complete(player_id: int, category_id: str) -> bool:
+    return (
+        _warm
+        and player_id not in _stale_player_ids
+        and category_id not in _stale_category_ids
+    )
+
+
+def _load(
+    session: SQLAlchemySession, player_id: int, category_id: str
+) -> dict[tuple[str | None, str | None], CachedRating]:
+    ratings: dict[tuple[str | None, str | None], CachedRating] = {}
+    for map_id, position_id, mu, sigma in session.query(
+        PlayerCategoryTrueskill.map_id,
+        PlayerCategoryTrueskill.position_id,
+        PlayerCategoryTrueskill.mu,
+        PlayerCategoryTrueskill.sigma,
+    ).filter(
+        PlayerCategoryTrueskill.player_id == player_id,
+        PlayerCategoryTrueskill.category_id == category_id,
+    ):
+        ratings.setdefault((map_id, position_id), CachedRating(mu, sigma))
+    return ratings
+
+
+def _player_category_ratings(
+    session: SQLAlchemySession, player_id: int, category_id: str
+) -> dict[tuple[str | None, str | None], CachedRating]:
+    key = (player_id, category_id)
+    if key in _ratings or _is_complete(player_id, category_id):
+        stats.hits += 1
+        return _ratings.get(key, {})
+    stats.misses += 1
+    ratings = _load(session, player_id, category_id)
+    _ratings[key] = ratings
+    return ratings
+
+
+def get(
+    session: SQLAlchemySession,
+    player_id: int,
+    category_id: str,
+    map_id: str | None = None,
+    position_id: str | None = None,
+) -> CachedRating | None:
+    """
+    :returns: The rating stored for exactly this player, category, map and
+    position, or None if there isn't one
+    """
+    return _player_category_ratings(session, player_id, category_id).get(
+        (map_id, position_id)
+    )
+
+
+def get_any(
+    session: SQLAlchemySession, player_id: int, category_id: str
+) -> CachedRating | None:
+    """
+    :returns: The player's category-only rating if they have one, otherwise
+    any of their ratings in the category, or None if they have none
+    """
+    ratings = _player_category_ratings(session, player_id, category_id)
+    if (None, None) in ratings:
+        return ratings[(None, None)]
+    return next(iter(ratings.values()), None)
+
+
+def get_all(
+    session: SQLAlchemySession, player_id: int, category_id: str
+) -> dict[tuple[str | None, str | None], CachedRating]:
+    """
+    :returns: Every rating the player has in the category, by (map_id,
+    position_id)
+    """
+    return dict(_player_category_ratings(session, player_id, category_id))
+
+
+def _set(
+    player_id: int,
+    category_id: str,
+    map_id: str | None,
+    position_id: str | None,
+    rating: CachedRating | None,
+):
+    key = (player_id, category_id)
+    if key not in _ratings:
+        if not _is_complete(player_id, category_id):
+            # Load the rest of this player's ratings on the next read instead
+            return
+        _ratings[key] = {}
+    if rating:
+        _ratings[key][(map_id, position_id)] = rating
+    else:
+        _ratings[key].pop((map_id, position_id), None)
+
+
+# Write-through: remember what each flush changed, apply it once the session
+# commits, and throw it away if it rolls back
+_PENDING_CHANGES_KEY = "rating_cache_pending_changes"
+
+
+@event.listens_for(SQLAlchemySession, "after_flush")
+def _after_flush(session: SQLAlchemySession, _flush_context):
+    changes: dict = session.info.setdefault(_PENDING_CHANGES_KEY, {})
+    for obj in session.new | session.dirty:
+        if isinstance(obj, PlayerCategoryTrueskill):
+            changes[obj.id] = (
+                obj.player_id,
+                obj.category_id,
+                obj.map_id,
+                obj.position_id,
+                CachedRating(obj.mu, obj.sigma),
+            )
+    for obj in session.deleted:
+        if isinstance(obj, PlayerCategoryTrueskill):
+            changes[obj.id] = (
+                obj.player_id,
+                obj.category_id,
+                obj.map_id,
+                obj.position_id,
+                None,
+            )
+
+
+@event.listens_for(SQLAlchemySession, "after_commit")
+def _after_commit(session: SQLAlchemySession):
+    for change in session.info.pop(_PENDING_CHANGES_KEY, {}).values():
+        _set(*change)
+
+
+@event.listens_for(SQLAlchemySession, "after_transaction_end")
+def _after_transaction_end(session: SQLAlchemySession, transaction):
+    # Anything still pending here was rolled back
+    if transaction.parent is None:
+        session.info.pop(_PENDING_CHANGES_KEY, None)
@@ -0,0 +1,236 @@
+"""
+Renders the game server's HTML stat sheets to images and uploads them without
+blocking the event loop.
+
+When a game finishes, submit() takes the newest stat sheet in STATS_DIR that
+no other job has taken and queues a job that renders it with wkhtmltoimage
+(through imgkit) and crops it with PIL in one of STATS_RENDER_WORKERS worker
+threads, then uploads it from the event loop as soon as it's done. The
+command that finished the game doesn't wait for any of it. The stat sheet is
+taken straight away, so a job waiting for a worker can't end up with the
+sheet of a game that finished after it.
+
+Rather than listing and stat'ing every file in STATS_DIR for every job, the
+jobs share an index of the stat sheets (see StatsDirWatcher), which is only
+rebuilt when a file was added to or removed from the directory.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import discord
+from discord import DMChannel, GroupChannel, TextChannel
+
+import discord_bots.config as config
+
+_log = logging.getLogger(__name__)
+
+
+@dataclass
+class RenderMetrics:
+    """
+    :rendered: Stat sheets rendered and uploaded
+    :failed: Jobs that failed to render or upload
+    :queue_depth: Jobs submitted that haven't finished yet
+    :queue_wait_seconds: Time spent waiting for a free worker
+    :render_seconds: Time spent rendering and cropping inside the worker
+    """
+
+    rendered: int = 0
+    failed: int = 0
+    queue_depth: int = 0
+    max_queue_depth: int = 0
+    total_queue_wait_seconds: float = 0.0
+    max_queue_wait_seconds: float = 0.0
+    total_render_seconds: float = 0.0
+    max_render_seconds: float = 0.0
+
+    def record(self, queue_wait_seconds: float, render_seconds: float):
+        self.rendered += 1
+        self.total_queue_wait_seconds += queue_wait_seconds
+        self.max_queue_wait_seconds = max(
+            self.max_queue_wait_seconds, queue_wait_seconds
+        )
+        self.total_render_seconds += render_seconds
+        self.max_render_seconds = max(self.max_render_seconds, render_seconds)
+
+
+metrics = RenderMetrics()
+
+
+class StatsDirWatcher:
+    """
+    The stat sheets in a directory and when each was modified. The directory
+    is only scanned again when its own modification time changes, which
+    happens whenever a file is added, removed or renamed in it.
+
+    Not thread safe, the event loop and the workers share one under _lock.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._directory_mtime_ns: int | None = None
+        self._mtimes: dict[str, float] = {}
+        # Stat sheets a job is rendering or uploading
+        self._claimed: set[str] = set()
+
+    def _refresh(self):
+        directory_mtime_ns = os.stat(self.directory).st_mtime_ns
+        if directory_mtime_ns == self._directory_mtime_ns:
+            return
+        self._directory_mtime_ns = directory_mtime_ns
+        self._mtimes = {
+            entry.name: entry.stat().st_mtime
+            for entry in os.scandir(self.directory)
+            if entry.name.endswith(".html") and entry.is_file()
+        }
+
+    def claim_newest(self) -> str | None:
+        """
+        :returns: The file name of the most recently modified stat sheet no
+        other job has claimed, or None if there isn't one
+        """
+        self._refresh()
+        unclaimed = [name for name in self._mtimes if name not in self._claimed]
+        if not unclaimed:
+            return None
+        newest = max(unclaimed, key=self._mtimes.__getitem__)
+        self._claimed.add(newest)
+        return newest
+
+    def release(self, name: str, cleanup: bool):
+        """
+        Give up a claimed stat sheet. With cleanup, delete it, its image, and
+        every unclaimed stat sheet older than it with their images.
+        """
+        self._claimed.discard(name)
+        if not cleanup:
+            return
+        mtime = self._mtimes.get(name, float("-inf"))
+        names = [name] + [
+            other_name
+            for other_name, other_mtime in self._mtimes.items()
+            if other_name != name
+            and other_name not in self._claimed
+            and other_mtime <= mtime
+        ]
+        for name_ in names:
+            for file_ in (name_, name_ + ".png"):
+                try:
+                    os.remove(os.path.join(self.directory, file_))
+                except FileNotFoundError:
+                    pass
+
+
+_executor: ThreadPoolExecutor | None = None
+_watcher: StatsDirWatcher | None = None
+_lock = threading.Lock()
+# Keeps the running jobs from being garbage collected
+_jobs: set[asyncio.Task] = set()
+
+
+def _claim_newest() -> str | None:
+    global _watcher
+    with _lock:
+        if _watcher is None:
+            _watcher = StatsDirWatcher(config.STATS_DIR)
+        return _watcher.claim_newest()
+
+
+def _render(html_file: str) -> tuple[float, float]:
+    """
+    Runs in a worker thread. Renders the stat sheet to <html_file>.png.
+
+    :returns: When the worker started, and how long rendering took
+    """
+    import imgkit
+    from PIL import Image
+
+    started_at = time.time()
+    image_path = os.path.join(config.STATS_DIR, html_file + ".png")
+    imgkit.from_file(
+        os.path.join(config.STATS_DIR, html_file),
+        image_path,
+        options={"enable-local-file-access": None},
+    )
+    if config.STATS_WIDTH and config.STATS_HEIGHT:
+        with Image.open(image_path) as image:
+            cropped = image.crop((0, 0, config.STATS_WIDTH, config.STATS_HEIGHT))
+        cropped.save(image_path)
+    return started_at, time.time() - started_at
+
+
+def _release(html_file: str, cleanup: bool):
+    with _lock:
+        _watcher.release(html_file, cleanup)
+
+
+async def _run(
+    channel: TextChannel | DMChannel | GroupChannel, html_file: str, cleanup: bool
+):
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=max(1, config.STATS_RENDER_WORKERS),
+            thread_name_prefix="stats_render",
+        )
+    metrics.queue_depth += 1
+    metrics.max_queue_depth = max(metrics.max_queue_depth, metrics.queue_depth)
+    submitted_at = time.time()
+    # A stat sheet that failed to render is kept
+    rendered = False
+    try:
+        started_at, render_seconds = await asyncio.get_running_loop().run_in_executor(
+            _executor, _render, html_file
+        )
+        rendered = True
+        await channel.send(
+            file=discord.File(os.path.join(config.STATS_DIR, html_file + ".png"))
+        )
+        queue_wait_seconds = max(0.0, started_at - submitted_at)
+        metrics.record(queue_wait_seconds, render_seconds)
+        _log.info(
+            f"[stats_render] Uploaded {html_file}, queue wait: {queue_wait_seconds:.3f}s, render: {render_seconds:.3f}s, queue depth: {metrics.queue_depth}"
+        )
+    except Exception:
+        metrics.failed += 1
+        _log.exception("[stats_render] Failed to render or upload a stat sheet")
+    finally:
+        metrics.queue_depth -= 1
+        await asyncio.to_thread(_release, html_file, cleanup and rendered)
+
+
+def submit(channel: TextChannel | DMChannel | GroupChannel, cleanup: bool = True):
+    """
+    Take the newest stat sheet and queue rendering it and uploading it to
+    the channel. Returns straight away.
+
+    :param cleanup: Whether to delete the stat sheet and its image once it's
+    uploaded, along with any older stat sheets
+    """
+    if not config.STATS_DIR:
+        return
+    # Only rescans STATS_DIR if a file was added or removed since the last
+    # job, so this is cheap enough for the event loop
+    try:
+        html_file = _claim_newest()
+    except OSError:
+        _log.exception(f"[stats_render] Failed to read {config.STATS_DIR}")
+        return
+    if html_file is None:
+        return
+    job = asyncio.create_task(_run(channel, html_file, cleanup))
+    _jobs.add(job)
+    job.add_done_callback(_jobs.discard)
+
+
+def shutdown():
+    global _executor
+    if _executor:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -4,23 +4,37 @@
 
 import asyncio
 import logging
+import time
 from collections import defaultdict
 from datetime import datetime, timedelta, timezone
 from random import shuffle
 
 import discord
-import sqlalchemy
 from discord.channel import TextChannel
 from discord.colour import Colour
 from discord.ext import tasks
 from discord.guild import Guild
 from discord.member import Member
 from discord.utils import escape_markdown
+from sqlalchemy import case, func, literal, select, union_all, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
+import discord_bots.activity as activity
 import discord_bots.config as config
+import discord_bots.leaderboard as leaderboard
+import discord_bots.rank_index as rank_index
+import discord_bots.rating_cache as rating_cache
+from discord_bots.async_db_utils import (
+    async_delete_where,
+    async_query_all,
+    async_query_first,
+    async_session,
+)
 from discord_bots.cogs.schedule import ScheduleUtils
+from discord_bots.dispatcher import Priority
 from discord_bots.utils import (
     add_empty_field,
+    async_is_in_game,
     execute_map_rotation,
     move_game_players_lobby,
     print_leaderboard,
@@ -29,7 +43,7 @@ from discord_bots.utils import (
 
 from .bot import bot
 from .cogs.economy import EconomyCommands
-from .commands import add_player_to_queue, create_game, is_in_game
+from .commands import add_player_to_queues, create_game
 from .models import (
     Category,
     InProgressGame,
@@ -38,6 +52,7 @@ from .models import (
     MapVote,
     Player,
     PlayerCategoryTrueskill,
+    PlayerDecay,
     Queue,
     QueuePlayer,
     QueueWaitlist,
@@ -46,7 +61,6 @@ from .models import (
     RotationMap,
     SchedulePlayer,
     ScopedSession,
-    Session,
     SkipMapVote,
     VotePassedWaitlist,
     VotePassedWaitlistPlayer,
@@ -56,18 +70,29 @@ from .queues import AddPlayerQueueMessage, add_player_queue, waitlist_messages
 _log = logging.getLogger(__name__)
 
 
-async def add_players(session: sqlalchemy.orm.Session):
+async def add_players(session: AsyncSession, messages: list[AddPlayerQueueMessage]):
     """
     Handle adding players in a task that pulls messages off of a queue.
 
     This helps with concurrency issues since players can be added from multiple
     sources (waitlist vs normal add command)
+
+    session is only used to read the queues and build the reply. Each message
+    is still added by add_player_to_queues in its own transaction, committed
+    before the next message is handled: a queue that pops runs create_game,
+    which reads the queue's players in a session of its own, so every add
+    before it has to be committed already.
+
+    :messages: Every message that was waiting, in the order they were sent
     """
-    if add_player_queue.empty():
-        # check if the queue is empty up front to avoid emitting any SQL
-        return
-    queues: list[Queue] = session.query(Queue).order_by(Queue.ordinal.asc()).all()
+    queues: list[Queue] = list(
+        await session.scalars(select(Queue).order_by(Queue.ordinal.asc()))
+    )
     queue_by_id: dict[str, Queue] = {queue.id: queue for queue in queues}
+    # Loaded up front, an AsyncSession can't lazy load queue.rotation
+    rotation_by_id: dict[str, Rotation] = {
+        rotation.id: rotation for rotation in await async_query_all(session, Rotation)
+    }
     queues_added_to_by_player_id: dict[int, list[Queue]] = {}
     queues_added_to_by_id: dict[str, Queue] = {}
     rotations_added_to_by_id: dict[str, Rotation] = {}
@@ -75,9 +100,8 @@ async def add_players(session: sqlalchemy.orm.Session):
     message: AddPlayerQueueMessage | None = None
     embed = discord.Embed()
     queue_popped = False
-    while not add_player_queue.empty():
+    for message in messages:
         queues_added_to: list[Queue] = []
-        message: AddPlayerQueueMessage = add_player_queue.get()
         player_name_by_id[message.player_id] = message.player_name
         # add some randomization to which queue gets to pop. queue_player does not track the add-time, otherwise it
         # would be possible to fill all queues and then start popping full queues randomly until no queue has full
@@ -85,22 +109,20 @@ async def add_players(session: sqlalchemy.orm.Session):
         queue_ids = message.queue_ids
         if config.POP_RANDOM_QUEUE:
             shuffle(queue_ids)
-        for queue_id in queue_ids:
-            queue: Queue = queue_by_id[queue_id]
-            if queue.is_locked:
-                continue
-
-            added_to_queue, queue_popped = await add_player_to_queue(
-                queue.id, message.player_id, message.channel, message.guild
-            )
-            if queue_popped:
-                queues_added_to = []
-                break
-            if added_to_queue:
-                queues_added_to.append(queue)
+        added_queue_ids, popped_queue_id = await add_player_to_queues(
+            [queue_id for queue_id in queue_ids if not queue_by_id[queue_id].is_locked],
+            message.player_id,
+            message.channel,
+            message.guild,
+        )
+        queue_popped = popped_queue_id is not None
+        if not queue_popped:
+            queues_added_to = [queue_by_id[queue_id] for queue_id in added_queue_ids]
         for queue in queues_added_to:
             queues_added_to_by_id[queue.id] = queue
-            rotations_added_to_by_id[queue.rotation_id] = queue.rotation
+            rotations_added_to_by_id[queue.rotation_id] = rotation_by_id[
+                queue.rotation_id
+            ]
         if message.player_id not in queues_added_to_by_player_id:
             queues_added_to_by_player_id[message.player_id] = queues_added_to
         else:
@@ -120,26 +142,23 @@ async def add_players(session: sqlalchemy.orm.Session):
                     value=f"```asciidoc\n* {rotation.name}```",
                     inline=False,
                 )
-            next_rotation_map: RotationMap | None = (
-                session.query(RotationMap)
-                .filter(RotationMap.rotation_id == rotation.id)
-                .filter(RotationMap.is_next == True)
-                .first()
+            next_rotation_map: RotationMap | None = await async_query_first(
+                session,
+                RotationMap,
+                RotationMap.rotation_id == rotation.id,
+                RotationMap.is_next == True,
             )
             if not next_rotation_map:
                 continue
-            next_map: Map | None = (
-                session.query(Map)
-                .join(RotationMap, RotationMap.map_id == Map.id)
-                .filter(next_rotation_map.map_id == Map.id)
-                .first()
+            next_map: Map | None = await async_query_first(
+                session, Map, Map.id == next_rotation_map.map_id
             )
             if next_map:
                 next_map_str = f"{next_map.full_name} ({next_map.short_name})"
-                skip_map_votes_count = (
-                    session.query(SkipMapVote)
-                    .filter(SkipMapVote.rotation_id == rotation.id)
-                    .count()
+                skip_map_votes_count: int = await session.scalar(
+                    select(func.count(SkipMapVote.id)).where(
+                        SkipMapVote.rotation_id == rotation.id
+                    )
                 )
                 if skip_map_votes_count:
                     embed.add_field(
@@ -159,37 +178,20 @@ async def add_players(session: sqlalchemy.orm.Session):
                         inline=False,
                     )
             for queue_id in set(queues_added_to_by_id.keys()) & set(
-                [queue.id for queue in rotation.queues]
+                [queue.id for queue in queues if queue.rotation_id == rotation.id]
             ):
-                queue: Queue = session.query(Queue).filter(Queue.id == queue_id).one()
+                queue: Queue = queue_by_id[queue_id]
                 if queue.is_locked:
                     continue
 
-                queue_players = (
-                    session.query(QueuePlayer, Player.name)
-                    .join(Player, QueuePlayer.player_id == Player.id)
-                    .filter(QueuePlayer.queue_id == queue.id)
-                    .order_by(QueuePlayer.added_at.asc())
-                    .all()
-                )
-                player_names: list[str] = (
-                    [name[1] for name in queue_players] if queue_players else []
-                )
-                next_rotation_map: RotationMap | None = (
-                    session.query(RotationMap)
-                    .filter(RotationMap.rotation_id == queue.rotation_id)
-                    .filter(RotationMap.is_next == True)
-                    .first()
-                )
-                if next_rotation_map:
-                    next_map: Map | None = (
-                        session.query(Map)
-                        .join(RotationMap, RotationMap.map_id == Map.id)
-                        .filter(next_rotation_map.map_id == Map.id)
-                        .first()
+                player_names: list[str] = list(
+                    await session.scalars(
+                        select(Player.name)
+                        .join(QueuePlayer, QueuePlayer.player_id == Player.id)
+                        .where(QueuePlayer.queue_id == queue.id)
+                        .order_by(QueuePlayer.added_at.asc())
                     )
-                    if next_map:
-                        next_map_str = f"{next_map.full_name} ({next_map.short_name})"
+                )
                 queue_title_str = f"(**{queue.ordinal}**) {queue.name} [{len(player_names)}/{queue.size}]"
                 newline = "\n"
                 embed.add_field(
@@ -203,7 +205,7 @@ async def add_players(session: sqlalchemy.orm.Session):
                 )
 
         for player_id in queues_added_to_by_player_id.keys():
-            if is_in_game(player_id):
+            if await async_is_in_game(session, player_id):
                 continue
             player_name = player_name_by_id[player_id]
             queues_added_to = queues_added_to_by_player_id[player_id]
@@ -232,27 +234,28 @@ async def add_players(session: sqlalchemy.orm.Session):
     for queue in queues:
         if not queue.is_sweaty:
             continue
-        queue_players: list[QueuePlayer] = (
-            session.query(QueuePlayer).filter(QueuePlayer.queue_id == queue.id).all()
+        player_ids: list[int] = list(
+            await session.scalars(
+                select(QueuePlayer.player_id).where(QueuePlayer.queue_id == queue.id)
+            )
         )
-        if len(queue_players) >= queue.size:
-            player_ids: list[int] = list(map(lambda x: x.player_id, queue_players))
+        if len(player_ids) >= queue.size:
             if queue.category_id:
-                pcts = session.query(PlayerCategoryTrueskill).filter(
-                    PlayerCategoryTrueskill.player_id.in_(player_ids),
-                    PlayerCategoryTrueskill.category_id == queue.category_id,
-                )
-                top_player_ids = [
-                    prt.player_id
-                    for prt in sorted(
-                        pcts,
-                        key=lambda prt: prt.mu,
-                        reverse=True,
-                    )[: queue.size]
-                ]
+                ratings: dict[int, rating_cache.CachedRating] = {}
+                for player_id in player_ids:
+                    rating = await session.run_sync(
+                        rating_cache.get_any, player_id, queue.category_id
+                    )
+                    if rating:
+                        ratings[player_id] = rating
+                top_player_ids = sorted(
+                    ratings,
+                    key=lambda player_id: ratings[player_id].mu,
+                    reverse=True,
+                )[: queue.size]
             else:
-                players: list[Player] = (
-                    session.query(Player).filter(Player.id.in_(player_ids)).all()
+                players: list[Player] = await async_query_all(
+                    session, Player, Player.id.in_(player_ids)
                 )
                 top_player_ids = [
                     player.id
@@ -270,112 +273,153 @@ async def add_players(session: sqlalchemy.orm.Session):
             )
 
 
-@tasks.loop(seconds=1)
+@tasks.loop(seconds=config.ACTIVITY_FLUSH_SECONDS)
+async def activity_flush_task():
+    """
+    Write the player activity buffered since the last run to the database
+    """
+    await activity.flush()
+
+
+@tasks.loop()
 async def add_player_task():
-    session: sqlalchemy.orm.Session
-    with Session() as session:
-        await add_players(session)
+    # Sleep until someone adds, then take everyone else who added meanwhile
+    # too, so a burst of adds is handled in one batch
+    messages: list[AddPlayerQueueMessage] = [await add_player_queue.get()]
+    while not add_player_queue.empty():
+        messages.append(add_player_queue.get_nowait())
+    async with async_session() as session:
+        await add_players(session, messages)
 
 
 @tasks.loop(minutes=1)
 async def afk_timer_task():
-    session: sqlalchemy.orm.Session
-    with Session() as session:
-        timeout: datetime = datetime.now(timezone.utc) - timedelta(
-            minutes=config.AFK_TIME_MINUTES
-        )
+    """
+    Remove inactive players from every queue and take away their map votes.
 
-        player: Player
-        for player in (
-            session.query(Player)
-            .join(QueuePlayer)
-            .filter(
-                Player.last_activity_at < timeout, QueuePlayer.player_id == Player.id
-            )
-        ):
-            queue_player = (
-                session.query(QueuePlayer)
-                .filter(QueuePlayer.player_id == player.id)
-                .first()
-            )
-            if queue_player:
-                channel = bot.get_channel(queue_player.channel_id)
-                if channel and isinstance(channel, TextChannel):
-                    member: Member | None = channel.guild.get_member(player.id)
-                    if member:
-                        await send_message(
-                            channel,
-                            content=f"{member.mention} was removed from all queues for being inactive for {config.AFK_TIME_MINUTES} minutes",
-                            embed_content=False,
+    Everyone who's inactive is found with one query across the three tables
+    and removed with one bulk delete per table. The messages go out after the
+    commit, one per channel, all at once.
+    """
+    start = time.perf_counter()
+    timeout: datetime = datetime.now(timezone.utc) - timedelta(
+        minutes=config.AFK_TIME_MINUTES
+    )
+    async with async_session() as session:
+        inactive_rows = (
+            await session.execute(
+                union_all(
+                    *[
+                        select(
+                            literal(table.__tablename__).label("table_name"),
+                            table.player_id,
+                            table.channel_id,
+                            Player.name,
                         )
-                session.query(QueuePlayer).filter(
-                    QueuePlayer.player_id == player.id
-                ).delete()
-                session.commit()
-
-        votes_removed_sent = False
-        for player in (
-            session.query(Player)
-            .join(MapVote)
-            .filter(Player.last_activity_at < timeout, MapVote.player_id == Player.id)
-        ):
-            map_votes: list[MapVote] = (
-                session.query(MapVote).filter(MapVote.player_id == player.id).all()
+                        .join(Player, Player.id == table.player_id)
+                        .where(Player.last_activity_at < timeout)
+                        for table in (QueuePlayer, MapVote, SkipMapVote)
+                    ]
+                )
             )
-            if len(map_votes) > 0:
-                channel = bot.get_channel(map_votes[0].channel_id)
-                if channel and isinstance(channel, TextChannel):
-                    member: Member | None = channel.guild.get_member(player.id)
-                    if member:
-                        await send_message(
-                            channel,
-                            content=member.mention,
-                            embed_content=False,
-                            embed_description=f"{escape_markdown(player.name)}'s votes removed for being inactive for {config.AFK_TIME_MINUTES} minutes",
-                            colour=Colour.red(),
-                        )
-                        votes_removed_sent = True
-                session.query(MapVote).filter(MapVote.player_id == player.id).delete()
-                session.commit()
-
-        for player in (
-            session.query(Player)
-            .join(SkipMapVote)
-            .filter(
-                Player.last_activity_at < timeout, SkipMapVote.player_id == Player.id
+        ).all()
+        # Activity that hasn't been flushed yet isn't in the database
+        inactive_rows = [
+            row
+            for row in inactive_rows
+            if (activity.last_activity_at(row.player_id) or datetime.min)
+            < timeout.replace(tzinfo=None)
+        ]
+        if not inactive_rows:
+            _log.debug(
+                f"[afk_timer_task] Nobody inactive, took {time.perf_counter() - start:.3f}s"
             )
-        ):
-            skip_map_votes: list[SkipMapVote] = (
-                session.query(SkipMapVote)
-                .filter(SkipMapVote.player_id == player.id)
-                .all()
+            return
+
+        player_ids_by_table: dict[str, set[int]] = defaultdict(set)
+        # The first channel each player added or voted in, like before
+        queue_channel_id_by_player_id: dict[int, int] = {}
+        vote_channel_id_by_player_id: dict[int, int] = {}
+        player_name_by_id: dict[int, str] = {}
+        for table_name, player_id, channel_id, player_name in inactive_rows:
+            player_ids_by_table[table_name].add(player_id)
+            player_name_by_id[player_id] = player_name
+            if table_name == QueuePlayer.__tablename__:
+                queue_channel_id_by_player_id.setdefault(player_id, channel_id)
+            else:
+                vote_channel_id_by_player_id.setdefault(player_id, channel_id)
+
+        for table in (QueuePlayer, MapVote, SkipMapVote):
+            player_ids = player_ids_by_table[table.__tablename__]
+            if player_ids:
+                await async_delete_where(
+                    session, table, table.player_id.in_(player_ids)
+                )
+        await session.commit()
+
+    def members_by_channel(
+        channel_id_by_player_id: dict[int, int],
+    ) -> dict[TextChannel, list[tuple[Member, str]]]:
+        members: dict[TextChannel, list[tuple[Member, str]]] = defaultdict(list)
+        for player_id, channel_id in channel_id_by_player_id.items():
+            channel = bot.get_channel(channel_id)
+            if channel and isinstance(channel, TextChannel):
+                member: Member | None = channel.guild.get_member(player_id)
+                if member:
+                    members[channel].append((member, player_name_by_id[player_id]))
+        return members
+
+    coroutines = []
+    for channel, members in members_by_channel(queue_channel_id_by_player_id).items():
+        mentions = ", ".join(member.mention for member, _ in members)
+        coroutines.append(
+            send_message(
+                channel,
+                content=f"{mentions} {'was' if len(members) == 1 else 'were'} removed from all queues for being inactive for {config.AFK_TIME_MINUTES} minutes",
+                embed_content=False,
+                priority=Priority.BACKGROUND,
             )
-            if len(skip_map_votes) > 0:
-                # So we don't send this message twice
-                if not votes_removed_sent:
-                    channel = bot.get_channel(skip_map_votes[0].channel_id)
-                    if channel and isinstance(channel, TextChannel):
-                        member: Member | None = channel.guild.get_member(player.id)
-                        if member:
-                            await send_message(
-                                channel,
-                                content=member.mention,
-                                embed_content=False,
-                                embed_description=f"{escape_markdown(player.name)}'s votes removed for being inactive for {config.AFK_TIME_MINUTES} minutes",
-                                colour=Colour.red(),
-                            )
-                session.query(SkipMapVote).filter(
-                    SkipMapVote.player_id == player.id
-                ).delete()
-                session.commit()
+        )
+    for channel, members in members_by_channel(vote_channel_id_by_player_id).items():
+        names = ", ".join(escape_markdown(name) for _, name in members)
+        coroutines.append(
+            send_message(
+                channel,
+                content=" ".join(member.mention for member, _ in members),
+                embed_content=False,
+                embed_description=(
+                    f"{names}'s votes removed"
+                    if len(members) == 1
+                    else f"Votes removed for {names}"
+                )
+                + f" for being inactive for {config.AFK_TIME_MINUTES} minutes",
+                colour=Colour.red(),
+                priority=Priority.BACKGROUND,
+            )
+        )
+    await asyncio.gather(*coroutines)
+    _log.info(
+        f"[afk_timer_task] Removed {len(queue_channel_id_by_player_id)} player(s) from queues and {len(vote_channel_id_by_player_id)} player(s) votes, took {time.perf_counter() - start:.3f}s"
+    )
+
 
+leaderboard_printed_at: float | None = None
 
-@tasks.loop(seconds=1800)
+
+@tasks.loop(seconds=60)
 async def leaderboard_task():
     """
-    Periodically print the leaderboard
+    Print the leaderboard soon after a game finishes or ratings decay, and at
+    least every 30 minutes to pick up any other rating changes
     """
-    await print_leaderboard()
+    global leaderboard_printed_at
+    if (
+        leaderboard.take_dirty()
+        or leaderboard_printed_at is None
+        or time.monotonic() - leaderboard_printed_at >= 1800
+    ):
+        leaderboard_printed_at = time.monotonic()
+        await print_leaderboard()
 
 
 @tasks.loop(minutes=1)
@@ -386,18 +430,17 @@ async def map_rotation_task():
     if config.DISABLE_MAP_ROTATION:
         return
 
-    session: sqlalchemy.orm.Session
-    with Session() as session:
-        rotations: list[Rotation] | None = session.query(Rotation).all()
+    async with async_session() as session:
+        rotations: list[Rotation] = await async_query_all(session, Rotation)
         if not rotations:
             return
 
         for rotation in rotations:
-            next_rotation_map: RotationMap | None = (
-                session.query(RotationMap)
-                .filter(RotationMap.rotation_id == rotation.id)
-                .filter(RotationMap.is_next == True)
-                .first()
+            next_rotation_map: RotationMap | None = await async_query_first(
+                session,
+                RotationMap,
+                RotationMap.rotation_id == rotation.id,
+                RotationMap.is_next == True,
             )
             if next_rotation_map and not next_rotation_map.stop_rotation:
                 time_since_update: timedelta = datetime.now(
@@ -413,12 +456,10 @@ async def prediction_task():
     Updates prediction embeds.
     Closes prediction after submission period
     """
-    session = Session()
-    in_progress_games: list[InProgressGame] | None = (
-        session.query(InProgressGame)
-        .filter(InProgressGame.prediction_open == True)
-        .all()
-    )
+    async with async_session() as session:
+        in_progress_games: list[InProgressGame] = await async_query_all(
+            session, InProgressGame, InProgressGame.prediction_open == True
+        )
     try:
         await EconomyCommands.update_embeds(None, in_progress_games)
     except Exception as e:
@@ -427,12 +468,10 @@ async def prediction_task():
         # Cleanly cancel & restart task to resolve
         _log.warning(e)
         _log.info("prediction_task restarting...")
-        session.close()
         prediction_task.cancel()
         prediction_task.restart()
 
     await EconomyCommands.close_predictions(None, in_progress_games=in_progress_games)
-    session.close()
 
 
 @tasks.loop(seconds=1)
@@ -445,9 +484,10 @@ async def queue_waitlist_task():
 
     TODO: Tests for this method
     """
-    session: sqlalchemy.orm.Session
-    with Session() as session:
-        queues: list[Queue] = session.query(Queue).order_by(Queue.ordinal.asc())  # type: ignore
+    async with async_session() as session:
+        queues: list[Queue] = list(
+            await session.scalars(select(Queue).order_by(Queue.ordinal.asc()))
+        )
         queue_waitlist: QueueWaitlist
         channel: (
             discord.abc.GuildChannel
@@ -456,8 +496,10 @@ async def queue_waitlist_task():
             | None
         ) = None
         guild: Guild | None = None
-        for queue_waitlist in session.query(QueueWaitlist).filter(
-            QueueWaitlist.end_waitlist_at < datetime.now(timezone.utc)
+        for queue_waitlist in await async_query_all(
+            session,
+            QueueWaitlist,
+            QueueWaitlist.end_waitlist_at < datetime.now(timezone.utc),
         ):
             if not channel:
                 channel = bot.get_channel(queue_waitlist.channel_id)
@@ -465,10 +507,10 @@ async def queue_waitlist_task():
                 guild = bot.get_guild(queue_waitlist.guild_id)
 
             queue_waitlist_players: list[QueueWaitlistPlayer]
-            queue_waitlist_players = (
-                session.query(QueueWaitlistPlayer)
-                .filter(QueueWaitlistPlayer.queue_waitlist_id == queue_waitlist.id)
-                .all()
+            queue_waitlist_players = await async_query_all(
+                session,
+                QueueWaitlistPlayer,
+                QueueWaitlistPlayer.queue_waitlist_id == queue_waitlist.id,
             )
             qwp_by_queue_id: dict[str, list[QueueWaitlistPlayer]] = defaultdict(list)
             for qwp in queue_waitlist_players:
@@ -481,18 +523,18 @@ async def queue_waitlist_task():
                 qwps_for_queue = qwp_by_queue_id[queue.id]
                 shuffle(qwps_for_queue)
                 for queue_waitlist_player in qwps_for_queue:
-                    if is_in_game(queue_waitlist_player.player_id):
-                        session.delete(queue_waitlist_player)
+                    if await async_is_in_game(session, queue_waitlist_player.player_id):
+                        await session.delete(queue_waitlist_player)
                         continue
 
                     if isinstance(channel, TextChannel) and guild:
-                        player = (
-                            session.query(Player)
-                            .filter(Player.id == queue_waitlist_player.player_id)
-                            .first()
+                        player = await async_query_first(
+                            session,
+                            Player,
+                            Player.id == queue_waitlist_player.player_id,
                         )
 
-                        add_player_queue.put(
+                        add_player_queue.put_nowait(
                             AddPlayerQueueMessage(
                                 queue_waitlist_player.player_id,
                                 player.name,
@@ -514,13 +556,11 @@ async def queue_waitlist_task():
                     )
                 finally:
                     waitlist_messages.clear()
-            ipg_channels: list[InProgressGameChannel] = (
-                session.query(InProgressGameChannel)
-                .filter(
-                    InProgressGameChannel.in_progress_game_id
-                    == queue_waitlist.in_progress_game_id
-                )
-                .all()
+            ipg_channels: list[InProgressGameChannel] = await async_query_all(
+                session,
+                InProgressGameChannel,
+                InProgressGameChannel.in_progress_game_id
+                == queue_waitlist.in_progress_game_id,
             )
             if guild:
                 ipg_discord_channels: list[discord.abc.GuildChannel] = [
@@ -541,18 +581,24 @@ async def queue_waitlist_task():
                         f"[queue_waitlist_task] Failed to delete in_progress_game channels {ipg_discord_channels} from guild {guild.id}"
                     )
             # TODO: deleting channels from the guild and from the DB isn't atomic
-            session.query(InProgressGameChannel).filter(
+            await async_delete_where(
+                session,
+                InProgressGameChannel,
                 InProgressGameChannel.in_progress_game_id
-                == queue_waitlist.in_progress_game_id
-            ).delete()
-            session.query(QueueWaitlistPlayer).filter(
-                QueueWaitlistPlayer.queue_waitlist_id == queue_waitlist.id
-            ).delete()
-            session.delete(queue_waitlist)
-            session.query(InProgressGame).filter(
-                InProgressGame.id == queue_waitlist.in_progress_game_id
-            ).delete()
-        session.commit()
+                == queue_waitlist.in_progress_game_id,
+            )
+            await async_delete_where(
+                session,
+                QueueWaitlistPlayer,
+                QueueWaitlistPlayer.queue_waitlist_id == queue_waitlist.id,
+            )
+            await session.delete(queue_waitlist)
+            await async_delete_where(
+                session,
+                InProgressGame,
+                InProgressGame.id == queue_waitlist.in_progress_game_id,
+            )
+        await session.commit()
 
 
 @tasks.loop(hours=24)
@@ -626,25 +672,28 @@ async def vote_passed_waitlist_task():
 
     TODO: Tests for this method
     """
-    session: sqlalchemy.orm.Session
-    with Session() as session:
-        vpw: VotePassedWaitlist | None = (
-            session.query(VotePassedWaitlist)
-            .filter(VotePassedWaitlist.end_waitlist_at < datetime.now(timezone.utc))
-            .first()
+    async with async_session() as session:
+        vpw: VotePassedWaitlist | None = await async_query_first(
+            session,
+            VotePassedWaitlist,
+            VotePassedWaitlist.end_waitlist_at < datetime.now(timezone.utc),
         )
         if not vpw:
             return
 
         channel = bot.get_channel(vpw.channel_id)
         guild: Guild | None = bot.get_guild(vpw.guild_id)
-        queues: list[Queue] = session.query(Queue).order_by(Queue.created_at.asc())  # type: ignore
+        queues: list[Queue] = list(
+            await session.scalars(select(Queue).order_by(Queue.created_at.asc()))
+        )
 
         # TODO: Do we actually need to filter by id?
         vote_passed_waitlist_players: list[VotePassedWaitlistPlayer] = (
-            session.query(VotePassedWaitlistPlayer)
-            .filter(VotePassedWaitlistPlayer.vote_passed_waitlist_id == vpw.id)
-            .all()
+            await async_query_all(
+                session,
+                VotePassedWaitlistPlayer,
+                VotePassedWaitlistPlayer.vote_passed_waitlist_id == vpw.id,
+            )
         )
         vpwp_by_queue_id: dict[str, list[VotePassedWaitlistPlayer]] = defaultdict(list)
         for vote_passed_waitlist_player in vote_passed_waitlist_players:
@@ -657,18 +706,20 @@ async def vote_passed_waitlist_task():
             vpwps_for_queue = vpwp_by_queue_id[queue.id]
             shuffle(vpwps_for_queue)
             for vote_passed_waitlist_player in vpwps_for_queue:
-                if is_in_game(vote_passed_waitlist_player.player_id):
-                    session.delete(vote_passed_waitlist_player)
+                if await async_is_in_game(
+                    session, vote_passed_waitlist_player.player_id
+                ):
+                    await session.delete(vote_passed_waitlist_player)
                     continue
 
                 if isinstance(channel, TextChannel) and guild:
-                    player = (
-                        session.query(Player)
-                        .filter(Player.id == vote_passed_waitlist_player.player_id)
-                        .first()
+                    player = await async_query_first(
+                        session,
+                        Player,
+                        Player.id == vote_passed_waitlist_player.player_id,
                     )
 
-                    add_player_queue.put(
+                    add_player_queue.put_nowait(
                         AddPlayerQueueMessage(
                             vote_passed_waitlist_player.player_id,
                             player.name,
@@ -680,47 +731,96 @@ async def vote_passed_waitlist_task():
                         )
                     )
 
-        session.query(VotePassedWaitlistPlayer).filter(
-            VotePassedWaitlistPlayer.vote_passed_waitlist_id == vpw.id
-        ).delete()
-        session.delete(vpw)
-        session.commit()
+        await async_delete_where(
+            session,
+            VotePassedWaitlistPlayer,
+            VotePassedWaitlistPlayer.vote_passed_waitlist_id == vpw.id,
+        )
+        await session.delete(vpw)
+        await session.commit()
 
 
 @tasks.loop(time=config.TRUESKILL_SIGMA_DECAY_JOB_SCHEDULED_TIME)
 async def sigma_decay_task():
-    session: sqlalchemy.orm.Session
-    with Session() as session:
-        # Lookup all categories to calculate sigma cutoffs
-        # TODO: If we kill off SQLite we can use INTERVAL to check a time range and have a single join between Category and PlayerCategoryTrueskill
-        time_now = datetime.now(timezone.utc)
-        categories = session.query(Category).filter(Category.sigma_decay_amount != 0.0).all()
-        category_details = {
-            category.id: {
-                'category': category,
-                'cutoff': time_now - timedelta(
-                    days=category.sigma_decay_grace_days
-                )
-            }
-            for category in categories
-        }
-
-        # Find all player trueskill values with a last played game older than the decay grace period
-        player_category_trueskills = (
-            session
-            .query(PlayerCategoryTrueskill)
-            .filter(
-                PlayerCategoryTrueskill.category_id.in_(category_details.keys())
-            )
-            .all()
+    """
+    Decays the sigma of every rating whose last game is older than its
+    category's grace period, with one UPDATE per category instead of loading
+    each PlayerCategoryTrueskill
+    """
+    start = time.perf_counter()
+    async with async_session() as session:
+        # last_game_finished_at is stored as naive UTC
+        time_now = datetime.now(timezone.utc).replace(tzinfo=None)
+        categories: list[Category] = await async_query_all(
+            session, Category, Category.sigma_decay_amount != 0.0
         )
-        for pct in player_category_trueskills:
-            # If the last game for this PCT was before the cutoff, apply the decay
-            if pct.last_game_finished_at.replace(tzinfo=timezone.utc) < category_details[pct.category_id]['cutoff']:
-                category = category_details[pct.category_id]['category']
-                pct.sigma = min(
-                    pct.sigma + category.sigma_decay_amount,
-                    config.DEFAULT_TRUESKILL_SIGMA * category.sigma_decay_max_decay_proportion,
+        decayed_counts: dict[str, int] = {}
+        for category in categories:
+            cutoff = time_now - timedelta(days=category.sigma_decay_grace_days)
+            max_sigma = (
+                config.DEFAULT_TRUESKILL_SIGMA
+                * category.sigma_decay_max_decay_proportion
+            )
+            # min(sigma + amount, max_sigma), spelled out so it works on both
+            # SQLite and Postgres
+            decayed_sigma = case(
+                (
+                    PlayerCategoryTrueskill.sigma + category.sigma_decay_amount
+                    < max_sigma,
+                    PlayerCategoryTrueskill.sigma + category.sigma_decay_amount,
+                ),
+                else_=max_sigma,
+            )
+            filters = (
+                PlayerCategoryTrueskill.category_id == category.id,
+                PlayerCategoryTrueskill.last_game_finished_at < cutoff,
+            )
+            if config.SIGMA_DECAY_AUDIT:
+                session.add_all(
+                    [
+                        PlayerDecay(
+                            player_id=player_id,
+                            decay_percentage=0.0,
+                            rated_trueskill_mu_before=mu,
+                            rated_trueskill_mu_after=mu,
+                            category_id=category.id,
+                            rated_trueskill_sigma_before=sigma_before,
+                            rated_trueskill_sigma_after=sigma_after,
+                        )
+                        for player_id, mu, sigma_before, sigma_after in (
+                            await session.execute(
+                                select(
+                                    PlayerCategoryTrueskill.player_id,
+                                    PlayerCategoryTrueskill.mu,
+                                    PlayerCategoryTrueskill.sigma,
+                                    decayed_sigma,
+                                ).where(*filters)
+                            )
+                        )
+                    ]
                 )
-                pct.rank = pct.mu - (3 * pct.sigma)
-        session.commit()
+            decayed_counts[category.name] = (
+                await session.execute(
+                    update(PlayerCategoryTrueskill)
+                    .where(*filters)
+                    .values(
+                        {
+                            PlayerCategoryTrueskill.sigma: decayed_sigma,
+                            PlayerCategoryTrueskill.rank: PlayerCategoryTrueskill.mu
+                            - 3 * decayed_sigma,
+                        }
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+            ).rowcount
+        await session.commit()
+        # The bulk updates skip the ORM, so the cache can't see them
+        for category in categories:
+            rating_cache.invalidate(category_id=category.id)
+            await session.run_sync(rank_index.reload_category, category.id)
+    leaderboard.mark_dirty()
+
+    _log.info(
+        f"[sigma_decay_task] Decayed {sum(decayed_counts.values())} ratings "
+        f"{decayed_counts} in {time.perf_counter() - start:.3f}s"
+    )
@@ -0,0 +1,311 @@
+"""
+Replays finished games through TrueSkill for the offline scripts
+(soft_reset, backtest_win_accuracy, parameter sweeps), much faster than
+calling trueskill.rate once per game.
+
+A Replay is prepared once from the game history. Players are mapped to
+indexes into flat lists of mu and sigma, and each game is reduced to the
+indexes of its two teams, its result and whether it's rated. Replay.run can
+then be called any number of times with different ReplayParams.
+
+Every game has exactly two teams, so the factor graph trueskill.rate builds
+always has a single team difference, and its result has a closed form, which
+run applies directly without creating Rating or Gaussian objects. Like
+trueskill.rate, draws use the draw versions of the V and W functions, and
+unrated games are predicted but don't change anyone's rating.
+
+Sigma decay is simulated from the games' finish times, as if sigma_decay_task
+had run once a day: before each game, a player who last played more than
+sigma_decay_grace_days ago gets sigma_decay_amount per whole day past the
+grace period, up to sigma * sigma_decay_max_decay_proportion.
+"""
+
+import logging
+import math
+from dataclasses import dataclass
+from statistics import NormalDist
+
+import numpy as np
+import trueskill
+
+import discord_bots.config as config
+from discord_bots.game_history import GameHistory
+
+_log = logging.getLogger(__name__)
+
+_SQRT2 = math.sqrt(2)
+_SQRT2PI = math.sqrt(2 * math.pi)
+
+
+def _cdf(x: float) -> float:
+    return 0.5 * math.erfc(-x / _SQRT2)
+
+
+def _pdf(x: float) -> float:
+    return math.exp(-x * x / 2) / _SQRT2PI
+
+
+# The V and W functions, the same as trueskill.TrueSkill's, including their
+# guards against numbers too small to divide by
+
+
+def _v_win(diff: float, draw_margin: float) -> float:
+    x = diff - draw_margin
+    denom = _cdf(x)
+    return (_pdf(x) / denom) if denom else -x
+
+
+def _w_win(diff: float, draw_margin: float) -> float:
+    x = diff - draw_margin
+    v = _v_win(diff, draw_margin)
+    w = v * (v + x)
+    if 0 < w < 1:
+        return w
+    raise FloatingPointError(f"w_win({diff}, {draw_margin}) = {w}")
+
+
+def _v_draw(diff: float, draw_margin: float) -> float:
+    abs_diff = abs(diff)
+    a, b = draw_margin - abs_diff, -draw_margin - abs_diff
+    denom = _cdf(a) - _cdf(b)
+    numer = _pdf(b) - _pdf(a)
+    return ((numer / denom) if denom else a) * (-1 if diff < 0 else +1)
+
+
+def _w_draw(diff: float, draw_margin: float) -> float:
+    abs_diff = abs(diff)
+    a, b = draw_margin - abs_diff, -draw_margin - abs_diff
+    denom = _cdf(a) - _cdf(b)
+    if not denom:
+        raise FloatingPointError(f"w_draw({diff}, {draw_margin})")
+    v = _v_draw(abs_diff, draw_margin)
+    return (v**2) + (a * _pdf(a) - b * _pdf(b)) / denom
+
+
+@dataclass(frozen=True)
+class ReplayParams:
+    """
+    :mu: The mu every player starts with
+    :sigma: The sigma every player starts with
+    :beta: The distance in mu that gives a ~76% chance of winning
+    :tau: Added to every player's sigma before each game
+    :draw_probability: How often games are expected to tie
+    :mm_sigma_mult: MM_SIGMA_MULT, for matchmaking_win_probability
+    :sigma_decay_amount: Same as Category.sigma_decay_amount, 0 for no decay
+    :sigma_decay_grace_days: Same as Category.sigma_decay_grace_days
+    :sigma_decay_max_decay_proportion: Same as
+    Category.sigma_decay_max_decay_proportion
+    """
+
+    mu: float = config.DEFAULT_TRUESKILL_MU
+    sigma: float = config.DEFAULT_TRUESKILL_SIGMA
+    beta: float = config.DEFAULT_TRUESKILL_BETA
+    tau: float = config.DEFAULT_TRUESKILL_TAU
+    draw_probability: float = trueskill.DRAW_PROBABILITY
+    mm_sigma_mult: float = config.MM_SIGMA_MULT
+    sigma_decay_amount: float = 0.0
+    sigma_decay_grace_days: int = 0
+    sigma_decay_max_decay_proportion: float = 1.0
+
+    @classmethod
+    def from_env(cls, env: trueskill.TrueSkill | None = None) -> "ReplayParams":
+        """
+        The parameters of a trueskill environment, the global one by default
+        """
+        env = env or trueskill.global_env()
+        return cls(
+            mu=env.mu,
+            sigma=env.sigma,
+            beta=env.beta,
+            tau=env.tau,
+            draw_probability=env.draw_probability,
+        )
+
+
+@dataclass
+class ReplayResult:
+    """
+    :player_ids: The player id of each entry in mu and sigma
+    :mu: Every player's mu after the last game
+    :sigma: Every player's sigma after the last game
+    :win_probability: For each game of the replay, team0's chance of winning
+    with the ratings before it, as utils.win_probability
+    :matchmaking_win_probability: The same, as
+    utils.win_probability_matchmaking
+    """
+
+    player_ids: np.ndarray
+    mu: np.ndarray
+    sigma: np.ndarray
+    win_probability: np.ndarray
+    matchmaking_win_probability: np.ndarray
+
+    def ratings(self) -> dict[int, tuple[float, float]]:
+        """
+        :returns: (mu, sigma) by player id
+        """
+        return {
+            player_id: (mu, sigma)
+            for player_id, mu, sigma in zip(
+                self.player_ids.tolist(), self.mu.tolist(), self.sigma.tolist()
+            )
+        }
+
+
+class Replay:
+    """
+    :player_ids: The player id for each player index
+    :game_indexes: For each game of the replay, its index in the history it
+    was prepared from. Games without two even teams are left out.
+    :winning_team: For each game of the replay, 0 or 1, or -1 for a tie
+    """
+
+    def __init__(
+        self,
+        player_ids: np.ndarray,
+        teams: np.ndarray,
+        offsets: np.ndarray,
+        winning_team: np.ndarray,
+        is_rated: np.ndarray,
+        finished_at: np.ndarray | None = None,
+        game_ids: list[str] | None = None,
+    ):
+        """
+        :param player_ids: For every player of every game, their id
+        :param teams: For every player of every game, their team
+        :param offsets: The players of game i are offsets[i]:offsets[i + 1]
+        :param winning_team: For every game, 0, 1, or -1 for a tie
+        :param is_rated: For every game, whether it changes ratings
+        :param finished_at: For every game, when it finished, as datetime64.
+        Needed for sigma decay.
+        :param game_ids: For every game, an id to log if it's left out
+        """
+        self.player_ids, player_indexes = np.unique(player_ids, return_inverse=True)
+        player_indexes = player_indexes.tolist()
+        teams = teams.tolist()
+        offsets = offsets.tolist()
+        self._games: list[tuple[list[int], list[int], int, bool, float]] = []
+        game_indexes: list[int] = []
+        # Days since the epoch, for sigma decay
+        finished_days = (
+            (finished_at.astype("datetime64[s]").astype(np.int64) / 86400).tolist()
+            if finished_at is not None
+            else [0.0] * len(winning_team)
+        )
+        for i, (winning, rated, finished_day) in enumerate(
+            zip(winning_team.tolist(), is_rated.tolist(), finished_days)
+        ):
+            team0 = []
+            team1 = []
+            for j in range(offsets[i], offsets[i + 1]):
+                (team0 if teams[j] == 0 else team1).append(player_indexes[j])
+            if not team0 or len(team0) != len(team1):
+                game_id = game_ids[i] if game_ids else i
+                _log.warning(
+                    f"[Replay] Ignoring game {game_id}. Teams are empty or not balanced."
+                )
+                continue
+            self._games.append((team0, team1, winning, rated, finished_day))
+            game_indexes.append(i)
+        self.game_indexes = np.array(game_indexes, dtype=np.int64)
+        self.winning_team = np.asarray(winning_team)[self.game_indexes]
+
+    @classmethod
+    def from_history(cls, history: GameHistory) -> "Replay":
+        return cls(
+            history.player_ids,
+            history.teams,
+            history.offsets,
+            history.winning_team,
+            history.is_rated,
+            history.finished_at,
+            history.game_ids,
+        )
+
+    def __len__(self) -> int:
+        return len(self._games)
+
+    def run(self, params: ReplayParams = ReplayParams()) -> ReplayResult:
+        """
+        Rate every game in order, starting everyone at params.mu and
+        params.sigma
+        """
+        mu = [params.mu] * len(self.player_ids)
+        sigma = [params.sigma] * len(self.player_ids)
+        win_probability = [0.0] * len(self._games)
+        matchmaking_win_probability = [0.0] * len(self._games)
+        beta_squared = params.beta**2
+        tau_squared = params.tau**2
+        mm_sigma_mult = params.mm_sigma_mult
+        decay_amount = params.sigma_decay_amount
+        decay_grace_days = params.sigma_decay_grace_days
+        decay_max_sigma = params.sigma * params.sigma_decay_max_decay_proportion
+        # The day each player last finished a game, rated or not
+        last_played = [0.0] * len(self.player_ids)
+        # trueskill.calc_draw_margin without the sqrt(team sizes)
+        draw_margin_per_player = (
+            NormalDist().inv_cdf((params.draw_probability + 1) / 2) * params.beta
+        )
+        for g, (team0, team1, winning_team, rated, day) in enumerate(self._games):
+            size = len(team0) + len(team1)
+            if decay_amount:
+                for team in (team0, team1):
+                    for i in team:
+                        idle_days = int(day - last_played[i] - decay_grace_days)
+                        if last_played[i] and idle_days > 0:
+                            sigma[i] = min(
+                                sigma[i] + idle_days * decay_amount, decay_max_sigma
+                            )
+                        last_played[i] = day
+            team0_mu = team1_mu = 0.0
+            team0_sigma = team1_sigma = 0.0
+            sigma_squared = 0.0
+            for i in team0:
+                team0_mu += mu[i]
+                team0_sigma += sigma[i]
+                sigma_squared += sigma[i] * sigma[i]
+            for i in team1:
+                team1_mu += mu[i]
+                team1_sigma += sigma[i]
+                sigma_squared += sigma[i] * sigma[i]
+            denom = math.sqrt(size * beta_squared + sigma_squared)
+            win_probability[g] = _cdf((team0_mu - team1_mu) / denom)
+            matchmaking_win_probability[g] = _cdf(
+                (
+                    (team0_mu - mm_sigma_mult * team0_sigma)
+                    - (team1_mu - mm_sigma_mult * team1_sigma)
+                )
+                / denom
+            )
+            if not rated:
+                continue
+
+            # Players' sigmas grow by tau before the game is rated
+            c_squared = size * (beta_squared + tau_squared) + sigma_squared
+            c = math.sqrt(c_squared)
+            draw_margin = draw_margin_per_player * math.sqrt(size) / c
+            if winning_team == 1:
+                winners, losers = team1, team0
+                diff = (team1_mu - team0_mu) / c
+            else:
+                winners, losers = team0, team1
+                diff = (team0_mu - team1_mu) / c
+            if winning_team == -1:
+                v = _v_draw(diff, draw_margin)
+                w = _w_draw(diff, draw_margin)
+            else:
+                v = _v_win(diff, draw_margin)
+                w = _w_win(diff, draw_margin)
+            for direction, team in ((1, winners), (-1, losers)):
+                for i in team:
+                    variance = sigma[i] * sigma[i] + tau_squared
+                    mu[i] += direction * variance / c * v
+                    sigma[i] = math.sqrt(variance * (1 - variance / c_squared * w))
+
+        return ReplayResult(
+            player_ids=self.player_ids,
+            mu=np.array(mu),
+            sigma=np.array(sigma),
+            win_probability=np.array(win_probability),
+            matchmaking_win_probability=np.array(matchmaking_win_probability),
+        )
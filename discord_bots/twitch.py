@@ -1,8 +1,28 @@
+from __future__ import annotations
+
+from functools import cache
+from typing import TYPE_CHECKING
+
 import discord_bots.config as config
-from twitchAPI.twitch import Twitch
 
-twitch: Twitch | None = None
-if config.TWITCH_GAME_NAME and config.TWITCH_CLIENT_ID and config.TWITCH_CLIENT_SECRET:
-    twitch = Twitch(
+if TYPE_CHECKING:
+    from twitchAPI.twitch import Twitch
+
+
+@cache
+def get_twitch() -> Twitch | None:
+    """
+    :returns: The Twitch client, created the first time it's needed so the bot
+    doesn't import twitchAPI at startup. None if Twitch isn't configured.
+    """
+    if not (
+        config.TWITCH_GAME_NAME
+        and config.TWITCH_CLIENT_ID
+        and config.TWITCH_CLIENT_SECRET
+    ):
+        return None
+    from twitchAPI.twitch import Twitch
+
+    return Twitch(
         app_id=config.TWITCH_CLIENT_ID, app_secret=config.TWITCH_CLIENT_SECRET
     )
@@ -7,13 +7,11 @@ import os
 import statistics
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
-from heapq import heappop, heappush
-from itertools import combinations
+from functools import partial
 from random import choices
 from typing import List, Optional
 
 import discord
-import imgkit
 import sqlalchemy.orm.session
 from discord import (
     Colour,
@@ -31,16 +29,28 @@ from discord import (
 from discord.ext.commands.context import Context
 from discord.member import Member
 from discord.utils import escape_markdown
-from PIL import Image
-from selenium import webdriver
-from selenium.webdriver.firefox.options import Options as FirefoxOptions
-from sqlalchemy import and_, func, or_, select
+from sqlalchemy import and_, delete, func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm.session import Session as SQLAlchemySession
 from table2ascii import Alignment, Merge, PresetStyle, table2ascii
 from trueskill import Rating, global_env
 
 import discord_bots.config as config
+import discord_bots.game_index as game_index
+import discord_bots.leaderboard as leaderboard
+import discord_bots.rank_index as rank_index
+import discord_bots.rating_cache as rating_cache
+import discord_bots.stats_render as stats_render
+from discord_bots.async_db_utils import async_query_first, async_session
 from discord_bots.bot import bot
+from discord_bots.dispatcher import (
+    Priority,
+    channel_route,
+    dispatcher,
+    dm_route,
+    voice_move_route,
+)
+from discord_bots.matchmaking import TeamBalancer
 from discord_bots.models import (
     Category,
     Config,
@@ -127,38 +137,18 @@ def get_n_finished_game_teams(
     n: int,
     direction: int = 1,
 ) -> list[tuple[list[FinishedGamePlayer], float]]:
-    teams: list[tuple[float, list[FinishedGamePlayer]]] = []
-
-    all_combinations = list(combinations(fgps, team_size))
-    for team0 in all_combinations:
-        team1 = [p for p in fgps if p not in team0]
-        team0_ratings = list(
-            map(
-                lambda x: Rating(
-                    x.rated_trueskill_mu_before, x.rated_trueskill_sigma_before
-                ),
-                team0,
-            )
-        )
-        team1_ratings = list(
-            map(
-                lambda x: Rating(
-                    x.rated_trueskill_mu_before, x.rated_trueskill_sigma_before
-                ),
-                team1,
-            )
-        )
-        win_prob = win_probability(team0_ratings, team1_ratings)
-        current_team_evenness = abs(0.50 - win_prob)
-        heappush(
-            teams, (direction * current_team_evenness, list(team0[:]) + list(team1[:]))
+    balancer = TeamBalancer(
+        [fgp.rated_trueskill_mu_before for fgp in fgps],
+        [fgp.rated_trueskill_sigma_before for fgp in fgps],
+        sigma_mult=0,
+    )
+    return [
+        (
+            direction * split.evenness,
+            [fgps[i] for i in split.team0] + [fgps[i] for i in split.team1],
         )
-
-    teams_out = []
-    for _ in range(n):
-        teams_out.append(heappop(teams))
-
-    return teams_out
+        for split in balancer.top_splits(team_size, n, direction)
+    ]
 
 
 def get_n_best_teams(
@@ -182,34 +172,18 @@ def get_n_teams(
     n: int,
     direction: int = 1,
 ) -> list[tuple[list[Player], float]]:
-    teams: list[tuple[float, list[Player]]] = []
-
-    all_combinations = list(combinations(players, team_size))
-    for team0 in all_combinations:
-        team1 = [p for p in players if p not in team0]
-        team0_ratings = list(
-            map(
-                lambda x: Rating(x.rated_trueskill_mu, x.rated_trueskill_sigma),
-                team0,
-            )
-        )
-        team1_ratings = list(
-            map(
-                lambda x: Rating(x.rated_trueskill_mu, x.rated_trueskill_sigma),
-                team1,
-            )
-        )
-        win_prob = win_probability(team0_ratings, team1_ratings)
-        current_team_evenness = abs(0.50 - win_prob)
-        heappush(
-            teams, (direction * current_team_evenness, list(team0[:]) + list(team1[:]))
+    balancer = TeamBalancer(
+        [player.rated_trueskill_mu for player in players],
+        [player.rated_trueskill_sigma for player in players],
+        sigma_mult=0,
+    )
+    return [
+        (
+            direction * split.evenness,
+            [players[i] for i in split.team0] + [players[i] for i in split.team1],
         )
-
-    teams_out = []
-    for _ in range(n):
-        teams_out.append(heappop(teams))
-
-    return teams_out
+        for split in balancer.top_splits(team_size, n, direction)
+    ]
 
 
 def mock_teams_str(
@@ -407,9 +381,20 @@ def mock_finished_game_teams_str(
 
 
 def is_in_game(player_id: int) -> bool:
-    session: sqlalchemy.orm.Session
-    with Session() as session:
-        return get_player_game(player_id, session) is not None
+    if not game_index.is_warm():
+        session: sqlalchemy.orm.Session
+        with Session() as session:
+            game_index.warm(session)
+    return game_index.game_id(player_id) is not None
+
+
+async def async_is_in_game(session: AsyncSession, player_id: int) -> bool:
+    """
+    is_in_game for code that already has an AsyncSession open
+    """
+    if not game_index.is_warm():
+        await session.run_sync(game_index.warm)
+    return game_index.game_id(player_id) is not None
 
 
 def get_player_game(player_id: int, session=None) -> InProgressGame | None:
@@ -419,30 +404,12 @@ def get_player_game(player_id: int, session=None) -> InProgressGame | None:
     :session: Pass in a session if you want to do something with the game that
     gets returned
     """
-    should_close = False
-    if not session:
-        should_close = True
-        session = (
-            Session()
-        )  # TODO: this session has the potential to not be closed, replace with context manager
-    ipg_player = (
-        session.query(InProgressGamePlayer)
-        .join(InProgressGame)
-        .filter(InProgressGamePlayer.player_id == player_id)
-        .first()
-    )
-    if ipg_player:
-        if should_close:
-            session.close()
-        return (
-            session.query(InProgressGame)
-            .filter(InProgressGame.id == ipg_player.in_progress_game_id)
-            .first()
-        )
-    else:
-        if should_close:
-            session.close()
+    if not is_in_game(player_id):
         return None
+    if session:
+        return session.get(InProgressGame, game_index.game_id(player_id))
+    with Session() as session:
+        return session.get(InProgressGame, game_index.game_id(player_id))
 
 
 def finished_game_str(finished_game: FinishedGame, debug: bool = False) -> str:
@@ -589,6 +556,10 @@ def utc_now_naive() -> datetime:
 
 
 async def upload_stats_screenshot_selenium(ctx: Context, cleanup=True):
+    from PIL import Image
+    from selenium import webdriver
+    from selenium.webdriver.firefox.options import Options as FirefoxOptions
+
     # Assume the most recently modified HTML file is the correct stat sheet
     if not config.STATS_DIR:
         return
@@ -623,13 +594,150 @@ async def upload_stats_screenshot_selenium(ctx: Context, cleanup=True):
                 os.remove(os.path.join(config.STATS_DIR, file_))
 
 
+@dataclass
+class GameEmbedBundle:
+    """
+    Everything the game embeds show besides the game itself
+
+    :queue: The game's queue, only loaded for in progress games
+    :team0_players: (name, position short name or None) of each player on
+    team0. Same for team1_players. In in progress games with captains, the
+    team's captain comes first, which SHOW_CAPTAINS relies on. The order is
+    otherwise up to the database, like when each game was loaded on its own.
+    """
+
+    queue: Queue | None
+    map: Map | None
+    team0_players: list[tuple[str, str | None]]
+    team1_players: list[tuple[str, str | None]]
+
+
+def _load_game_maps(
+    session: sqlalchemy.orm.Session,
+    games: list[InProgressGame] | list[FinishedGame],
+) -> dict[str, Map | None]:
+    """
+    :returns: The map of each game by game id, matched by full or short name
+    """
+    maps: list[Map] = (
+        session.query(Map)
+        .filter(
+            or_(
+                Map.full_name.in_({game.map_full_name for game in games}),
+                Map.short_name.in_({game.map_short_name for game in games}),
+            )
+        )
+        .all()
+        if games
+        else []
+    )
+    return {
+        game.id: next(
+            (
+                map
+                for map in maps
+                if map.full_name == game.map_full_name
+                or map.short_name == game.map_short_name
+            ),
+            None,
+        )
+        for game in games
+    }
+
+
+def load_in_progress_game_bundles(
+    session: sqlalchemy.orm.Session, games: list[InProgressGame]
+) -> dict[str, GameEmbedBundle]:
+    """
+    Load what create_in_progress_game_embed and
+    create_condensed_in_progress_game_embed need for every game, with the
+    same three queries however many games there are
+
+    :returns: The bundle of each game by game id
+    """
+    if not games:
+        return {}
+    queues: dict[str, Queue] = {
+        queue.id: queue
+        for queue in session.query(Queue).filter(
+            Queue.id.in_({game.queue_id for game in games if game.queue_id})
+        )
+    }
+    maps = _load_game_maps(session, games)
+    bundles: dict[str, GameEmbedBundle] = {
+        game.id: GameEmbedBundle(queues.get(game.queue_id), maps[game.id], [], [])
+        for game in games
+    }
+    for game_id, team, name, position_short_name in (
+        session.query(
+            InProgressGamePlayer.in_progress_game_id,
+            InProgressGamePlayer.team,
+            Player.name,
+            Position.short_name,
+        )
+        .join(Player, Player.id == InProgressGamePlayer.player_id)
+        .outerjoin(Position, Position.id == InProgressGamePlayer.position_id)
+        .filter(InProgressGamePlayer.in_progress_game_id.in_(list(bundles)))
+        .order_by(
+            InProgressGamePlayer.in_progress_game_id,
+            InProgressGamePlayer.is_captain.desc(),
+        )
+    ):
+        bundle = bundles[game_id]
+        players = bundle.team0_players if team == 0 else bundle.team1_players
+        players.append((name, position_short_name))
+    return bundles
+
+
+def load_finished_game_bundles(
+    session: sqlalchemy.orm.Session, finished_games: list[FinishedGame]
+) -> dict[str, GameEmbedBundle]:
+    """
+    Load what create_finished_game_embed needs for every game, with the same
+    two queries however many games there are
+
+    :returns: The bundle of each game by finished game id
+    """
+    if not finished_games:
+        return {}
+    maps = _load_game_maps(session, finished_games)
+    bundles: dict[str, GameEmbedBundle] = {
+        finished_game.id: GameEmbedBundle(None, maps[finished_game.id], [], [])
+        for finished_game in finished_games
+    }
+    for finished_game_id, team, player_name, position_name in session.query(
+        FinishedGamePlayer.finished_game_id,
+        FinishedGamePlayer.team,
+        FinishedGamePlayer.player_name,
+        FinishedGamePlayer.position_name,
+    ).filter(FinishedGamePlayer.finished_game_id.in_(list(bundles))):
+        bundle = bundles[finished_game_id]
+        players = bundle.team0_players if team == 0 else bundle.team1_players
+        players.append((player_name, position_name or None))
+    return bundles
+
+
+def _player_names(players: list[tuple[str, str | None]]) -> list[str]:
+    return [
+        f"{name} ({position_name})" if position_name else f"{name}"
+        for name, position_name in players
+    ]
+
+
 async def create_in_progress_game_embed(
     session: sqlalchemy.orm.Session,
     game: InProgressGame,
     guild: discord.Guild,
     show_map_image: bool = True,
+    bundle: GameEmbedBundle | None = None,
 ) -> Embed:
-    queue: Queue | None = session.query(Queue).filter(Queue.id == game.queue_id).first()
+    """
+    :param bundle: The game's bundle from load_in_progress_game_bundles, to
+    skip loading it
+    """
+    if bundle is None:
+        bundle = load_in_progress_game_bundles(session, [game])[game.id]
+    queue: Queue | None = bundle.queue
     embed: discord.Embed
     if queue:
         embed = Embed(
@@ -646,68 +754,8 @@ async def create_in_progress_game_embed(
         tzinfo=timezone.utc
     )  # timezones aren't stored in the DB, so add it ourselves
     timestamp = discord.utils.format_dt(aware_db_datetime, style="R")
-    non_position_result: list[str] | None = (
-        session.query(Player.name)
-        .join(InProgressGamePlayer, Player.id == InProgressGamePlayer.player_id)
-        .filter(
-            InProgressGamePlayer.in_progress_game_id == game.id,
-            InProgressGamePlayer.team == 0,
-        )
-        .all()
-    )
-    position_result: list[str] | None = (
-        session.query(Player.name, Position.short_name)
-        .join(InProgressGamePlayer, Player.id == InProgressGamePlayer.player_id)
-        .join(Position, InProgressGamePlayer.position_id == Position.id)
-        .filter(
-            InProgressGamePlayer.in_progress_game_id == game.id,
-            InProgressGamePlayer.team == 0,
-        )
-        .all()
-    )
-    if position_result:
-        team0_player_names: list[str] = (
-            [f"{name[0]} ({name[1]})" for name in position_result if name]
-            if position_result
-            else []
-        )
-    else:
-        team0_player_names: list[str] = (
-            [f"{name[0]}" for name in non_position_result if name]
-            if non_position_result
-            else []
-        )
-    non_position_result: list[str] | None = (
-        session.query(Player.name)
-        .join(InProgressGamePlayer, Player.id == InProgressGamePlayer.player_id)
-        .filter(
-            InProgressGamePlayer.in_progress_game_id == game.id,
-            InProgressGamePlayer.team == 1,
-        )
-        .all()
-    )
-    position_result: list[str] | None = (
-        session.query(Player.name, Position.short_name)
-        .join(InProgressGamePlayer, Player.id == InProgressGamePlayer.player_id)
-        .join(Position, InProgressGamePlayer.position_id == Position.id)
-        .filter(
-            InProgressGamePlayer.in_progress_game_id == game.id,
-            InProgressGamePlayer.team == 1,
-        )
-        .all()
-    )
-    if position_result:
-        team1_player_names: list[str] = (
-            [f"{name[0]} ({name[1]})" for name in position_result if name]
-            if position_result
-            else []
-        )
-    else:
-        team1_player_names: list[str] = (
-            [f"{name[0]}" for name in non_position_result if name]
-            if non_position_result
-            else []
-        )
+    team0_player_names = _player_names(bundle.team0_players)
+    team1_player_names = _player_names(bundle.team1_players)
     if config.SHOW_CAPTAINS:
         if team0_player_names:
             team0_player_names[0] = "(C) " + team0_player_names[0]
@@ -764,27 +812,23 @@ async def create_in_progress_game_embed(
             inline=True,
         )
     add_empty_field(embed, offset=3)
-    if show_map_image:
-        map: Map | None = (
-            session.query(Map)
-            .filter(
-                or_(
-                    Map.full_name == game.map_full_name,
-                    Map.short_name == game.map_short_name,
-                )
-            )
-            .first()
-        )
-        if map and map.image_url:
-            embed.set_image(url=map.image_url)
+    if show_map_image and bundle.map and bundle.map.image_url:
+        embed.set_image(url=bundle.map.image_url)
     return embed
 
 
 async def create_condensed_in_progress_game_embed(
     session: sqlalchemy.orm.Session,
     game: InProgressGame,
+    bundle: GameEmbedBundle | None = None,
 ) -> Embed:
-    queue: Queue | None = session.query(Queue).filter(Queue.id == game.queue_id).first()
+    """
+    :param bundle: The game's bundle from load_in_progress_game_bundles, to
+    skip loading it
+    """
+    if bundle is None:
+        bundle = load_in_progress_game_bundles(session, [game])[game.id]
+    queue: Queue | None = bundle.queue
     embed: discord.Embed
     if queue:
         embed = Embed(
@@ -801,48 +845,8 @@ async def create_condensed_in_progress_game_embed(
         tzinfo=timezone.utc
     )  # timezones aren't stored in the DB, so add it ourselves
     timestamp = discord.utils.format_dt(aware_db_datetime, style="R")
-    result: list[str] | None = (
-        session.query(Player.name, InProgressGamePlayer.position_id)
-        .join(InProgressGamePlayer, Player.id == InProgressGamePlayer.player_id)
-        .filter(
-            InProgressGamePlayer.in_progress_game_id == game.id,
-            InProgressGamePlayer.team == 0,
-        )
-        .all()
-    )
-    team0_player_names: list[str] = []
-    for igp in result:
-        if igp.position_id:
-            position = (
-                session.query(Position).filter(Position.id == igp.position_id).first()
-            )
-            if position:
-                team0_player_names.append(f"{igp.name} ({position.short_name})")
-            else:
-                team0_player_names.append(f"{igp.name}")
-        else:
-            team0_player_names.append(f"{igp.name}")
-    result: list[str] | None = (
-        session.query(Player.name, InProgressGamePlayer.position_id)
-        .join(InProgressGamePlayer, Player.id == InProgressGamePlayer.player_id)
-        .filter(
-            InProgressGamePlayer.in_progress_game_id == game.id,
-            InProgressGamePlayer.team == 1,
-        )
-        .all()
-    )
-    team1_player_names: list[str] = []
-    for igp in result:
-        if igp.position_id:
-            position = (
-                session.query(Position).filter(Position.id == igp.position_id).first()
-            )
-            if position:
-                team1_player_names.append(f"{igp.name} ({position.short_name})")
-            else:
-                team1_player_names.append(f"{igp.name}")
-        else:
-            team1_player_names.append(f"{igp.name}")
+    team0_player_names = _player_names(bundle.team0_players)
+    team1_player_names = _player_names(bundle.team1_players)
 
     if config.SHOW_CAPTAINS:
         if team0_player_names:
@@ -872,18 +876,8 @@ async def create_condensed_in_progress_game_embed(
     )
     content += f"\n*{timestamp}*"
     embed.description = content
-    map: Map | None = (
-        session.query(Map)
-        .filter(
-            or_(
-                Map.full_name == game.map_full_name,
-                Map.short_name == game.map_short_name,
-            )
-        )
-        .first()
-    )
-    if map and map.image_url:
-        embed.set_thumbnail(url=map.image_url)
+    if bundle.map and bundle.map.image_url:
+        embed.set_thumbnail(url=bundle.map.image_url)
     return embed
 
 
@@ -892,11 +886,21 @@ def create_finished_game_embed(
     finished_game_id: str,
     guild_id: int,
     name_tuple: Optional[tuple[str, str]] = None,  # (user_name, display_name)
+    finished_game: FinishedGame | None = None,
+    bundle: GameEmbedBundle | None = None,
 ) -> Embed:
+    """
+    :param finished_game: The finished game, to skip loading it
+    :param bundle: Its bundle from load_finished_game_bundles, to skip loading
+    it
+    """
     # assumes that the FinishedGamePlayers have already been comitted
-    finished_game = (
-        session.query(FinishedGame).filter(FinishedGame.id == finished_game_id).first()
-    )
+    if finished_game is None:
+        finished_game = (
+            session.query(FinishedGame)
+            .filter(FinishedGame.id == finished_game_id)
+            .first()
+        )
     if not finished_game:
         _log.error(
             f"[create_finished_game_embed] Could not find finished_game with id={finished_game_id}"
@@ -921,34 +925,10 @@ def create_finished_game_embed(
     if name_tuple is not None:
         user_name, display_name = name_tuple[0], name_tuple[1]
         embed.set_footer(text=f"Finished by {display_name} ({user_name})")
-    result = (
-        session.query(FinishedGamePlayer)
-        .filter(
-            FinishedGamePlayer.finished_game_id == finished_game.id,
-            FinishedGamePlayer.team == 0,
-        )
-        .all()
-    )
-    team0_player_names: list[str] = []
-    for p in result:
-        if p.position_name:
-            team0_player_names.append(f"{p.player_name} ({p.position_name})")
-        else:
-            team0_player_names.append(f"{p.player_name}")
-    result = (
-        session.query(FinishedGamePlayer)
-        .filter(
-            FinishedGamePlayer.finished_game_id == finished_game.id,
-            FinishedGamePlayer.team == 1,
-        )
-        .all()
-    )
-    team1_player_names: list[str] = []
-    for p in result:
-        if p.position_name:
-            team1_player_names.append(f"{p.player_name} ({p.position_name})")
-        else:
-            team1_player_names.append(f"{p.player_name}")
+    if bundle is None:
+        bundle = load_finished_game_bundles(session, [finished_game])[finished_game.id]
+    team0_player_names = _player_names(bundle.team0_players)
+    team1_player_names = _player_names(bundle.team1_players)
     # sort the names alphabetically and caselessly to make them easier to read
     team0_player_names.sort(key=str.casefold)
     team1_player_names.sort(key=str.casefold)
@@ -1016,18 +996,8 @@ def create_finished_game_embed(
             value=round(finished_game.average_trueskill, 2),
             inline=True,
         )
-    map: Map | None = (
-        session.query(Map)
-        .filter(
-            or_(
-                Map.full_name == finished_game.map_full_name,
-                Map.short_name == finished_game.map_short_name,
-            )
-        )
-        .first()
-    )
-    if map and map.image_url:
-        embed.set_image(url=map.image_url)
+    if bundle.map and bundle.map.image_url:
+        embed.set_image(url=bundle.map.image_url)
     return embed
 
 
@@ -1132,41 +1102,12 @@ uploaded to a centralized channel
 async def upload_stats_screenshot_imgkit_interaction(
     interaction: discord.Interaction, cleanup=True
 ):
-    # Assume the most recently modified HTML file is the correct stat sheet
-    if not config.STATS_DIR:
-        return
-
-    html_files = list(
-        filter(lambda x: x.endswith(".html"), os.listdir(config.STATS_DIR))
-    )
-    html_files.sort(
-        key=lambda x: os.path.getmtime(os.path.join(config.STATS_DIR, x)), reverse=True
-    )
-
-    if len(html_files) == 0:
-        return
-
-    image_path = os.path.join(config.STATS_DIR, html_files[0] + ".png")
-    imgkit.from_file(
-        os.path.join(config.STATS_DIR, html_files[0]),
-        image_path,
-        options={"enable-local-file-access": None},
-    )
-    if config.STATS_WIDTH and config.STATS_HEIGHT:
-        image = Image.open(image_path)
-        cropped = image.crop((0, 0, config.STATS_WIDTH, config.STATS_HEIGHT))
-        cropped.save(image_path)
-
-    await interaction.channel.send(
-        file=discord.File(image_path)
+    # The newest stat sheet is rendered and uploaded in the background, see
+    # stats_render
+    stats_render.submit(
+        interaction.channel, cleanup
     )  # ideally edit the original resonse, but sending to the channel is fine
 
-    # Clean up everything
-    if cleanup:
-        for file_ in os.listdir(config.STATS_DIR):
-            if file_.endswith(".png") or file_.endswith(".html"):
-                os.remove(os.path.join(config.STATS_DIR, file_))
-
 
 """
 Temporary function until we have a shared match history channel
@@ -1176,38 +1117,7 @@ Temporary function until we have a shared match history channel
 async def upload_stats_screenshot_imgkit_channel(
     channel: TextChannel | DMChannel | GroupChannel, cleanup=True
 ):
-    # Assume the most recently modified HTML file is the correct stat sheet
-    if not config.STATS_DIR:
-        return
-
-    html_files = list(
-        filter(lambda x: x.endswith(".html"), os.listdir(config.STATS_DIR))
-    )
-    html_files.sort(
-        key=lambda x: os.path.getmtime(os.path.join(config.STATS_DIR, x)), reverse=True
-    )
-
-    if len(html_files) == 0:
-        return
-
-    image_path = os.path.join(config.STATS_DIR, html_files[0] + ".png")
-    imgkit.from_file(
-        os.path.join(config.STATS_DIR, html_files[0]),
-        image_path,
-        options={"enable-local-file-access": None},
-    )
-    if config.STATS_WIDTH and config.STATS_HEIGHT:
-        image = Image.open(image_path)
-        cropped = image.crop((0, 0, config.STATS_WIDTH, config.STATS_HEIGHT))
-        cropped.save(image_path)
-
-    await channel.send(file=discord.File(image_path))
-
-    # Clean up everything
-    if cleanup:
-        for file_ in os.listdir(config.STATS_DIR):
-            if file_.endswith(".png") or file_.endswith(".html"):
-                os.remove(os.path.join(config.STATS_DIR, file_))
+    stats_render.submit(channel, cleanup)
 
 
 def win_probability_matchmaking(team0: list[Rating], team1: list[Rating]) -> float:
@@ -1251,10 +1161,9 @@ async def execute_map_rotation(rotation_id: str, is_verbose: bool):
     :is_verbose: specifies if we want to see queues affected in the bot response.
         currently passing in False for when game pops, True for everything else.
     """
-    session: sqlalchemy.orm.Session
-    with Session() as session:
-        rotation: Rotation | None = (
-            session.query(Rotation).filter(Rotation.id == rotation_id).first()
+    async with async_session() as session:
+        rotation: Rotation | None = await async_query_first(
+            session, Rotation, Rotation.id == rotation_id
         )
         if not rotation:
             _log.warning(
@@ -1263,34 +1172,34 @@ async def execute_map_rotation(rotation_id: str, is_verbose: bool):
             return
 
         if rotation.is_random:
-            all_rotation_maps: list[RotationMap] = (
-                session.query(RotationMap)
-                .filter(RotationMap.rotation_id == rotation_id)
-                .all()
+            all_rotation_maps: list[RotationMap] = list(
+                await session.scalars(
+                    select(RotationMap).where(RotationMap.rotation_id == rotation_id)
+                )
             )
 
-            history_length = (
-                session.query(RotationMapHistory)
-                .filter(RotationMapHistory.rotation_id == rotation_id)
-                .count()
+            history_length: int = await session.scalar(
+                select(func.count(RotationMapHistory.id)).where(
+                    RotationMapHistory.rotation_id == rotation_id
+                )
             )
             rank_subquery = (
-                session.query(
+                select(
                     RotationMapHistory.rotation_map_id,
                     func.rank()
                     .over(order_by=RotationMapHistory.selected_at.desc())
                     .label("rank"),
                 )
-                .filter(RotationMapHistory.rotation_id == rotation_id)
+                .where(RotationMapHistory.rotation_id == rotation_id)
                 .subquery()
             )
             history = (
-                session.query(
-                    rank_subquery.c.rotation_map_id, func.min(rank_subquery.c.rank)
+                await session.execute(
+                    select(
+                        rank_subquery.c.rotation_map_id, func.min(rank_subquery.c.rank)
+                    ).group_by(rank_subquery.c.rotation_map_id)
                 )
-                .group_by(rank_subquery.c.rotation_map_id)
-                .all()
-            )
+            ).all()
 
             maps_for_random = []
             for m in all_rotation_maps:
@@ -1330,16 +1239,16 @@ async def execute_map_rotation(rotation_id: str, is_verbose: bool):
                 weights=[x.random_weight for x in eligible_maps],
             )[0]
         else:
-            current_rotation_map: RotationMap | None = (
-                session.query(RotationMap)
-                .filter(RotationMap.rotation_id == rotation_id)
-                .filter(RotationMap.is_next == True)
-                .first()
+            current_rotation_map: RotationMap | None = await async_query_first(
+                session,
+                RotationMap,
+                RotationMap.rotation_id == rotation_id,
+                RotationMap.is_next == True,
             )
-            rotation_map_length = (
-                session.query(RotationMap)
-                .filter(RotationMap.rotation_id == rotation_id)
-                .count()
+            rotation_map_length: int = await session.scalar(
+                select(func.count(RotationMap.id)).where(
+                    RotationMap.rotation_id == rotation_id
+                )
             )
             following_ordinal = (
                 current_rotation_map.ordinal + 1 if current_rotation_map else 1
@@ -1347,11 +1256,11 @@ async def execute_map_rotation(rotation_id: str, is_verbose: bool):
             if following_ordinal > rotation_map_length:
                 following_ordinal = 1
 
-            following_map: RotationMap | None = (
-                session.query(RotationMap)
-                .filter(RotationMap.rotation_id == rotation_id)
-                .filter(RotationMap.ordinal == following_ordinal)
-                .first()
+            following_map: RotationMap | None = await async_query_first(
+                session,
+                RotationMap,
+                RotationMap.rotation_id == rotation_id,
+                RotationMap.ordinal == following_ordinal,
             )
             if not following_map:
                 _log.error(
@@ -1375,67 +1284,71 @@ async def update_next_map(
     :is_verbose: specifies if we want to see queues affected in the bot response.
         currently passing in False for when game pops, True for everything else.
     """
-    session: sqlalchemy.orm.Session
-    with Session() as session:
-        next_rotation_map: RotationMap = (
-            session.query(RotationMap)
-            .filter(RotationMap.id == new_rotation_map_id)
-            .one()
+    async with async_session() as session:
+        await session.execute(
+            update(RotationMap)
+            .where(RotationMap.rotation_id == rotation_id, RotationMap.is_next == True)
+            .values(is_next=False)
+        )
+        await session.execute(
+            update(RotationMap)
+            .where(RotationMap.id == new_rotation_map_id)
+            .values(is_next=True)
+        )
+        next_map_id: str = await session.scalar(
+            select(RotationMap.map_id).where(RotationMap.id == new_rotation_map_id)
         )
-        session.query(RotationMap).filter(
-            RotationMap.rotation_id == rotation_id
-        ).filter(RotationMap.is_next == True).update({"is_next": False})
-        next_rotation_map.is_next = True
 
         history = RotationMapHistory(
             rotation_id=rotation_id, rotation_map_id=new_rotation_map_id
         )
         session.add(history)
 
-        map_votes: list[MapVote] = (
-            session.query(MapVote)
-            .join(RotationMap, RotationMap.id == MapVote.rotation_map_id)
-            .filter(RotationMap.rotation_id == rotation_id)
-            .all()
+        await session.execute(
+            delete(MapVote).where(
+                MapVote.rotation_map_id.in_(
+                    select(RotationMap.id).where(RotationMap.rotation_id == rotation_id)
+                )
+            )
         )
-        for map_vote in map_votes:
-            session.delete(map_vote)
-        session.query(SkipMapVote).filter(
-            SkipMapVote.rotation_id == rotation_id
-        ).delete()
-        session.commit()
+        await session.execute(
+            delete(SkipMapVote).where(SkipMapVote.rotation_id == rotation_id)
+        )
+        await session.commit()
 
         channel = bot.get_channel(config.CHANNEL_ID)
-        if isinstance(channel, discord.TextChannel):
-            if is_verbose:
-                next_map: Map = (
-                    session.query(Map).filter(Map.id == next_rotation_map.map_id).one()
-                )
-                affected_queues: list[Queue] = (
-                    session.query(Queue).filter(Queue.rotation_id == rotation_id).all()
+        if not isinstance(channel, discord.TextChannel) or not is_verbose:
+            return
+        next_map: Map = (
+            await session.scalars(select(Map).where(Map.id == next_map_id))
+        ).one()
+        affected_queues: list[Queue] = list(
+            await session.scalars(select(Queue).where(Queue.rotation_id == rotation_id))
+        )
+        affected_queue_names = [queue.name for queue in affected_queues]
+
+        queue_is_empty: bool = (
+            await session.scalar(
+                select(QueuePlayer.id)
+                .where(
+                    QueuePlayer.queue_id.in_([queue.id for queue in affected_queues])
                 )
-                affected_queue_names = [queue.name for queue in affected_queues]
-
-                queue_is_empty: bool = True
-                for queue in affected_queues:
-                    queue_players: list[QueuePlayer] = (
-                        session.query(QueuePlayer)
-                        .filter(QueuePlayer.queue_id == queue.id)
-                        .all()
-                    )
-                    if len(queue_players) != 0:
-                        queue_is_empty = False
-                        break
-
-                if not queue_is_empty:
-                    await send_message(
-                        channel,
-                        embed_title=f"Next Map rotated to {next_map.full_name}",
-                        embed_description=f"Queues affected: **{', '.join(affected_queue_names)}**",
-                        embed_footer="All votes removed",
-                        image_url=next_map.image_url,
-                        colour=Colour.blue(),
-                    )
+                .limit(1)
+            )
+            is None
+        )
+
+    # Sent once the session is closed, so it isn't held while the message
+    # waits its turn
+    if not queue_is_empty:
+        await send_message(
+            channel,
+            embed_title=f"Next Map rotated to {next_map.full_name}",
+            embed_description=f"Queues affected: **{', '.join(affected_queue_names)}**",
+            embed_footer="All votes removed",
+            image_url=next_map.image_url,
+            colour=Colour.blue(),
+        )
 
 
 async def send_in_guild_message(
@@ -1443,18 +1356,20 @@ async def send_in_guild_message(
     user_id: int,
     message_content: Optional[str] = None,
     embed: Optional[Embed] = None,
+    priority: Priority = Priority.NORMAL,
 ):
-    # use asyncio.gather to run this coroutine in parallel, else each send has to await for the previous one to finish
+    """
+    Queue a DM to a member of the guild. Returns once it's queued, the
+    dispatcher sends it and logs it if it fails.
+    """
     if not config.DISABLE_PRIVATE_MESSAGES:
         member: Member | None = guild.get_member(user_id)
         if member:
-            try:
-                await member.send(content=message_content, embed=embed)
-            except Exception as e:
-                _log.warning(
-                    "[send_in_guild_message] Could not send DM to user {user_id} due to: {e}",
-                    exc_info=True,
-                )
+            dispatcher.submit(
+                dm_route(),
+                partial(member.send, content=message_content, embed=embed),
+                priority,
+            )
 
 
 def get_guild_partial_message(
@@ -1487,9 +1402,12 @@ async def send_message(
     delete_after: float | None = None,
     image_url: str | None = None,
     embed_footer: str | None = None,
+    priority: Priority = Priority.NORMAL,
 ) -> Message | None:
     """
     :colour: red = fail, green = success, blue = informational
+    :priority: Of the message among everything else the bot is sending, see
+    dispatcher
     """
     message: Message | None = None
     if content:
@@ -1511,8 +1429,12 @@ async def send_message(
     if image_url:
         embed.set_image(url=image_url)
     try:
-        message = await channel.send(
-            content=content, embed=embed, delete_after=delete_after
+        message = await dispatcher.submit(
+            channel_route(channel.id),
+            partial(
+                channel.send, content=content, embed=embed, delete_after=delete_after
+            ),
+            priority,
         )
     except Exception:
         _log.exception("[send_message] Ignoring exception:")
@@ -1531,62 +1453,42 @@ async def print_leaderboard():
         )
         if len(categories) > 0:
             for i, category in enumerate(categories):
-                subquery = (
-                    session.query(FinishedGamePlayer.player_id)
-                    .join(
-                        FinishedGame,
-                        FinishedGame.id == FinishedGamePlayer.finished_game_id,
-                    )
-                    .filter(
-                        FinishedGame.started_at
-                        > (datetime.now(timezone.utc) - timedelta(days=30))
-                    )
-                    .filter(FinishedGame.category_name == category.name)
-                    .filter(FinishedGame.is_captain_pick == False)
-                    .group_by(FinishedGamePlayer.player_id)
-                    .having(func.count() >= category.min_games_for_leaderboard)
-                    .subquery()
-                )
-                top_10_pcts: list[PlayerCategoryTrueskill] | None = (
-                    session.query(PlayerCategoryTrueskill)
-                    .join(Player, Player.id == PlayerCategoryTrueskill.player_id)
-                    .filter(PlayerCategoryTrueskill.player_id.in_(select(subquery)))
-                    .filter(PlayerCategoryTrueskill.category_id == category.id)
-                    .filter(Player.leaderboard_enabled == True)
-                    .order_by(PlayerCategoryTrueskill.rank.desc())
-                    .limit(10)
-                    .all()
+                eligible_player_ids = leaderboard.eligible_player_ids(
+                    category.name, category.min_games_for_leaderboard
                 )
-                if top_10_pcts:
+                player_names: dict[int, str] = {}
+                if eligible_player_ids:
+                    player_names = dict(
+                        session.query(Player.id, Player.name).filter(
+                            Player.id.in_(eligible_player_ids),
+                            Player.leaderboard_enabled == True,
+                        )
+                    )
+                top_10 = rank_index.top(category.id, player_names, 10)
+                if top_10:
                     message_content += f"**{category.name} Leaderboard**"
                     cols = []
-                    for i, pct in enumerate(top_10_pcts, 1):
-                        # TODO: merge this with the pct query
-                        player: Player | None = (
-                            session.query(Player)
-                            .filter(Player.id == pct.player_id)
-                            .first()
-                        )
-                        if player:
-                            if i == 1:
-                                player_name = f"{player.name}🥇"
-                            elif i == 2:
-                                player_name = f"{player.name}🥈"
-                            elif i == 3:
-                                player_name = f"{player.name}🥉"
-                            else:
-                                player_name = player.name
-                            col = [
-                                i,
-                                round(pct.rank, 1),
-                                round(pct.mu, 1),
-                                round(pct.sigma, 1),
-                                player_name,
-                            ]
-                            cols.append(col)
+                    for i, pct in enumerate(top_10, 1):
+                        name = player_names[pct.player_id]
+                        if i == 1:
+                            player_name = f"{name}🥇"
+                        elif i == 2:
+                            player_name = f"{name}🥈"
+                        elif i == 3:
+                            player_name = f"{name}🥉"
+                        else:
+                            player_name = name
+                        col = [
+                            i,
+                            round(pct.rank, 1),
+                            round(pct.mu, 1),
+                            round(pct.sigma, 1),
+                            player_name,
+                        ]
+                        cols.append(col)
                     if category.min_games_for_leaderboard > 0:
                         footer = [
-                            f"Min. {category.min_games_for_leaderboard} {'games' if category.min_games_for_leaderboard > 1 else 'game'} played in the last 30 days",
+                            f"Min. {category.min_games_for_leaderboard} {'games' if category.min_games_for_leaderboard > 1 else 'game'} played in the last {leaderboard.LEADERBOARD_DAYS} days",
                             Merge.LEFT,
                             Merge.LEFT,
                             Merge.LEFT,
@@ -1764,9 +1666,14 @@ async def move_game_players(
                     if member_voice and member_voice.channel:
                         try:
                             coroutines.append(
-                                member.move_to(
-                                    be_voice_channel,
-                                    reason=f"Game {game_id} started",
+                                dispatcher.submit(
+                                    voice_move_route(guild.id),
+                                    partial(
+                                        member.move_to,
+                                        be_voice_channel,
+                                        reason=f"Game {game_id} started",
+                                    ),
+                                    Priority.POP,
                                 )
                             )
                         except Exception:
@@ -1782,16 +1689,21 @@ async def move_game_players(
                     if member_voice and member_voice.channel:
                         try:
                             coroutines.append(
-                                member.move_to(
-                                    ds_voice_channel,
-                                    reason=f"Game {game_id} started",
+                                dispatcher.submit(
+                                    voice_move_route(guild.id),
+                                    partial(
+                                        member.move_to,
+                                        ds_voice_channel,
+                                        reason=f"Game {game_id} started",
+                                    ),
+                                    Priority.POP,
                                 )
                             )
                         except Exception:
                             _log.exception(
                                 f"Caught exception moving player to voice channel"
                             )
-    # use gather to run the moves concurrently in the event loop
+    # the dispatcher runs the moves a few at a time, before other requests
     # note: a member has to be in a voice channel already for them to be moved, else it throws an exception
     results = await asyncio.gather(*coroutines, return_exceptions=True)
     for result in results:
@@ -1839,9 +1751,13 @@ async def move_game_players_lobby(game_id: str, guild: Guild):
                     for member in members:
                         try:
                             coroutines.append(
-                                member.move_to(
-                                    voice_lobby,
-                                    reason=f"Game {short_uuid(game_id)} finished",
+                                dispatcher.submit(
+                                    voice_move_route(guild.id),
+                                    partial(
+                                        member.move_to,
+                                        voice_lobby,
+                                        reason=f"Game {short_uuid(game_id)} finished",
+                                    ),
                                 )
                             )
                         except Exception:
@@ -1885,138 +1801,122 @@ def add_empty_field(embed: discord.Embed, *, offset: int = 0):
 
 async def map_short_name_autocomplete(interaction: Interaction, current: str):
     result = []
-    session: SQLAlchemySession
-    with Session() as session:
-        maps: list[Map] | None = (
-            session.query(Map).order_by(Map.full_name).limit(25).all()
-        )
-        if maps:
-            for map in maps:
-                current_casefold = current.casefold()
-                if (
-                    current_casefold in map.short_name.casefold()
-                    or current_casefold in map.full_name.casefold()
-                ):
-                    result.append(
-                        discord.app_commands.Choice(
-                            name=map.full_name, value=map.short_name
-                        )
+    async with async_session() as session:
+        maps: list[Map] = list(
+            await session.scalars(select(Map).order_by(Map.full_name).limit(25))
+        )
+        current_casefold = current.casefold()
+        for map in maps:
+            if (
+                current_casefold in map.short_name.casefold()
+                or current_casefold in map.full_name.casefold()
+            ):
+                result.append(
+                    discord.app_commands.Choice(
+                        name=map.full_name, value=map.short_name
                     )
+                )
     return result
 
 
 async def map_full_name_autocomplete(interaction: Interaction, current: str):
     result = []
-    session: SQLAlchemySession
-    with Session() as session:
-        maps: list[Map] | None = (
-            session.query(Map).order_by(Map.full_name).limit(25).all()
-        )
-        if maps:
-            for map in maps:
-                current_casefold = current.casefold()
-                if (
-                    current_casefold in map.short_name.casefold()
-                    or current_casefold in map.full_name.casefold()
-                ):
-                    result.append(
-                        discord.app_commands.Choice(
-                            name=map.full_name, value=map.full_name
-                        )
-                    )
+    async with async_session() as session:
+        maps: list[Map] = list(
+            await session.scalars(select(Map).order_by(Map.full_name).limit(25))
+        )
+        current_casefold = current.casefold()
+        for map in maps:
+            if (
+                current_casefold in map.short_name.casefold()
+                or current_casefold in map.full_name.casefold()
+            ):
+                result.append(
+                    discord.app_commands.Choice(name=map.full_name, value=map.full_name)
+                )
     return result
 
 
 async def queue_autocomplete(interaction: Interaction, current: str):
     result = []
-    session: SQLAlchemySession
-    with Session() as session:
-        queues: list[Queue] | None = (
-            session.query(Queue).order_by(Queue.ordinal).limit(25).all()
-        )
-        if queues:
-            current_casefold = current.casefold()
-            for queue in queues:
-                if current_casefold in queue.name.casefold():
-                    result.append(
-                        discord.app_commands.Choice(name=queue.name, value=queue.name)
-                    )
+    async with async_session() as session:
+        queue_names: list[str] = list(
+            await session.scalars(select(Queue.name).order_by(Queue.ordinal).limit(25))
+        )
+        current_casefold = current.casefold()
+        for queue_name in queue_names:
+            if current_casefold in queue_name.casefold():
+                result.append(
+                    discord.app_commands.Choice(name=queue_name, value=queue_name)
+                )
     return result
 
 
 async def unlocked_queue_autocomplete(interaction: Interaction, current: str):
     result = []
-    session: SQLAlchemySession
-    with Session() as session:
-        queues: list[Queue] | None = (
-            session.query(Queue)
-            .filter(Queue.is_locked == False)
-            .order_by(Queue.ordinal)
-            .limit(25)
-            .all()
+    async with async_session() as session:
+        queue_names: list[str] = list(
+            await session.scalars(
+                select(Queue.name)
+                .where(Queue.is_locked == False)
+                .order_by(Queue.ordinal)
+                .limit(25)
+            )
         )
-        if queues:
-            current_casefold = current.casefold()
-            for queue in queues:
-                if current_casefold in queue.name.casefold():
-                    result.append(
-                        discord.app_commands.Choice(name=queue.name, value=queue.name)
-                    )
+        current_casefold = current.casefold()
+        for queue_name in queue_names:
+            if current_casefold in queue_name.casefold():
+                result.append(
+                    discord.app_commands.Choice(name=queue_name, value=queue_name)
+                )
     return result
 
 
 async def in_progress_game_autocomplete(interaction: Interaction, current: str):
     result = []
-    session: SQLAlchemySession
-    with Session() as session:
-        in_progress_games: list[InProgressGame] | None = (
-            session.query(InProgressGame).limit(25).all()
-        )  # discord only supports up to 25 choices
-        if in_progress_games:
-            for ipg in in_progress_games:
-                short_game_id = short_uuid(ipg.id)
-                if current in short_game_id:
-                    result.append(
-                        discord.app_commands.Choice(
-                            name=short_game_id, value=short_game_id
-                        )
-                    )
+    async with async_session() as session:
+        # discord only supports up to 25 choices
+        in_progress_game_ids: list[str] = list(
+            await session.scalars(select(InProgressGame.id).limit(25))
+        )
+        for in_progress_game_id in in_progress_game_ids:
+            short_game_id = short_uuid(in_progress_game_id)
+            if current in short_game_id:
+                result.append(
+                    discord.app_commands.Choice(name=short_game_id, value=short_game_id)
+                )
     return result
 
 
 async def rotation_autocomplete(interaction: Interaction, current: str):
     result = []
-    session: SQLAlchemySession
-    with Session() as session:
-        rotations: list[Rotation] | None = (
-            session.query(Rotation).order_by(Rotation.name).limit(25).all()
-        )
-        if rotations:
-            current_casefold = current.casefold()
-            for rotation in rotations:
-                if current_casefold in rotation.name.casefold():
-                    result.append(
-                        discord.app_commands.Choice(
-                            name=rotation.name, value=rotation.name
-                        )
-                    )
+    async with async_session() as session:
+        rotation_names: list[str] = list(
+            await session.scalars(
+                select(Rotation.name).order_by(Rotation.name).limit(25)
+            )
+        )
+        current_casefold = current.casefold()
+        for rotation_name in rotation_names:
+            if current_casefold in rotation_name.casefold():
+                result.append(
+                    discord.app_commands.Choice(name=rotation_name, value=rotation_name)
+                )
     return result
 
 
 async def ladder_autocomplete(interaction: Interaction, current: str):
     result = []
-    session: SQLAlchemySession
-    with Session() as session:
-        ladders: list[Ladder] | None = (
-            session.query(Ladder).order_by(Ladder.name).limit(25).all()
-        )
-        if ladders:
-            current_casefold = current.casefold()
-            for ladder in ladders:
-                if current_casefold in ladder.name.casefold():
-                    result.append(
-                        discord.app_commands.Choice(name=ladder.name, value=ladder.name)
-                    )
+    async with async_session() as session:
+        ladder_names: list[str] = list(
+            await session.scalars(select(Ladder.name).order_by(Ladder.name).limit(25))
+        )
+        current_casefold = current.casefold()
+        for ladder_name in ladder_names:
+            if current_casefold in ladder_name.casefold():
+                result.append(
+                    discord.app_commands.Choice(name=ladder_name, value=ladder_name)
+                )
     return result
 
 
@@ -2026,34 +1926,35 @@ async def ladder_match_autocomplete(interaction: Interaction, current: str):
     "<ladder>: challenger vs defender [status]". Returns IDs as values.
     """
     from discord_bots.models import LadderMatch as _LadderMatch
-    from discord_bots.models import LadderTeam as _LadderTeam
 
     result = []
-    session: SQLAlchemySession
-    with Session() as session:
+    async with async_session() as session:
         rows = (
-            session.query(_LadderMatch, Ladder)
-            .join(Ladder, Ladder.id == _LadderMatch.ladder_id)
-            .order_by(_LadderMatch.challenged_at.desc())
-            .limit(50)
-            .all()
+            await session.execute(
+                select(_LadderMatch, Ladder)
+                .join(Ladder, Ladder.id == _LadderMatch.ladder_id)
+                .order_by(_LadderMatch.challenged_at.desc())
+                .limit(50)
+            )
+        ).all()
+        team_ids = {match.challenger_team_id for match, _ in rows} | {
+            match.defender_team_id for match, _ in rows
+        }
+        team_name_by_id: dict[str, str] = dict(
+            (
+                await session.execute(
+                    select(LadderTeam.id, LadderTeam.name).where(
+                        LadderTeam.id.in_(team_ids)
+                    )
+                )
+            ).all()
         )
         cf = current.casefold()
         for match, ladder in rows:
-            challenger = (
-                session.query(_LadderTeam)
-                .filter(_LadderTeam.id == match.challenger_team_id)
-                .first()
-            )
-            defender = (
-                session.query(_LadderTeam)
-                .filter(_LadderTeam.id == match.defender_team_id)
-                .first()
-            )
             label = (
                 f"{ladder.name}: "
-                f"{challenger.name if challenger else '?'} vs "
-                f"{defender.name if defender else '?'} "
+                f"{team_name_by_id.get(match.challenger_team_id, '?')} vs "
+                f"{team_name_by_id.get(match.defender_team_id, '?')} "
                 f"[{match.status}]"
             )
             label = label[:100]
@@ -2073,25 +1974,25 @@ async def ladder_team_autocomplete(interaction: Interaction, current: str):
     if not ladder_name:
         return []
     result = []
-    session: SQLAlchemySession
-    with Session() as session:
-        ladder_row: Ladder | None = (
-            session.query(Ladder).filter(Ladder.name == ladder_name).first()
+    async with async_session() as session:
+        ladder_row: Ladder | None = await async_query_first(
+            session, Ladder, Ladder.name == ladder_name
         )
         if not ladder_row:
             return []
-        teams: list[LadderTeam] = (
-            session.query(LadderTeam)
-            .filter(LadderTeam.ladder_id == ladder_row.id)
-            .order_by(LadderTeam.name)
-            .limit(25)
-            .all()
+        team_names: list[str] = list(
+            await session.scalars(
+                select(LadderTeam.name)
+                .where(LadderTeam.ladder_id == ladder_row.id)
+                .order_by(LadderTeam.name)
+                .limit(25)
+            )
         )
         current_casefold = current.casefold()
-        for team in teams:
-            if current_casefold in team.name.casefold():
+        for team_name in team_names:
+            if current_casefold in team_name.casefold():
                 result.append(
-                    discord.app_commands.Choice(name=team.name, value=team.name)
+                    discord.app_commands.Choice(name=team_name, value=team_name)
                 )
     return result
 
@@ -2099,21 +2000,21 @@ async def ladder_team_autocomplete(interaction: Interaction, current: str):
 async def category_autocomplete_with_user_id(interaction: Interaction, current: str):
     # useful for when you want to filter the categories based on the ones the author has games played in
     choices = []
-    session: SQLAlchemySession
-    with Session() as session:
+    async with async_session() as session:
         result = (
-            session.query(Category.name, PlayerCategoryTrueskill.player_id)
-            .join(PlayerCategoryTrueskill)
-            .filter(
-                PlayerCategoryTrueskill.player_id == interaction.user.id,
-                Category.is_rated,
+            await session.execute(
+                select(Category.name, PlayerCategoryTrueskill.player_id)
+                .join(PlayerCategoryTrueskill)
+                .where(
+                    PlayerCategoryTrueskill.player_id == interaction.user.id,
+                    Category.is_rated,
+                )
+                .distinct(Category.name)
+                .order_by(Category.name)
+                .limit(25)  # discord only supports up to 25 choices
             )
-            .distinct(Category.name)
-            .order_by(Category.name)
-            .limit(25)  # discord only supports up to 25 choices
-            .all()
-        )
-        category_names: list[str] = [r[0] for r in result] if result else []
+        ).all()
+        category_names: list[str] = [r[0] for r in result]
         current_casefold = current.casefold()
         for name in category_names:
             if current_casefold in name.casefold():
@@ -2131,18 +2032,16 @@ async def category_name_autocomplete_without_user_id(
 ):
     # useful for when you want all of the categories, regardless of whether the user has played games in them
     choices = []
-    session: SQLAlchemySession
-    with Session() as session:
-        categories: list[Category] | None = (
-            session.query(Category)
-            .filter(Category.is_rated)
-            .distinct(Category.name)
-            .order_by(Category.name)
-            .limit(25)  # discord only supports up to 25 choices
-            .all()
+    async with async_session() as session:
+        categories: list[Category] = list(
+            await session.scalars(
+                select(Category)
+                .where(Category.is_rated)
+                .distinct(Category.name)
+                .order_by(Category.name)
+                .limit(25)  # discord only supports up to 25 choices
+            )
         )
-        if not categories:
-            return []
         current_casefold = current.casefold()
         for category in categories:
             if current_casefold in category.name.casefold():
@@ -2158,32 +2057,27 @@ async def category_name_autocomplete_without_user_id(
 async def position_autocomplete_with_user_id(interaction: Interaction, current: str):
     # useful for when you want to filter the positions based on the ones the author has games played in
     choices = []
-    session: SQLAlchemySession
-    with Session() as session:
-        player_category_trueskills: list[PlayerCategoryTrueskill] = (
-            session.query(PlayerCategoryTrueskill)
-            .join(Category, Category.id == PlayerCategoryTrueskill.category_id)
-            .filter(
-                PlayerCategoryTrueskill.player_id == interaction.user.id,
-                PlayerCategoryTrueskill.position_id != None,
-                Category.is_rated,
+    async with async_session() as session:
+        position_ids: list[str] = list(
+            await session.scalars(
+                select(PlayerCategoryTrueskill.position_id)
+                .join(Category, Category.id == PlayerCategoryTrueskill.category_id)
+                .where(
+                    PlayerCategoryTrueskill.player_id == interaction.user.id,
+                    PlayerCategoryTrueskill.position_id != None,
+                    Category.is_rated,
+                )
             )
-            .all()
         )
-        position_ids: list[str] = [
-            pct.position_id for pct in player_category_trueskills
-        ]
-        result = (
-            session.query(Position)
-            .filter(
-                Position.id.in_(position_ids),
+        positions: list[Position] = list(
+            await session.scalars(
+                select(Position)
+                .where(Position.id.in_(position_ids))
+                .distinct(Position.name)
+                .order_by(Position.name)
+                .limit(25)  # discord only supports up to 25 choices
             )
-            .distinct(Position.name)
-            .order_by(Position.name)
-            .limit(25)  # discord only supports up to 25 choices
-            .all()
         )
-        positions: list[Position] = result if result else []
         current_casefold = current.casefold()
         for position in positions:
             if current_casefold in position.name.casefold():
@@ -2199,29 +2093,28 @@ async def position_autocomplete_with_user_id(interaction: Interaction, current:
 async def map_autocomplete_with_user_id(interaction: Interaction, current: str):
     # useful for when you want to filter the maps based on the ones the author has games played in
     choices = []
-    session: SQLAlchemySession
-    with Session() as session:
-        player_category_trueskills: list[PlayerCategoryTrueskill] = (
-            session.query(PlayerCategoryTrueskill)
-            .join(Category, Category.id == PlayerCategoryTrueskill.category_id)
-            .filter(
-                PlayerCategoryTrueskill.player_id == interaction.user.id,
-                PlayerCategoryTrueskill.map_id != None,
-                Category.is_rated,
+    async with async_session() as session:
+        map_ids: list[str] = list(
+            await session.scalars(
+                select(PlayerCategoryTrueskill.map_id)
+                .join(Category, Category.id == PlayerCategoryTrueskill.category_id)
+                .where(
+                    PlayerCategoryTrueskill.player_id == interaction.user.id,
+                    PlayerCategoryTrueskill.map_id != None,
+                    Category.is_rated,
+                )
+                .limit(25)  # discord only supports up to 25 choices
             )
-            .limit(25)  # discord only supports up to 25 choices
-            .all()
         )
-        map_ids: list[str] = [pct.map_id for pct in player_category_trueskills]
-        result = (
-            session.query(Map)
-            .filter(Map.id.in_(map_ids))
-            .distinct(Map.full_name)
-            .order_by(Map.full_name)
-            .limit(25)  # discord only supports up to 25 choices
-            .all()
+        maps: list[Map] = list(
+            await session.scalars(
+                select(Map)
+                .where(Map.id.in_(map_ids))
+                .distinct(Map.full_name)
+                .order_by(Map.full_name)
+                .limit(25)  # discord only supports up to 25 choices
+            )
         )
-        maps: list[Map] = result if result else []
         current_casefold = current.casefold()
         for map in maps:
             if current_casefold in map.full_name.casefold():
@@ -2236,19 +2129,18 @@ async def map_autocomplete_with_user_id(interaction: Interaction, current: str):
 
 async def command_autocomplete(interaction: Interaction, current: str):
     result = []
-    session: SQLAlchemySession
-    with Session() as session:
-        commands: list[CustomCommand] | None = (
-            session.query(CustomCommand).order_by(CustomCommand.name).limit(25).all()
-        )  # discord only supports up to 25 choices
-        if commands:
-            for command in commands:
-                if current in command.name:
-                    result.append(
-                        discord.app_commands.Choice(
-                            name=command.name, value=command.name
-                        )
-                    )
+    async with async_session() as session:
+        # discord only supports up to 25 choices
+        command_names: list[str] = list(
+            await session.scalars(
+                select(CustomCommand.name).order_by(CustomCommand.name).limit(25)
+            )
+        )
+        for command_name in command_names:
+            if current in command_name:
+                result.append(
+                    discord.app_commands.Choice(name=command_name, value=command_name)
+                )
     return result
 
 
@@ -2342,113 +2234,166 @@ def flatten_list(l: list[list[any]]) -> list[any]:
     return [item for sublist in l for item in sublist]
 
 
-def get_category_trueskill(
+def get_category_trueskills(
     session: SQLAlchemySession,
     config: Config,
-    player_id: int,
+    player_positions: list[tuple[int, str | None]],
     queue_enabled_map_trueskill: bool,
     category_id: str,
     map_id: str,
-    position_id: str | None = None,
-) -> PlayerCategoryTrueskill:
+) -> list[PlayerCategoryTrueskill]:
     """
-    Fetch the appropriate category trueskill given the parameters.
+    Fetch the appropriate category trueskill for several players in the same
+    category and map, e.g. everyone in a game.
+
+    Every PlayerCategoryTrueskill that could match is loaded in one query and
+    the fallbacks (positionless, mapless, category only, then the player's own
+    trueskill) are resolved from those. Missing ones are created from their
+    nearest fallback and flushed in one go, the caller commits them.
 
-    This will create the appropriate PlayerCategoryTrueskill if not found.
+    :player_positions: (player id, position id) for each player
+    :returns: One PlayerCategoryTrueskill for each entry in player_positions,
+    in the same order
     """
     if not config.enable_position_trueskill:
-        position_id = None
+        player_positions = [(player_id, None) for player_id, _ in player_positions]
     if not config.enable_map_trueskill or not queue_enabled_map_trueskill:
         map_id = None
 
-    pct = (
-        session.query(PlayerCategoryTrueskill)
-        .filter(
-            PlayerCategoryTrueskill.player_id == player_id,
-            PlayerCategoryTrueskill.category_id == category_id,
-            PlayerCategoryTrueskill.position_id == position_id,
+    player_ids = {player_id for player_id, _ in player_positions}
+    position_ids = {position_id for _, position_id in player_positions if position_id}
+    pcts_by_key: dict[tuple[int, str | None, str | None], PlayerCategoryTrueskill] = {}
+    for pct in session.query(PlayerCategoryTrueskill).filter(
+        PlayerCategoryTrueskill.player_id.in_(player_ids),
+        PlayerCategoryTrueskill.category_id == category_id,
+        or_(
             PlayerCategoryTrueskill.map_id == map_id,
-        )
-        .first()
-    )
-    if pct:
-        return pct
-
-    # We couldn't find a matching PCT, so find the nearest parent and create
-    # a new one based on that
-    mu_to_use = None
-    sigma_to_use = None
-
-    if position_id:
-        # Try to find a one with a map but no position
-        positionless_pct = (
-            session.query(PlayerCategoryTrueskill)
-            .filter(
-                PlayerCategoryTrueskill.player_id == player_id,
-                PlayerCategoryTrueskill.category_id == category_id,
-                PlayerCategoryTrueskill.position_id == None,
-                PlayerCategoryTrueskill.map_id == map_id,
-            )
-            .first()
-        )
-        if positionless_pct:
-            mu_to_use = positionless_pct.mu
-            sigma_to_use = positionless_pct.sigma
+            PlayerCategoryTrueskill.map_id == None,
+        ),
+        or_(
+            PlayerCategoryTrueskill.position_id.in_(position_ids),
+            PlayerCategoryTrueskill.position_id == None,
+        ),
+    ):
+        pcts_by_key.setdefault((pct.player_id, pct.position_id, pct.map_id), pct)
+
+    def parent_pct(player_id: int, position_id: str | None):
+        if position_id:
+            # Try to find a one with a map but no position
+            fallbacks = [(None, map_id)]
+        elif map_id:
+            # Try to find a one with a position but no map
+            fallbacks = [(position_id, None)]
+        else:
+            fallbacks = []
+        # Try category alone, no position or map
+        fallbacks.append((None, None))
+        for fallback_position_id, fallback_map_id in fallbacks:
+            pct = pcts_by_key.get((player_id, fallback_position_id, fallback_map_id))
+            if pct:
+                return pct
+        return None
 
-    elif map_id:
-        # Try to find a one with a position but no map
-        mapless_pct = (
-            session.query(PlayerCategoryTrueskill)
-            .filter(
-                PlayerCategoryTrueskill.player_id == player_id,
-                PlayerCategoryTrueskill.category_id == category_id,
-                PlayerCategoryTrueskill.position_id == position_id,
-                PlayerCategoryTrueskill.map_id == None,
+    # We couldn't find any player_category_trueskill for these, so use the
+    # global player ones
+    players_by_id: dict[int, Player] = {}
+    player_ids_without_pct = [
+        player_id
+        for player_id, position_id in player_positions
+        if (player_id, position_id, map_id) not in pcts_by_key
+        and not parent_pct(player_id, position_id)
+    ]
+    if player_ids_without_pct:
+        players_by_id = {
+            player.id: player
+            for player in session.query(Player).filter(
+                Player.id.in_(player_ids_without_pct)
             )
-            .first()
-        )
-        if mapless_pct:
-            mu_to_use = mapless_pct.mu
-            sigma_to_use = mapless_pct.sigma
+        }
+
+    new_pcts: list[PlayerCategoryTrueskill] = []
+    result: list[PlayerCategoryTrueskill] = []
+    for player_id, position_id in player_positions:
+        pct = pcts_by_key.get((player_id, position_id, map_id))
+        if pct:
+            result.append(pct)
+            continue
+
+        # We couldn't find a matching PCT, so find the nearest parent and
+        # create a new one based on that
+        parent = parent_pct(player_id, position_id)
+        if parent:
+            mu_to_use = parent.mu
+            sigma_to_use = parent.sigma
+        else:
+            player = players_by_id[player_id]
+            mu_to_use = player.rated_trueskill_mu
+            sigma_to_use = player.rated_trueskill_sigma
+
+        # Since this is a new PCT, juice up the sigma so it can adjust quicker
+        sigma_to_use = min(2 * sigma_to_use, config.default_trueskill_sigma)
+
+        new_pct = PlayerCategoryTrueskill(
+            player_id=player_id,
+            category_id=category_id,
+            position_id=position_id,
+            map_id=map_id,
+            mu=mu_to_use,
+            sigma=sigma_to_use,
+            rank=mu_to_use - 3 * sigma_to_use,
+            last_game_finished_at=datetime.now(timezone.utc),
+        )
+        pcts_by_key[(player_id, position_id, map_id)] = new_pct
+        new_pcts.append(new_pct)
+        result.append(new_pct)
+
+    if new_pcts:
+        session.add_all(new_pcts)
+        session.flush()
+    return result
 
-    if mu_to_use is None and sigma_to_use is None:
-        # Try category alone, no position or map
-        category_only_pct = (
-            session.query(PlayerCategoryTrueskill)
-            .filter(
-                PlayerCategoryTrueskill.player_id == player_id,
-                PlayerCategoryTrueskill.category_id == category_id,
-                PlayerCategoryTrueskill.position_id == None,
-                PlayerCategoryTrueskill.map_id == None,
-            )
-            .first()
-        )
-        if category_only_pct:
-            mu_to_use = category_only_pct.mu
-            sigma_to_use = category_only_pct.sigma
-
-    # We couldn't find any player_category_trueskill, so use the global player one
-    if mu_to_use is None and sigma_to_use is None:
-        player: Player = session.query(Player).filter(Player.id == player_id).first()
-        mu_to_use = player.rated_trueskill_mu
-        sigma_to_use = player.rated_trueskill_sigma
-
-    # Since this is a new PCT, juice up the sigma so it can adjust quicker
-    sigma_to_use = min(2 * sigma_to_use, config.default_trueskill_sigma)
-
-    new_pct = PlayerCategoryTrueskill(
-        player_id=player_id,
-        category_id=category_id,
-        position_id=position_id,
-        map_id=map_id,
-        mu=mu_to_use,
-        sigma=sigma_to_use,
-        rank=mu_to_use - 3 * sigma_to_use,
-        last_game_finished_at=datetime.now(timezone.utc),
-    )
-    session.add(new_pct)
-    session.commit()
-    return new_pct
+
+def get_category_ratings(
+    session: SQLAlchemySession,
+    config: Config,
+    player_positions: list[tuple[int, str | None]],
+    queue_enabled_map_trueskill: bool,
+    category_id: str,
+    map_id: str,
+) -> list[rating_cache.CachedRating]:
+    """
+    get_category_trueskills for code that only needs the mu and sigma, e.g.
+    balancing teams. The ratings come from rating_cache, only players
+    without a PlayerCategoryTrueskill for the position and map yet go
+    through get_category_trueskills, which creates it for the caller to
+    commit.
+
+    :player_positions: (player id, position id) for each player
+    :returns: One rating for each entry in player_positions, in the same
+    order
+    """
+    if not config.enable_position_trueskill:
+        player_positions = [(player_id, None) for player_id, _ in player_positions]
+    if not config.enable_map_trueskill or not queue_enabled_map_trueskill:
+        map_id = None
+
+    ratings: list[rating_cache.CachedRating | None] = [
+        rating_cache.get(session, player_id, category_id, map_id, position_id)
+        for player_id, position_id in player_positions
+    ]
+    missing = [i for i, rating in enumerate(ratings) if rating is None]
+    if missing:
+        pcts = get_category_trueskills(
+            session,
+            config,
+            [player_positions[i] for i in missing],
+            queue_enabled_map_trueskill,
+            category_id,
+            map_id,
+        )
+        for i, pct in zip(missing, pcts):
+            ratings[i] = rating_cache.CachedRating(pct.mu, pct.sigma)
+    return ratings
 
 
 @dataclass
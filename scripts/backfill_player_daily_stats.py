@@ -0,0 +1,41 @@
+import argparse
+
+from discord_bots import daily_stats
+from discord_bots.models import Session
+
+"""
+Rebuilds the per-player daily win/loss/tie counters used by /stats and
+/map stats from the finished game history. Run it once after upgrading, or
+whenever the counters look off.
+"""
+
+
+def parse_args() -> dict[str, any]:
+    parser = argparse.ArgumentParser(
+        description="Rebuild player_daily_stats from finished games. Defaults to 'dry run' unless specifically told to overwrite data.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--store",
+        default="False",
+        help="If 'True' will replace the stored counters. "
+        "Defaults to 'False', which is a 'Dry Run' mode.",
+    )
+    arguments = parser.parse_args()
+    return vars(arguments)
+
+
+def main():
+    args = parse_args()
+    with Session() as session:
+        count = daily_stats.backfill(session)
+        if args["store"] == "True":
+            session.commit()
+            print(f"Stored {count} player daily stats")
+        else:
+            session.rollback()
+            print(f"Dry run, would have stored {count} player daily stats")
+
+
+if __name__ == "__main__":
+    main()
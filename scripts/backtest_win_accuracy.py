@@ -1,36 +1,296 @@
-from sqlalchemy.orm.session import Session as SQLAlchemySession
+import argparse
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 
+import numpy as np
+from table2ascii import Alignment, PresetStyle, table2ascii
+
+import discord_bots.config as config
+from discord_bots.game_history import load as load_game_history
 from discord_bots.models import FinishedGame, Session
+from discord_bots.trueskill_replay import Replay, ReplayParams
 
 """
 Measures the prediction accuracy of the last 1000 (default) matches.
 Each finished game contains a win probability for team0 winning, so
 we check this win probability against the match result to determine the overall accuracy.
+
+With --replay True, the whole history is instead replayed through TrueSkill
+once for every combination of the parameters given, spread over a pool of
+worker processes, and the win probabilities of each replay are scored by
+accuracy, log loss and Brier score. The history is loaded once and handed to
+each worker when it starts.
 """
-session: SQLAlchemySession = Session()
-finished_games: list[FinishedGame] = (
-    session.query(FinishedGame)
-    .order_by(FinishedGame.finished_at.desc())
-    .limit(1000)  # Increase or decrease based on preference
-    .all()
-)
-
-total_matches = len(finished_games)
-correct_predictions = 0
-incorrect_predictions = 0
-for game in finished_games:
-    result = game.winning_team
-    team0_win = True if result == 0 else False
-    team0_win_probability = game.win_probability
-    team1_win_probability = abs(1 - team0_win_probability)
-    if (team0_win_probability > team1_win_probability) == team0_win:
-        # team0 was predicted to win and they did actually win
-        correct_predictions += 1
+
+
+def parse_args() -> dict[str, any]:
+    parser = argparse.ArgumentParser(
+        description="Measure how often the predicted winner of a game won.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=1000,
+        help="How many of the most recent games to measure",
+    )
+    parser.add_argument(
+        "--replay",
+        default="False",
+        help="If 'True' replays every game to predict the last --limit games, "
+        "instead of using the win probability stored with them",
+    )
+    parser.add_argument(
+        "--categories",
+        nargs="*",
+        help="Only replay games from these categories. Defaults to every game",
+    )
+    parser.add_argument(
+        "--mu",
+        type=float,
+        nargs="*",
+        default=[config.DEFAULT_TRUESKILL_MU],
+        help="Starting mu values to replay with",
+    )
+    parser.add_argument(
+        "--sigma",
+        type=float,
+        nargs="*",
+        default=[config.DEFAULT_TRUESKILL_SIGMA],
+        help="Starting sigma values to replay with",
+    )
+    parser.add_argument(
+        "--beta",
+        type=float,
+        nargs="*",
+        default=[config.DEFAULT_TRUESKILL_BETA],
+        help="TrueSkill beta values to replay with",
+    )
+    parser.add_argument(
+        "--tau",
+        type=float,
+        nargs="*",
+        default=[config.DEFAULT_TRUESKILL_TAU],
+        help="TrueSkill tau values to replay with",
+    )
+    parser.add_argument(
+        "--mm-sigma-mult",
+        type=float,
+        nargs="*",
+        default=[config.MM_SIGMA_MULT],
+        help="MM_SIGMA_MULT values to measure matchmaking accuracy with",
+    )
+    parser.add_argument(
+        "--sigma-decay-amount",
+        type=float,
+        nargs="*",
+        default=[0.0],
+        help="Sigma decay per day values to replay with, 0 for no decay",
+    )
+    parser.add_argument(
+        "--sigma-decay-grace-days",
+        type=int,
+        nargs="*",
+        default=[0],
+        help="Sigma decay grace period values to replay with",
+    )
+    parser.add_argument(
+        "--sigma-decay-max-decay-proportion",
+        type=float,
+        nargs="*",
+        default=[1.0],
+        help="Sigma decay max proportion of the starting sigma values to replay with",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="How many processes to replay in, 1 to replay in this process",
+    )
+    parser.add_argument(
+        "--sort",
+        choices=["accuracy", "log_loss", "brier"],
+        default="log_loss",
+        help="Which score to sort the configurations by, best first",
+    )
+    return vars(parser.parse_args())
+
+
+def correct_predictions(win_probability: np.ndarray, winning_team: np.ndarray) -> int:
+    # team0 was predicted to win and they did actually win, or the other way
+    # around. A tie counts as team0 not winning.
+    return int(
+        np.count_nonzero((win_probability > 1 - win_probability) == (winning_team == 0))
+    )
+
+
+def accuracy(win_probability: np.ndarray, winning_team: np.ndarray) -> float:
+    return (
+        correct_predictions(win_probability, winning_team)
+        / (len(winning_team) or 1)
+        * 100
+    )
+
+
+def backtest_stored(limit: int):
+    with Session() as session:
+        game_history = load_game_history(session, descending=True, limit=limit)
+    total_matches = len(game_history)
+    correct = correct_predictions(
+        game_history.win_probability, game_history.winning_team
+    )
+    incorrect = total_matches - correct
+    print("Total Matches:", total_matches)
+    print(
+        f"Accuracy: {correct}/{incorrect} [{correct / (total_matches or 1) * 100:.2f}%]"
+    )
+
+
+# The replay each worker process scores, sent once when the process starts
+# instead of with every configuration
+_replay: Replay | None = None
+_measured: slice = slice(None)
+
+
+def _init_worker(replay: Replay, measured: slice):
+    global _replay, _measured
+    _replay = replay
+    _measured = measured
+
+
+def score(
+    win_probability: np.ndarray, winning_team: np.ndarray
+) -> tuple[float, float, float]:
+    """
+    :returns: accuracy (in %), log loss and Brier score. For log loss and
+    Brier score a tie counts as half a win.
+    """
+    outcome = np.where(winning_team == 0, 1.0, np.where(winning_team == 1, 0.0, 0.5))
+    clipped = np.clip(win_probability, 1e-15, 1 - 1e-15)
+    log_loss = -np.mean(outcome * np.log(clipped) + (1 - outcome) * np.log(1 - clipped))
+    brier = np.mean((win_probability - outcome) ** 2)
+    return accuracy(win_probability, winning_team), float(log_loss), float(brier)
+
+
+def _backtest(
+    params: ReplayParams,
+) -> tuple[ReplayParams, tuple[float, float, float], tuple[float, float, float]]:
+    result = _replay.run(params)
+    winning_team = _replay.winning_team[_measured]
+    return (
+        params,
+        score(result.win_probability[_measured], winning_team),
+        score(result.matchmaking_win_probability[_measured], winning_team),
+    )
+
+
+def backtest_replay(
+    limit: int,
+    categories: list[str] | None,
+    grid: list[ReplayParams],
+    workers: int,
+    sort: str,
+):
+    with Session() as session:
+        filters = (
+            [FinishedGame.category_name.in_(categories)]
+            if categories is not None
+            else []
+        )
+        replay = Replay.from_history(load_game_history(session, *filters))
+    measured = slice(max(len(replay) - limit, 0), len(replay))
+    print("Total Matches:", len(replay.winning_team[measured]))
+    print(f"Replaying {len(replay)} games with {len(grid)} configurations")
+
+    start = time.perf_counter()
+    if workers == 1:
+        _init_worker(replay, measured)
+        results = list(map(_backtest, grid))
+    else:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(replay, measured),
+        ) as executor:
+            results = list(
+                executor.map(
+                    _backtest,
+                    grid,
+                    chunksize=max(len(grid) // (4 * (workers or os.cpu_count())), 1),
+                )
+            )
+    print(f"Finished in {time.perf_counter() - start:.1f}s")
+
+    sort_index = {"accuracy": 0, "log_loss": 1, "brier": 2}[sort]
+    results.sort(
+        key=lambda result: result[1][sort_index] * (-1 if sort == "accuracy" else 1)
+    )
+    body = [
+        [
+            f"{params.mu:g}",
+            f"{params.sigma:g}",
+            f"{params.beta:g}",
+            f"{params.tau:g}",
+            f"{params.mm_sigma_mult:g}",
+            f"{params.sigma_decay_amount:g}/{params.sigma_decay_grace_days}/{params.sigma_decay_max_decay_proportion:g}",
+            f"{scores[0]:.2f}%",
+            f"{scores[1]:.4f}",
+            f"{scores[2]:.4f}",
+            f"{mm_scores[0]:.2f}%",
+            f"{mm_scores[1]:.4f}",
+            f"{mm_scores[2]:.4f}",
+        ]
+        for params, scores, mm_scores in results
+    ]
+    print(
+        table2ascii(
+            header=[
+                "mu",
+                "sigma",
+                "beta",
+                "tau",
+                "mm_sigma_mult",
+                "decay",
+                "accuracy",
+                "log_loss",
+                "brier",
+                "mm_accuracy",
+                "mm_log_loss",
+                "mm_brier",
+            ],
+            body=body,
+            style=PresetStyle.plain,
+            alignments=Alignment.LEFT,
+        )
+    )
+
+
+def main():
+    args = parse_args()
+    if args["replay"].lower() == "true":
+        # Every argument named after a ReplayParams field is swept
+        names = [
+            "mu",
+            "sigma",
+            "beta",
+            "tau",
+            "mm_sigma_mult",
+            "sigma_decay_amount",
+            "sigma_decay_grace_days",
+            "sigma_decay_max_decay_proportion",
+        ]
+        grid = [
+            ReplayParams(**dict(zip(names, values)))
+            for values in itertools.product(*(args[name] for name in names))
+        ]
+        backtest_replay(
+            args["limit"], args["categories"], grid, args["workers"], args["sort"]
+        )
     else:
-        incorrect_predictions += 1
+        backtest_stored(args["limit"])
+
 
-accuracy = round(
-    correct_predictions / (correct_predictions + incorrect_predictions) * 100, 2
-)
-print("Total Matches:", total_matches)
-print(f"Accuracy: {correct_predictions}/{incorrect_predictions} [{accuracy:.2f}%]")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+from sqlalchemy import create_engine, delete, event, func, insert, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from table2ascii import Alignment, PresetStyle, table2ascii
+
+from discord_bots.models import (
+    FinishedGame,
+    FinishedGamePlayer,
+    InProgressGame,
+    InProgressGamePlayer,
+    Player,
+    Queue,
+    QueuePlayer,
+    mapper_registry,
+    set_sqlite_pragmas,
+)
+
+"""
+Compares command latency with the sync Session the bot used to query with on
+the event loop thread, and with the AsyncSession the queue add/pop/finish
+pipeline and the background tasks use now, against a scratch SQLite database.
+
+Every simulated user is a coroutine on one event loop, like the commands the
+bot handles concurrently. Each command either runs the queries /add runs
+(is the player in a game, their most recent finished game, the queues, then
+adding or removing them from a queue) or reads a queue's players like
+/status. A heartbeat coroutine measures how late the event loop wakes it up,
+which is how long the gateway would have been frozen.
+"""
+
+
+def parse_args() -> dict[str, any]:
+    parser = argparse.ArgumentParser(
+        description="Benchmark command latency with sync and async sessions",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--commands", type=int, default=40, help="Per user")
+    parser.add_argument(
+        "--write-ratio", type=float, default=0.3, help="Ratio of commands that write"
+    )
+    parser.add_argument(
+        "--think-ms",
+        type=float,
+        default=20,
+        help="Most time a user waits between commands, chosen at random",
+    )
+    parser.add_argument("--players", type=int, default=2000)
+    parser.add_argument("--queues", type=int, default=10)
+    parser.add_argument(
+        "--games",
+        type=int,
+        default=20000,
+        help="Finished games to seed, so looking up a player's last game has work to do",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+    return vars(arguments)
+
+
+def create_database(path: str, players: int, queues: int, games: int, seed: int):
+    rng = random.Random(seed)
+    engine = create_engine(f"sqlite:///{path}")
+    event.listen(engine, "connect", set_sqlite_pragmas)
+    mapper_registry.metadata.create_all(engine)
+    with sessionmaker(bind=engine)() as session:
+        session.add_all(
+            [
+                Player(id=player_id, name=f"player{player_id}")
+                for player_id in range(players)
+            ]
+        )
+        session.add_all(
+            [Queue(name=f"queue{i}", size=10, ordinal=i) for i in range(queues)]
+        )
+        finished_at = datetime.now(timezone.utc) - timedelta(days=365)
+        finished_games = []
+        for game_index in range(games):
+            finished_games.append(
+                FinishedGame(
+                    average_trueskill=12.5,
+                    finished_at=finished_at + timedelta(minutes=game_index),
+                    game_id=str(game_index),
+                    is_rated=True,
+                    map_full_name="Dangerous Crossing",
+                    map_short_name="DX",
+                    queue_name="queue0",
+                    started_at=finished_at + timedelta(minutes=game_index - 20),
+                    team0_name="Blood Eagle",
+                    team1_name="Diamond Sword",
+                    win_probability=0.5,
+                    winning_team=rng.randrange(2),
+                )
+            )
+        session.add_all(finished_games)
+        session.flush()
+        session.execute(
+            insert(FinishedGamePlayer),
+            [
+                {
+                    "id": str(uuid4()),
+                    "finished_game_id": finished_game.id,
+                    "player_id": player_id,
+                    "player_name": f"player{player_id}",
+                    "team": i % 2,
+                    "rated_trueskill_mu_before": 12.5,
+                    "rated_trueskill_sigma_before": 4.2,
+                    "rated_trueskill_mu_after": 12.5,
+                    "rated_trueskill_sigma_after": 4.2,
+                }
+                for finished_game in finished_games
+                for i, player_id in enumerate(rng.sample(range(players), 10))
+            ],
+        )
+        session.commit()
+    engine.dispose()
+
+
+def in_game_statement(player_id: int):
+    return (
+        select(InProgressGamePlayer.in_progress_game_id)
+        .join(InProgressGame)
+        .where(InProgressGamePlayer.player_id == player_id)
+        .limit(1)
+    )
+
+
+def most_recent_game_statement(player_id: int):
+    return (
+        select(FinishedGame)
+        .join(FinishedGamePlayer)
+        .where(FinishedGamePlayer.player_id == player_id)
+        .order_by(FinishedGame.finished_at.desc())
+        .limit(1)
+    )
+
+
+def queues_statement():
+    return select(Queue).where(Queue.is_locked == False).order_by(Queue.ordinal)
+
+
+def remove_statement(queue_id: str, player_id: int):
+    return delete(QueuePlayer).where(
+        QueuePlayer.queue_id == queue_id, QueuePlayer.player_id == player_id
+    )
+
+
+def new_queue_player(queue_id: str, player_id: int) -> QueuePlayer:
+    return QueuePlayer(
+        queue_id=queue_id,
+        player_id=player_id,
+        channel_id=0,
+        added_at=datetime.now(timezone.utc).replace(tzinfo=None),
+    )
+
+
+def queue_size_statement(queue_id: str):
+    return select(func.count(QueuePlayer.id)).where(QueuePlayer.queue_id == queue_id)
+
+
+def status_statement(queue_id: str):
+    return (
+        select(Player.name)
+        .join(QueuePlayer)
+        .where(QueuePlayer.queue_id == queue_id)
+        .order_by(QueuePlayer.added_at)
+    )
+
+
+def run_command_sync(
+    sessionmaker_: sessionmaker, queue_id: str, player_id: int, is_write: bool
+):
+    with sessionmaker_() as session:
+        if not is_write:
+            session.scalars(status_statement(queue_id)).all()
+            return
+        session.scalar(in_game_statement(player_id))
+        session.scalar(most_recent_game_statement(player_id))
+        session.scalars(queues_statement()).all()
+        if not session.execute(remove_statement(queue_id, player_id)).rowcount:
+            session.add(new_queue_player(queue_id, player_id))
+        session.commit()
+        session.scalar(queue_size_statement(queue_id))
+
+
+async def run_command_async(
+    sessionmaker_: async_sessionmaker, queue_id: str, player_id: int, is_write: bool
+):
+    async with sessionmaker_() as session:
+        if not is_write:
+            (await session.scalars(status_statement(queue_id))).all()
+            return
+        await session.scalar(in_game_statement(player_id))
+        await session.scalar(most_recent_game_statement(player_id))
+        (await session.scalars(queues_statement())).all()
+        if not (await session.execute(remove_statement(queue_id, player_id))).rowcount:
+            session.add(new_queue_player(queue_id, player_id))
+        await session.commit()
+        await session.scalar(queue_size_statement(queue_id))
+
+
+async def run_load(
+    path: str, is_async: bool, args: dict[str, any]
+) -> tuple[list[float], list[float], int, float]:
+    """
+    :returns: Every command's latency and every heartbeat's lateness in
+    seconds, the number of commands that failed, and the wall time
+    """
+    if is_async:
+        engine = create_async_engine(
+            f"sqlite+aiosqlite:///{path}",
+            connect_args={"timeout": 15},
+        )
+        event.listen(engine.sync_engine, "connect", set_sqlite_pragmas)
+        sessionmaker_ = async_sessionmaker(bind=engine, expire_on_commit=False)
+    else:
+        engine = create_engine(f"sqlite:///{path}", connect_args={"timeout": 15})
+        event.listen(engine, "connect", set_sqlite_pragmas)
+        sessionmaker_ = sessionmaker(bind=engine)
+
+    with create_engine(f"sqlite:///{path}").connect() as connection:
+        queue_ids = list(connection.scalars(select(Queue.id)))
+    latencies: list[float] = []
+    heartbeat_lateness: list[float] = []
+    errors = 0
+    done = asyncio.Event()
+
+    async def heartbeat(interval: float = 0.005):
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            heartbeat_lateness.append(time.perf_counter() - start - interval)
+
+    async def user(user_index: int):
+        nonlocal errors
+        rng = random.Random(args["seed"] * 1000 + user_index)
+        for _ in range(args["commands"]):
+            think = rng.uniform(0, args["think_ms"] / 1000)
+            # Measured from when the command was sent, so time spent waiting
+            # for a blocked event loop to get to it counts too
+            start = time.perf_counter() + think
+            await asyncio.sleep(think)
+            queue_id = rng.choice(queue_ids)
+            player_id = rng.randrange(args["players"])
+            is_write = rng.random() < args["write_ratio"]
+            try:
+                if is_async:
+                    await run_command_async(
+                        sessionmaker_, queue_id, player_id, is_write
+                    )
+                else:
+                    run_command_sync(sessionmaker_, queue_id, player_id, is_write)
+            except Exception:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    heartbeat_task = asyncio.create_task(heartbeat())
+    start = time.perf_counter()
+    await asyncio.gather(*[user(i) for i in range(args["users"])])
+    seconds = time.perf_counter() - start
+    done.set()
+    await heartbeat_task
+    if is_async:
+        await engine.dispose()
+    else:
+        engine.dispose()
+    return latencies, heartbeat_lateness, errors, seconds
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+async def run(args: dict[str, any]):
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "benchmark.db")
+        create_database(
+            path, args["players"], args["queues"], args["games"], args["seed"]
+        )
+        for is_async in (False, True):
+            latencies, lateness, errors, seconds = await run_load(path, is_async, args)
+            rows.append(
+                [
+                    "async" if is_async else "sync",
+                    f"{len(latencies) / seconds:.0f}",
+                    f"{statistics.median(latencies) * 1000:.2f}",
+                    f"{percentile(latencies, 0.95) * 1000:.2f}",
+                    f"{percentile(latencies, 0.99) * 1000:.2f}",
+                    f"{percentile(lateness, 0.99) * 1000:.2f}",
+                    f"{max(lateness) * 1000:.2f}",
+                    str(errors),
+                ]
+            )
+    print(
+        f"{args['users']} users, {args['commands']} commands each, {args['games']} finished games"
+    )
+    print(
+        table2ascii(
+            header=[
+                "session",
+                "commands/s",
+                "p50 ms",
+                "p95 ms",
+                "p99 ms",
+                "p99 loop lag ms",
+                "max loop lag ms",
+                "errors",
+            ],
+            body=rows,
+            style=PresetStyle.plain,
+            alignments=Alignment.LEFT,
+        )
+    )
+
+
+def main():
+    asyncio.run(run(parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from table2ascii import Alignment, PresetStyle, table2ascii
+
+from discord_bots.models import (
+    AsyncSessionLocal,
+    Player,
+    Queue,
+    QueuePlayer,
+    Session,
+    mapper_registry,
+    set_sqlite_pragmas,
+)
+
+"""
+Measures command latency against a scratch SQLite database under concurrent
+load, with SQLite's default settings and with the PRAGMAs models.py sets
+(SQLITE_* in .env). Each worker thread runs commands back to back: most read
+a queue's players like /status, the rest add or remove a queue player and
+commit like /add and /del.
+
+Also times opening and closing the two sessions before_invoke used to open
+for every prefix command, which are now only opened when a command uses them.
+"""
+
+
+def parse_args() -> dict[str, any]:
+    parser = argparse.ArgumentParser(
+        description="Benchmark command latency with and without the SQLite profile",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--workers", type=int, nargs="*", default=[1, 8, 32])
+    parser.add_argument("--commands", type=int, default=200, help="Per worker")
+    parser.add_argument(
+        "--write-ratio", type=float, default=0.2, help="Ratio of commands that write"
+    )
+    parser.add_argument("--players", type=int, default=500)
+    parser.add_argument("--queues", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+    return vars(arguments)
+
+
+def create_database(path: str, players: int, queues: int, tuned: bool) -> sessionmaker:
+    engine = create_engine(f"sqlite:///{path}", connect_args={"timeout": 15})
+    if tuned:
+        event.listen(engine, "connect", set_sqlite_pragmas)
+    mapper_registry.metadata.create_all(engine)
+    sessionmaker_ = sessionmaker(bind=engine)
+    with sessionmaker_() as session:
+        session.add_all(
+            [
+                Player(id=player_id, name=f"player{player_id}")
+                for player_id in range(players)
+            ]
+        )
+        session.add_all(
+            [Queue(name=f"queue{i}", size=10, ordinal=i) for i in range(queues)]
+        )
+        session.commit()
+    return sessionmaker_
+
+
+def run_command(
+    sessionmaker_: sessionmaker,
+    rng: random.Random,
+    queue_ids: list[str],
+    players: int,
+    write_ratio: float,
+):
+    with sessionmaker_() as session:
+        queue_id = rng.choice(queue_ids)
+        if rng.random() >= write_ratio:
+            session.query(Player.name).join(QueuePlayer).filter(
+                QueuePlayer.queue_id == queue_id
+            ).order_by(QueuePlayer.added_at).all()
+            return
+        player_id = rng.randrange(players)
+        deleted = (
+            session.query(QueuePlayer)
+            .filter(
+                QueuePlayer.queue_id == queue_id, QueuePlayer.player_id == player_id
+            )
+            .delete()
+        )
+        if not deleted:
+            session.add(
+                QueuePlayer(
+                    queue_id=queue_id,
+                    player_id=player_id,
+                    channel_id=0,
+                    added_at=datetime.now(timezone.utc).replace(tzinfo=None),
+                )
+            )
+        session.commit()
+
+
+def run_load(
+    sessionmaker_: sessionmaker,
+    workers: int,
+    commands: int,
+    players: int,
+    write_ratio: float,
+    seed: int,
+) -> tuple[list[float], int, float]:
+    """
+    :returns: Every command's latency in seconds, the number of commands that
+    failed, and the wall time
+    """
+    with sessionmaker_() as session:
+        queue_ids = [queue_id for (queue_id,) in session.query(Queue.id)]
+    latencies: list[float] = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def worker(worker_index: int):
+        rng = random.Random(seed * 1000 + worker_index)
+        for _ in range(commands):
+            start = time.perf_counter()
+            try:
+                run_command(sessionmaker_, rng, queue_ids, players, write_ratio)
+            except Exception:
+                with lock:
+                    errors[0] += 1
+                continue
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(workers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0], time.perf_counter() - start
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+def time_session_setup(iterations: int = 2000) -> float:
+    """
+    :returns: Seconds per open and close of the two sessions before_invoke
+    used to open for every prefix command
+    """
+    start = time.perf_counter()
+    for _ in range(iterations):
+        session = Session()
+        async_session = AsyncSessionLocal()
+        session.close()
+        # Nothing to close on a session that never connected
+        del async_session
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    args = parse_args()
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        for tuned in (False, True):
+            profile = "tuned" if tuned else "default"
+            sessionmaker_ = create_database(
+                os.path.join(directory, f"{profile}.db"),
+                args["players"],
+                args["queues"],
+                tuned,
+            )
+            for workers in args["workers"]:
+                latencies, errors, seconds = run_load(
+                    sessionmaker_,
+                    workers,
+                    args["commands"],
+                    args["players"],
+                    args["write_ratio"],
+                    args["seed"],
+                )
+                rows.append(
+                    [
+                        profile,
+                        str(workers),
+                        f"{len(latencies) / seconds:.0f}",
+                        f"{statistics.median(latencies) * 1000:.2f}",
+                        f"{percentile(latencies, 0.95) * 1000:.2f}",
+                        f"{percentile(latencies, 0.99) * 1000:.2f}",
+                        f"{max(latencies) * 1000:.2f}",
+                        str(errors),
+                    ]
+                )
+            sessionmaker_.kw["bind"].dispose()
+    print(
+        table2ascii(
+            header=[
+                "profile",
+                "workers",
+                "commands/s",
+                "p50 ms",
+                "p95 ms",
+                "p99 ms",
+                "max ms",
+                "errors",
+            ],
+            body=rows,
+            style=PresetStyle.plain,
+            alignments=Alignment.LEFT,
+        )
+    )
+    print(
+        f"Opening both sessions for a command that doesn't use them: {time_session_setup() * 1e6:.1f} us"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from collections import defaultdict
+from functools import partial
+from types import SimpleNamespace
+
+import discord
+from table2ascii import Alignment, PresetStyle, table2ascii
+
+from discord_bots.dispatcher import (
+    Dispatcher,
+    Priority,
+    channel_route,
+    dm_route,
+    voice_move_route,
+)
+
+"""
+Sends a burst of traffic like a busy moment on the bot to a fake Discord,
+first the way the bot used to (every request at once, retrying 429s like
+discord.py does), then through the dispatcher, and compares how long the
+players of a game that pops in the middle of it wait to be told, along with
+how many requests and 429s it took.
+
+The burst is --chatter messages spread over a few channels, --edit-rounds
+edits of each of --games prediction embeds, and then after --pop-delay-ms a
+queue pop: a DM and a voice move for each of --players players, the match
+channel message and the pop message. "pop messages ms" is how long players
+waited to be told about the game, "voice moves ms" how long for the moves.
+
+The fake Discord answers after --latency-ms, and allows --route-limit
+requests per route and --global-limit requests overall every --window
+seconds. Past that it answers 429 with how long until the window resets.
+Discord's real limits are per 5 seconds and looser overall, --window
+scales them down so the benchmark runs quickly.
+"""
+
+
+def parse_args() -> dict[str, any]:
+    parser = argparse.ArgumentParser(
+        description="Benchmark sending a burst of requests to a fake Discord",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--chatter", type=int, default=60)
+    parser.add_argument("--channels", type=int, default=3)
+    parser.add_argument("--games", type=int, default=4)
+    parser.add_argument("--edit-rounds", type=int, default=10)
+    parser.add_argument("--players", type=int, default=24)
+    parser.add_argument("--pop-delay-ms", type=float, default=50)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--route-limit", type=int, default=5)
+    parser.add_argument("--global-limit", type=int, default=50)
+    parser.add_argument("--window", type=float, default=1.0)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--route-concurrency", type=int, default=4)
+    parser.add_argument("--max-retries", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+    return vars(arguments)
+
+
+class FakeDiscord:
+    def __init__(
+        self,
+        route_limit: int,
+        global_limit: int,
+        window: float,
+        latency_seconds: float,
+        rng: random.Random,
+    ):
+        self.route_limit = route_limit
+        self.global_limit = global_limit
+        self.window = window
+        self.latency_seconds = latency_seconds
+        self.rng = rng
+        # route -> [window reset at, requests left]
+        self.buckets: dict[str, list[float]] = defaultdict(lambda: [0.0, 0])
+        self.global_bucket = [0.0, 0]
+        self.requests = 0
+        self.rate_limited = 0
+
+    def _take(self, bucket: list[float], limit: int, now: float) -> float | None:
+        """
+        :returns: None if the bucket had room, otherwise seconds until it does
+        """
+        if now >= bucket[0]:
+            bucket[0], bucket[1] = now + self.window, limit
+        if bucket[1] <= 0:
+            return bucket[0] - now
+        bucket[1] -= 1
+        return None
+
+    async def request(self, route: str):
+        await asyncio.sleep(self.latency_seconds * self.rng.uniform(0.5, 1.5))
+        self.requests += 1
+        now = asyncio.get_running_loop().time()
+        retry_after = self._take(self.global_bucket, self.global_limit, now)
+        if retry_after is None:
+            retry_after = self._take(self.buckets[route], self.route_limit, now)
+        if retry_after is not None:
+            self.rate_limited += 1
+            response = SimpleNamespace(
+                status=429,
+                reason="Too Many Requests",
+                headers={"Retry-After": f"{retry_after:.3f}"},
+            )
+            raise discord.HTTPException(response, "You are being rate limited.")
+
+
+def burst(args: dict[str, any]) -> tuple[list, list, list]:
+    """
+    :returns: (route, Discord's bucket, priority, key) of each request sent
+    before the pop, of the messages telling players about the pop, and of
+    the voice moves
+    """
+    before = [
+        (
+            channel_route(i % args["channels"]),
+            channel_route(i % args["channels"]),
+            Priority.NORMAL,
+            None,
+        )
+        for i in range(args["chatter"])
+    ]
+    for _ in range(args["edit_rounds"]):
+        for game in range(args["games"]):
+            route = channel_route(1000 + game)
+            before.append((route, route, Priority.BACKGROUND, ("edit", game)))
+    # Every DM channel is its own bucket on Discord
+    notify = [
+        (dm_route(), f"dm:{player}", Priority.POP, None)
+        for player in range(args["players"])
+    ]
+    notify += [
+        (channel_route(route), channel_route(route), Priority.POP, None)
+        for route in (2000, 0)
+    ]
+    moves = [
+        (voice_move_route(0), voice_move_route(0), Priority.POP, None)
+        for _ in range(args["players"])
+    ]
+    return before, notify, moves
+
+
+async def send_unbounded(fake: FakeDiscord, route: str, max_retries: int):
+    # Like discord.py, which waits out a 429 and tries again
+    for attempt in range(max_retries + 1):
+        try:
+            return await fake.request(route)
+        except discord.HTTPException as e:
+            if attempt == max_retries:
+                raise
+            await asyncio.sleep(float(e.response.headers["Retry-After"]))
+
+
+async def run(args: dict[str, any], use_dispatcher: bool) -> list[str]:
+    fake = FakeDiscord(
+        args["route_limit"],
+        args["global_limit"],
+        args["window"],
+        args["latency_ms"] / 1000,
+        random.Random(args["seed"]),
+    )
+    dispatcher = Dispatcher(
+        args["concurrency"],
+        args["route_concurrency"],
+        args["max_retries"],
+        backoff_seconds=0.05,
+    )
+    before, notify, moves = burst(args)
+    latencies: list[float] = []
+
+    async def send(route: str, bucket: str, priority: Priority, key) -> bool:
+        submitted_at = time.perf_counter()
+        try:
+            if use_dispatcher:
+                await dispatcher.submit(
+                    route, partial(fake.request, bucket), priority, key
+                )
+            else:
+                await send_unbounded(fake, bucket, args["max_retries"])
+        except discord.HTTPException:
+            return False
+        latencies.append(time.perf_counter() - submitted_at)
+        return True
+
+    async def timed(requests: list) -> tuple[list[bool], float]:
+        started_at = time.perf_counter()
+        results = await asyncio.gather(*[send(*request) for request in requests])
+        return results, time.perf_counter() - started_at
+
+    start = time.perf_counter()
+    before_tasks = [asyncio.create_task(send(*request)) for request in before]
+    await asyncio.sleep(args["pop_delay_ms"] / 1000)
+    (notify_results, notify_seconds), (move_results, move_seconds) = (
+        await asyncio.gather(timed(notify), timed(moves))
+    )
+    before_results = await asyncio.gather(*before_tasks)
+    seconds = time.perf_counter() - start
+    failed = sum(
+        not result for result in (*before_results, *notify_results, *move_results)
+    )
+    return [
+        "dispatcher" if use_dispatcher else "unbounded",
+        f"{notify_seconds * 1000:.0f}",
+        f"{move_seconds * 1000:.0f}",
+        f"{statistics.median(latencies) * 1000:.0f}",
+        f"{seconds * 1000:.0f}",
+        str(fake.requests),
+        str(fake.rate_limited),
+        str(dispatcher.metrics.coalesced),
+        str(failed),
+    ]
+
+
+async def main_async(args: dict[str, any]):
+    rows = [await run(args, use_dispatcher) for use_dispatcher in (False, True)]
+    before, notify, moves = burst(args)
+    print(
+        f"{len(before)} requests, then a pop of {len(notify)} messages and {len(moves)} voice moves"
+    )
+    print(
+        table2ascii(
+            header=[
+                "sender",
+                "pop messages ms",
+                "voice moves ms",
+                "p50 ms",
+                "all done ms",
+                "requests",
+                "429s",
+                "coalesced",
+                "failed",
+            ],
+            body=rows,
+            style=PresetStyle.plain,
+            alignments=Alignment.LEFT,
+        )
+    )
+
+
+def main():
+    asyncio.run(main_async(parse_args()))
+
+
+if __name__ == "__main__":
+    main()
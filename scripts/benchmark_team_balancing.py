@@ -0,0 +1,137 @@
+import argparse
+import random
+import time
+from itertools import combinations, product
+
+from table2ascii import Alignment, PresetStyle, table2ascii
+from trueskill import Rating
+
+from discord_bots.matchmaking import TeamBalancer
+from discord_bots.utils import win_probability_matchmaking
+
+"""
+Compares the team balancer search against the original
+one-combination-at-a-time loop from get_even_teams, for random players.
+The search should always find teams at least as even as the old loop.
+"""
+
+
+def parse_args() -> dict[str, any]:
+    parser = argparse.ArgumentParser(
+        description="Benchmark team balancing for team sizes 2 through --max-team-size",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--min-team-size", type=int, default=2)
+    parser.add_argument("--max-team-size", type=int, default=12)
+    parser.add_argument(
+        "--max-legacy-team-size",
+        type=int,
+        default=10,
+        help="The old loop is only run up to this team size, it takes minutes for 12v12",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+    return vars(arguments)
+
+
+def random_ratings(rng: random.Random, count: int) -> list[Rating]:
+    return [Rating(rng.gauss(25, 6), rng.uniform(1, 8.333)) for _ in range(count)]
+
+
+def stacked_ratings(rng: random.Random, count: int) -> list[Rating]:
+    """
+    One player far above everyone else, so no split is ever good enough and
+    every combination has to be scored
+    """
+    ratings = random_ratings(rng, count - 1)
+    ratings.insert(rng.randrange(count), Rating(25 + 15 * count // 2, 1))
+    return ratings
+
+
+def legacy_even_teams(ratings: list[Rating], team_size: int) -> tuple[list[int], float]:
+    """
+    The loop get_even_teams used before the balancer, working on indexes
+    """
+    players = list(range(len(ratings)))
+    best_win_prob_so_far: float = 0.0
+    best_teams_so_far: list[int] = []
+    for team0 in combinations(players, team_size):
+        team1 = [p for p in players if p not in team0]
+        team0_ratings = [ratings[p] for p in team0]
+        team1_ratings = [ratings[p] for p in team1]
+        win_prob = win_probability_matchmaking(team0_ratings, team1_ratings)
+        current_team_evenness = abs(0.50 - win_prob)
+        best_team_evenness_so_far = abs(0.50 - best_win_prob_so_far)
+        if current_team_evenness < best_team_evenness_so_far:
+            best_win_prob_so_far = win_prob
+            best_teams_so_far = list(team0[:]) + list(team1[:])
+        if best_team_evenness_so_far < 0.001:
+            break
+    return best_teams_so_far, best_win_prob_so_far
+
+
+def balancer_even_teams(
+    ratings: list[Rating], team_size: int
+) -> tuple[list[int], float]:
+    balancer = TeamBalancer([r.mu for r in ratings], [r.sigma for r in ratings])
+    split = balancer.search_split([(range(len(ratings)), team_size)])
+    return list(split.team0) + list(split.team1), split.win_probability
+
+
+def main():
+    args = parse_args()
+    rng = random.Random(args["seed"])
+    rows = []
+    for team_size, (scenario, make_ratings) in product(
+        range(args["min_team_size"], args["max_team_size"] + 1),
+        [("random", random_ratings), ("stacked", stacked_ratings)],
+    ):
+        ratings = make_ratings(rng, 2 * team_size)
+
+        start = time.perf_counter()
+        _, win_prob = balancer_even_teams(ratings, team_size)
+        balancer_seconds = time.perf_counter() - start
+
+        if team_size > args["max_legacy_team_size"]:
+            legacy_columns = ["-", "-", "-"]
+        else:
+            start = time.perf_counter()
+            _, legacy_win_prob = legacy_even_teams(ratings, team_size)
+            legacy_seconds = time.perf_counter() - start
+            legacy_columns = [
+                f"{legacy_seconds * 1000:.2f}",
+                f"{legacy_seconds / balancer_seconds:.1f}x",
+                f"{abs(0.50 - legacy_win_prob):.5f}",
+            ]
+
+        rows.append(
+            [
+                f"{team_size}v{team_size}",
+                scenario,
+                f"{balancer_seconds * 1000:.2f}",
+                legacy_columns[0],
+                legacy_columns[1],
+                f"{abs(0.50 - win_prob):.5f}",
+                legacy_columns[2],
+            ]
+        )
+    print(
+        table2ascii(
+            header=[
+                "teams",
+                "players",
+                "balancer ms",
+                "legacy ms",
+                "speedup",
+                "balancer evenness",
+                "legacy evenness",
+            ],
+            body=rows,
+            style=PresetStyle.plain,
+            alignments=Alignment.LEFT,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import argparse
+import random
+import time
+
+import numpy as np
+import trueskill
+from table2ascii import Alignment, PresetStyle, table2ascii
+
+from discord_bots.trueskill_replay import Replay, ReplayParams
+
+"""
+Compares the TrueSkill replay used by soft_reset and backtest_win_accuracy
+against rating the same random games one at a time with trueskill.rate, the
+way soft_reset used to. Both should end with the same ratings, up to
+trueskill's own approximation of the normal distribution.
+"""
+
+
+def parse_args() -> dict[str, any]:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the TrueSkill replay against trueskill.rate",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--games", type=int, default=5000)
+    parser.add_argument("--players", type=int, default=300)
+    parser.add_argument("--team-sizes", type=int, nargs="*", default=[4, 5, 7])
+    parser.add_argument("--tie-ratio", type=float, default=0.05)
+    parser.add_argument("--unrated-ratio", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+    return vars(arguments)
+
+
+def random_history(
+    rng: random.Random,
+    games: int,
+    players: int,
+    team_sizes: list[int],
+    tie_ratio: float,
+    unrated_ratio: float,
+) -> tuple[list[int], list[int], list[int], list[int], list[bool]]:
+    """
+    :returns: player_ids, teams, offsets, winning_team and is_rated, in the
+    same layout as GameHistory
+    """
+    player_ids: list[int] = []
+    teams: list[int] = []
+    offsets: list[int] = []
+    winning_team: list[int] = []
+    is_rated: list[bool] = []
+    for _ in range(games):
+        team_size = rng.choice(team_sizes)
+        offsets.append(len(player_ids))
+        player_ids.extend(rng.sample(range(players), 2 * team_size))
+        teams.extend([0] * team_size + [1] * team_size)
+        winning_team.append(-1 if rng.random() < tie_ratio else rng.randrange(2))
+        is_rated.append(rng.random() >= unrated_ratio)
+    offsets.append(len(player_ids))
+    return player_ids, teams, offsets, winning_team, is_rated
+
+
+def rate_one_at_a_time(
+    env: trueskill.TrueSkill,
+    player_ids: list[int],
+    teams: list[int],
+    offsets: list[int],
+    winning_team: list[int],
+    is_rated: list[bool],
+) -> dict[int, trueskill.Rating]:
+    ratings: dict[int, trueskill.Rating] = {}
+    for i in range(len(winning_team)):
+        players = range(offsets[i], offsets[i + 1])
+        team0 = [player_ids[j] for j in players if teams[j] == 0]
+        team1 = [player_ids[j] for j in players if teams[j] == 1]
+        ranks = [0, 1] if winning_team[i] == 0 else [1, 0]
+        if winning_team[i] == -1:
+            ranks = [0, 0]
+        team0_after, team1_after = env.rate(
+            [
+                [ratings.get(p, env.create_rating()) for p in team0],
+                [ratings.get(p, env.create_rating()) for p in team1],
+            ],
+            ranks,
+        )
+        if is_rated[i]:
+            ratings.update(zip(team0, team0_after))
+            ratings.update(zip(team1, team1_after))
+    return ratings
+
+
+def main():
+    args = parse_args()
+    rng = random.Random(args["seed"])
+    history = random_history(
+        rng,
+        args["games"],
+        args["players"],
+        args["team_sizes"],
+        args["tie_ratio"],
+        args["unrated_ratio"],
+    )
+
+    start = time.perf_counter()
+    replay = Replay(*(np.array(column) for column in history))
+    prepare_seconds = time.perf_counter() - start
+
+    rows = []
+    for env in [
+        trueskill.TrueSkill(),
+        trueskill.TrueSkill(tau=0.3),
+        trueskill.TrueSkill(beta=2),
+        trueskill.TrueSkill(mu=1000, sigma=400, beta=200, tau=4, draw_probability=0.02),
+    ]:
+        start = time.perf_counter()
+        result = replay.run(ReplayParams.from_env(env))
+        replay_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        expected = rate_one_at_a_time(env, *history)
+        rate_seconds = time.perf_counter() - start
+
+        ratings = result.ratings()
+        rows.append(
+            [
+                f"{env.mu:g}/{env.sigma:g}/{env.beta:g}/{env.tau:g}/{env.draw_probability:g}",
+                f"{replay_seconds * 1000:.1f}",
+                f"{rate_seconds * 1000:.1f}",
+                f"{rate_seconds / replay_seconds:.1f}x",
+                f"{max(abs(ratings[p][0] - r.mu) for p, r in expected.items()):.2e}",
+                f"{max(abs(ratings[p][1] - r.sigma) for p, r in expected.items()):.2e}",
+            ]
+        )
+    print(
+        f"{len(replay)} games, {len(replay.player_ids)} players, prepared in {prepare_seconds * 1000:.1f} ms"
+    )
+    print(
+        table2ascii(
+            header=[
+                "mu/sigma/beta/tau/draw",
+                "replay ms",
+                "trueskill.rate ms",
+                "speedup",
+                "max mu diff",
+                "max sigma diff",
+            ],
+            body=rows,
+            style=PresetStyle.plain,
+            alignments=Alignment.LEFT,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,9 @@
-from collections import defaultdict
-from typing import List
 import datetime
+from collections import defaultdict
+
 import pytz
 
+from discord_bots.game_history import load as load_game_history
 from discord_bots.models import FinishedGame, FinishedGamePlayer, Player, Session
 
 """
@@ -68,17 +69,13 @@ eligible_player_ids = [
 def main():
     session = Session()
 
-    finished_games: List[FinishedGame] = list(
-        session.query(FinishedGame)
-        .filter(FinishedGame.started_at >= cutoff_ts)
-        .order_by(FinishedGame.started_at.asc())
-    )
-    finished_game_ids = map(lambda x: x.id, finished_games)
+    game_history = load_game_history(session, FinishedGame.started_at >= cutoff_ts)
+    finished_game_ids = game_history.ids
 
     # Dump the number of games per day
     date_buckets = defaultdict(int)
-    for finished_game in finished_games:
-        date = finished_game.started_at.astimezone(pytz.timezone('America/Los_Angeles'))
+    for started_at in sorted(game_history.started_at.astype(object)):
+        date = started_at.astimezone(pytz.timezone("America/Los_Angeles"))
         bucket = datetime.datetime(*date.timetuple()[:3])
         date_buckets[bucket] += 1
     for k, v in date_buckets.items():
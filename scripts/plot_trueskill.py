@@ -3,9 +3,11 @@ from collections import defaultdict
 from datetime import timedelta
 
 import matplotlib.pyplot as plt
+import numpy as np
 from scipy.interpolate import interp1d
 
-from discord_bots.models import FinishedGame, FinishedGamePlayer, Player, Session
+from discord_bots.game_history import load as load_game_history
+from discord_bots.models import Player, Session
 
 cnames = {
     "aliceblue": "#F0F8FF",
@@ -152,16 +154,11 @@ cnames = {
 cname_keys = list(cnames.keys())
 
 session = Session()
-oldest_game: FinishedGame = (
-    session.query(FinishedGame).order_by(FinishedGame.finished_at).first()
-)
-newest_game: FinishedGame = (
-    session.query(FinishedGame)
-    .order_by(FinishedGame.finished_at.desc())  # type: ignore
-    .first()
-)
+game_history = load_game_history(session)
+oldest_game_finished_at = game_history.finished_at[0].astype(object)
+newest_game_finished_at = game_history.finished_at[-1].astype(object)
 
-duration_days = (newest_game.finished_at - oldest_game.finished_at).days
+duration_days = (newest_game_finished_at - oldest_game_finished_at).days
 print(duration_days)
 
 # x_axis = [i for i in range(duration_days)]
@@ -174,36 +171,41 @@ for player in players:
     sigma_y_axes[player.id].append(0)
     mu_y_axes[player.id].append(0)
 
-current_date = oldest_game.finished_at
-end_date = newest_game.finished_at
-# end_date = oldest_game.finished_at + timedelta(days=30)
+current_date = oldest_game_finished_at
+end_date = newest_game_finished_at
+# end_date = oldest_game_finished_at + timedelta(days=30)
 
+# The finished_at of every player row, to find each window's rows
+player_finished_at = np.repeat(game_history.finished_at, np.diff(game_history.offsets))
 while current_date < end_date:
     x_axis.append(x_axis[-1] + 1)
     window_start = current_date
     window_end = current_date + timedelta(days=1)
-    for player in players:
-        last_game_of_day: FinishedGamePlayer = (
-            session.query(FinishedGamePlayer)
-            .join(FinishedGame)
-            .filter(
-                FinishedGamePlayer.player_id == player.id,
-                FinishedGame.finished_at > window_start,
-                FinishedGame.finished_at <= window_end,
-            )
-            .order_by(FinishedGame.finished_at.desc())  # type: ignore
-            .first()
+    window = slice(
+        np.searchsorted(player_finished_at, np.datetime64(window_start), "right"),
+        np.searchsorted(player_finished_at, np.datetime64(window_end), "right"),
+    )
+    # Rows are in finished_at order, so the last row of a player in the window
+    # is their last game of the day
+    last_game_of_day = {
+        player_id: (mu, sigma)
+        for player_id, mu, sigma in zip(
+            game_history.player_ids[window].tolist(),
+            game_history.mu_after[window].tolist(),
+            game_history.sigma_after[window].tolist(),
         )
-        # print(last_game_of_day)
-        if last_game_of_day:
-            mu_y_axes[player.id].append(last_game_of_day.rated_trueskill_mu_after)
-            sigma_y_axes[player.id].append(last_game_of_day.rated_trueskill_sigma_after)
+    }
+    for player in players:
+        if player.id in last_game_of_day:
+            mu, sigma = last_game_of_day[player.id]
+            mu_y_axes[player.id].append(mu)
+            sigma_y_axes[player.id].append(sigma)
         else:
             mu_y_axes[player.id].append(mu_y_axes[player.id][-1])
             sigma_y_axes[player.id].append(sigma_y_axes[player.id][-1])
 
     current_date += timedelta(days=2)
-    print(current_date, newest_game.finished_at)
+    print(current_date, newest_game_finished_at)
 
 
 highest_rated_players = (
@@ -1,55 +1,43 @@
-from discord_bots.models import FinishedGame, FinishedGamePlayer, Player, Session
+from discord_bots.game_history import load as load_game_history
+from discord_bots.models import Player, Session
 
 session = Session()
 
-finished_games: list[FinishedGame] = (
-    session.query(FinishedGame)
-    .order_by(FinishedGame.finished_at.desc())
-    .limit(200)
-    .all()
+game_history = load_game_history(session, descending=True, limit=200)
+player_names: dict[int, str] = dict(
+    session.query(Player.id, Player.name).filter(
+        Player.id.in_(set(game_history.player_ids.tolist()))
+    )
 )
 
 print(
     "timestamp,winning_team,team0_win%,team1_win%,is_upset,t0player0,t0player1,t0player2,t0player3,t0player4,t1player0,t1player1,t1player2,t1player3,t1player4"
 )
 
-for finished_game in finished_games:
+for i in range(len(game_history)):
     winning_team = ""
-    if finished_game.winning_team == -1:
+    if game_history.winning_team[i] == -1:
         winning_team = "tie"
-    elif finished_game.winning_team == 0:
+    elif game_history.winning_team[i] == 0:
         winning_team = "be"
-    elif finished_game.winning_team == 1:
+    elif game_history.winning_team[i] == 1:
         winning_team = "ds"
-    team0_players: list[Player] = (
-        session.query(Player)
-        .join(
-            FinishedGamePlayer,
-            Player.id == FinishedGamePlayer.player_id,
-        )
-        .filter(
-            FinishedGamePlayer.finished_game_id == finished_game.id,
-            FinishedGamePlayer.team == 0,
-        )
+    players = game_history.players(i)
+    player_ids = game_history.player_ids[players]
+    teams = game_history.teams[players]
+    team0_names: str = ",".join(
+        [player_names[player_id] for player_id in player_ids[teams == 0].tolist()]
     )
-    team1_players: list[Player] = (
-        session.query(Player)
-        .join(
-            FinishedGamePlayer,
-            Player.id == FinishedGamePlayer.player_id,
-        )
-        .filter(
-            FinishedGamePlayer.finished_game_id == finished_game.id,
-            FinishedGamePlayer.team == 1,
-        )
+    team1_names: str = ",".join(
+        [player_names[player_id] for player_id in player_ids[teams == 1].tolist()]
     )
-    team0_names: str = ",".join([player.name for player in team0_players])
-    team1_names: str = ",".join([player.name for player in team1_players])
+    win_probability = game_history.win_probability[i]
     is_upset = False
-    if finished_game.win_probability > 0.5 and finished_game.winning_team == 1:
+    if win_probability > 0.5 and game_history.winning_team[i] == 1:
         is_upset = True
-    if finished_game.win_probability < 0.5 and finished_game.winning_team == 0:
+    if win_probability < 0.5 and game_history.winning_team[i] == 0:
         is_upset = True
+    finished_at = game_history.finished_at[i].astype(object)
     print(
-        f"{finished_game.finished_at},{winning_team},{round(finished_game.win_probability,2)},{round(1-finished_game.win_probability,2)},{is_upset},{team0_names},{team1_names}"
+        f"{finished_at},{winning_team},{round(win_probability,2)},{round(1-win_probability,2)},{is_upset},{team0_names},{team1_names}"
     )
@@ -0,0 +1,136 @@
+import argparse
+import asyncio
+import os
+import re
+import subprocess
+import sys
+import time
+
+from table2ascii import Alignment, PresetStyle, table2ascii
+
+"""
+Profiles how long the bot takes to start, without connecting to Discord.
+
+Imports discord_bots.main in a fresh interpreter with -X importtime and lists
+the modules that took longest to import, including everything they imported.
+The best of --runs is compared against --budget, and the script exits with
+status 1 if it's over, so it can guard against a slow import sneaking back in.
+
+With --cogs, also loads every cog the way bot setup does, against the
+database in DATABASE_URI, and times each one. InProgressGameCommands' time
+includes restoring the views of the games in progress.
+"""
+
+# e.g. "import time:       626 |     796421 |   discord_bots.activity"
+_IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def parse_args() -> dict[str, any]:
+    parser = argparse.ArgumentParser(
+        description="Profile bot startup and check the import time against a budget",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=2.5,
+        help="Most seconds importing discord_bots.main may take",
+    )
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=20, help="Slowest modules to list")
+    parser.add_argument(
+        "--cogs", action="store_true", help="Also time loading every cog"
+    )
+    arguments = parser.parse_args()
+    return vars(arguments)
+
+
+def profile_imports() -> dict[str, tuple[int, int, int]]:
+    """
+    :returns: The self and cumulative import time in microseconds and the
+    nesting depth of every module discord_bots.main imports, by name
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import discord_bots.main"],
+        capture_output=True,
+        text=True,
+        env=os.environ,
+    )
+    if result.returncode != 0:
+        sys.exit(f"Importing discord_bots.main failed:\n{result.stderr}")
+    modules: dict[str, tuple[int, int, int]] = {}
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules[name] = (int(self_us), int(cumulative_us), len(indent) // 2)
+    return modules
+
+
+async def profile_cogs() -> list[tuple[str, float]]:
+    """
+    :returns: The name of every cog and how many seconds it took to load
+    """
+    import discord_bots.main as main
+    from discord_bots.models import async_engine
+
+    timings = []
+    for cog in main.COGS:
+        start = time.perf_counter()
+        await main.bot.add_cog(cog(main.bot))
+        timings.append((cog.__name__, time.perf_counter() - start))
+    await async_engine.dispose()
+    return timings
+
+
+def main():
+    args = parse_args()
+    runs = [profile_imports() for _ in range(args["runs"])]
+    best = min(runs, key=lambda modules: modules["discord_bots.main"][1])
+    import_seconds = best["discord_bots.main"][1] / 1e6
+
+    slowest = sorted(
+        (name for name in best if name != "discord_bots.main"),
+        key=lambda name: best[name][1],
+        reverse=True,
+    )[: args["top"]]
+    print(
+        table2ascii(
+            header=["module", "depth", "self ms", "cumulative ms"],
+            body=[
+                [
+                    name,
+                    str(best[name][2]),
+                    f"{best[name][0] / 1000:.1f}",
+                    f"{best[name][1] / 1000:.1f}",
+                ]
+                for name in slowest
+            ],
+            style=PresetStyle.plain,
+            alignments=Alignment.LEFT,
+        )
+    )
+
+    if args["cogs"]:
+        timings = asyncio.run(profile_cogs())
+        print()
+        print(
+            table2ascii(
+                header=["cog", "load ms"],
+                body=[[name, f"{seconds * 1000:.1f}"] for name, seconds in timings],
+                style=PresetStyle.plain,
+                alignments=Alignment.LEFT,
+            )
+        )
+        print(f"All cogs: {sum(seconds for _, seconds in timings) * 1000:.1f} ms")
+
+    print(
+        f"Importing discord_bots.main took {import_seconds:.3f}s at best of {args['runs']}, budget {args['budget']:.3f}s"
+    )
+    if import_seconds > args["budget"]:
+        print("Over budget")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,17 +6,18 @@ from datetime import datetime
 from dateutil.parser import parse as parse_date
 from sqlalchemy import or_
 from table2ascii import Alignment, PresetStyle, table2ascii
-from trueskill import Rating, rate
-from typing_extensions import Literal
+from trueskill import Rating
 
+from discord_bots.game_history import GameHistory
+from discord_bots.game_history import load as load_game_history
 from discord_bots.models import (
     Category,
     FinishedGame,
-    FinishedGamePlayer,
     Player,
     PlayerCategoryTrueskill,
     Session,
 )
+from discord_bots.trueskill_replay import Replay, ReplayParams
 
 level = logging.INFO
 
@@ -37,19 +38,7 @@ def define_logger(name="app"):
 
 log = define_logger("soft_reset")
 
-OutcomeType = Literal["team1", "team2", "tie"]
 default_rating = Rating()
-DRAW = [0, 0]
-TEAM1_WIN = [0, 1]
-TEAM2_WIN = [1, 0]
-
-
-@dataclass
-class RawGame:
-    team1: list[int]
-    team2: list[int]
-    outcome: OutcomeType
-    rated: bool
 
 
 @dataclass
@@ -97,101 +86,15 @@ def parse_args() -> dict[str, any]:
     return vars(arguments)
 
 
-def map_raw_games(
-    game_history: list[FinishedGame], game_players: list[FinishedGamePlayer]
-) -> list[RawGame]:
-    output: list[RawGame] = []
-
-    log.info(f"Started mapping {len(game_history)} games")
-    for idx, game in enumerate(game_history):
-        players = list(
-            filter(lambda fgp: fgp.finished_game_id == game.id, game_players)
-        )
-        players_team1 = list(filter(lambda fgp: fgp.team == 0, players))
-        players_team2 = list(filter(lambda fgp: fgp.team == 1, players))
-        num_players_team1 = len(players_team1)
-        num_players_team2 = len(players_team2)
-        if num_players_team1 == 0:
-            log.warning(f"Ignoring game {game.game_id}. No players on team1")
-            continue
-        if num_players_team2 == 0:
-            log.warning(f"Ignoring game {game.game_id}. No players on team2")
-            continue
-        if num_players_team1 != num_players_team2:
-            log.warning(f"Ignoring game {game.game_id}. Player count not balanced.")
-            continue
-        # noinspection PyTypeChecker
-        outcome: OutcomeType = (
-            "team1"
-            if game.winning_team == 0
-            else ("team2" if game.winning_team == 1 else "tie")
-        )
-        output.append(
-            RawGame(
-                team1=list(map(lambda fgp: fgp.player_id, players_team1)),
-                team2=list(map(lambda fgp: fgp.player_id, players_team2)),
-                outcome=outcome,
-                rated=game.is_rated,
-            )
-        )
-        if idx % 1000 == 0 and idx > 0:
-            log.info(f"Mapped {idx}/{len(game_history)} games")
-
-    log.info(f"Finished mapping {len(game_history)} games")
-    return output
-
-
-def rate_games(games: list[RawGame]) -> dict[int, PlayerRating]:
-    def get_player_or_default(
-        players: dict[int, PlayerRating], player_id: int
-    ) -> PlayerRating:
-        player = players.get(player_id)
-        if player is None:
-            player = PlayerRating(
-                id=player_id,
-                mu=default_rating.mu,
-                sigma=default_rating.sigma,
-            )
-            players.update({player_id: player})
-        return player
-
-    def player_to_rating(player: PlayerRating) -> Rating:
-        return Rating(
-            mu=player.mu,
-            sigma=player.sigma,
-        )
-
-    def update_ratings(
-        team: list[PlayerRating], new_ratings: list[Rating], rated: bool
-    ):
-        for update_idx, player in enumerate(team):
-            if rated:
-                player.mu = new_ratings[update_idx].mu
-                player.sigma = new_ratings[update_idx].sigma
-
-    result: dict[int, PlayerRating] = {}
-    log.info(f"Started rating {len(games)} games")
-    for idx, game in enumerate(games):
-        team1 = list(map(lambda i: get_player_or_default(result, i), game.team1))
-        team2 = list(map(lambda i: get_player_or_default(result, i), game.team2))
-        team1_ratings_before = list(map(lambda p: player_to_rating(p), team1))
-        team2_ratings_before = list(map(lambda p: player_to_rating(p), team2))
-        game_result = (
-            TEAM1_WIN
-            if game.outcome == "team1"
-            else (TEAM2_WIN if game.outcome == "team2" else DRAW)
-        )
-        team1_ratings_after, team2_ratings_after = rate(
-            [team1_ratings_before, team2_ratings_before], game_result
-        )
-        update_ratings(team1, team1_ratings_after, game.rated)
-        update_ratings(team2, team2_ratings_after, game.rated)
-
-        if idx % 1000 == 0 and idx > 0:
-            log.info(f"Rated {idx}/{len(games)} games")
-
-    log.info(f"Finished rating {len(games)} games")
-    return result
+def rate_games(game_history: GameHistory) -> dict[int, PlayerRating]:
+    log.info(f"Started rating {len(game_history)} games")
+    replay = Replay.from_history(game_history)
+    result = replay.run(ReplayParams.from_env())
+    log.info(f"Finished rating {len(replay)} games")
+    return {
+        player_id: PlayerRating(id=player_id, mu=mu, sigma=sigma)
+        for player_id, (mu, sigma) in result.ratings().items()
+    }
 
 
 def map_ratings_to_entities(
@@ -235,6 +138,8 @@ def map_ratings_to_entities(
             new_pct = PlayerCategoryTrueskill(
                 player_id=rating.id,
                 category_id=target_category_id,
+                map_id=None,
+                position_id=None,
                 mu=rating.mu,
                 sigma=rating.sigma,
                 rank=rating.mu - (3 * rating.sigma),
@@ -246,6 +151,8 @@ def map_ratings_to_entities(
             new_pct = PlayerCategoryTrueskill(
                 player_id=player.id,
                 category_id=target_category_id,
+                map_id=None,
+                position_id=None,
                 mu=default_rating.mu,
                 sigma=default_rating.sigma,
                 rank=default_rating.mu - (3 * default_rating.sigma),
@@ -358,32 +265,17 @@ def do_soft_reset(
 
         log.info("Loading game history")
         # noinspection PyUnresolvedReferences
-        game_history: list[FinishedGame] = (
-            session.query(FinishedGame)
-            .filter(
-                or_(
-                    FinishedGame.queue_name.in_(src_queues),
-                    FinishedGame.category_name.in_(src_categories),
-                ),
-                FinishedGame.finished_at >= from_date,
-            )
-            .order_by(FinishedGame.finished_at.asc())
-            .all()
-        )
-        # noinspection PyUnresolvedReferences
-        game_players: list[FinishedGamePlayer] = (
-            session.query(FinishedGamePlayer)
-            .filter(
-                FinishedGamePlayer.finished_game_id.in_(
-                    list(map(lambda x: x.id, game_history))
-                )
-            )
-            .all()
+        game_history = load_game_history(
+            session,
+            or_(
+                FinishedGame.queue_name.in_(src_queues),
+                FinishedGame.category_name.in_(src_categories),
+            ),
+            FinishedGame.finished_at >= from_date,
         )
         log.info("Finished loading game history")
 
-        games = map_raw_games(game_history, game_players)
-        ratings = rate_games(games)
+        ratings = rate_games(game_history)
         new_rating_entries = map_ratings_to_entities(
             session, ratings, target_category.id
         )